@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class BahamConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'baham'
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from django.db.models.signals import post_migrate, post_save
+
+        from baham.backends import forget_unknown
+        from baham.sharding import remember_profile_shard, seed_id_ranges
+        post_save.connect(forget_unknown, sender=get_user_model(), dispatch_uid='baham_forget_unknown')
+        post_save.connect(remember_profile_shard, sender=self.get_model('UserProfile'),
+                          dispatch_uid='baham_remember_profile_shard')
+        post_migrate.connect(seed_id_ranges, sender=self, dispatch_uid='baham_seed_id_ranges')
@@ -0,0 +1,76 @@
+import hashlib
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db.models.functions import Lower
+
+# Functional indexes on auth_user matching the lookups below, created by migration 0016
+LOWER_USERNAME_INDEX = 'auth_user_username_lower_idx'
+LOWER_EMAIL_INDEX = 'auth_user_email_lower_idx'
+# Unknown identifiers are remembered briefly so repeated attempts skip the database. The 'logins' cache is
+# shared by every worker (see CACHES in settings), so creating a user anywhere clears them everywhere
+LOGIN_CACHE = 'logins'
+UNKNOWN_TIMEOUT = 60
+
+
+def _unknown_key(identifier):
+    return f'baham:auth:unknown:{hashlib.sha1(identifier.encode()).hexdigest()}'
+
+
+def lookup(identifier, field):
+    '''
+    Users whose username or email (field) equals identifier ignoring case, as a probe of the lower() index
+    '''
+    return get_user_model()._default_manager.alias(lowered=Lower(field)).filter(lowered=identifier.lower())
+
+
+def find_user(identifier):
+    '''
+    The user with this username or email, ignoring case, or None. Identifiers containing "@" are looked up
+    as emails first, others only as usernames, so a lookup is normally one index probe
+    '''
+    identifier = (identifier or '').strip().lower()
+    if not identifier or caches[LOGIN_CACHE].get(_unknown_key(identifier)):
+        return None
+    fields = ('email', 'username') if '@' in identifier else ('username',)
+    for field in fields:
+        user = lookup(identifier, field).order_by('pk').first()
+        if user:
+            return user
+    caches[LOGIN_CACHE].set(_unknown_key(identifier), True, UNKNOWN_TIMEOUT)
+    return None
+
+
+def forget_identifiers(identifiers):
+    '''
+    Stop treating these usernames or emails as unknown. Call it after creating users without post_save, as
+    bulk_create() does
+    '''
+    caches[LOGIN_CACHE].delete_many([_unknown_key(value.strip().lower()) for value in identifiers if value])
+
+
+def forget_unknown(sender, instance, **kwargs):
+    '''
+    post_save handler: a user created or renamed must not stay cached as unknown
+    '''
+    forget_identifiers([instance.username, instance.email])
+
+
+class UsernameOrEmailBackend(ModelBackend):
+    '''
+    Authenticate with a username or an email address, both case-insensitive
+    '''
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(get_user_model().USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        user = find_user(username)
+        if user is None:
+            # Hash anyway so unknown and known identifiers take the same time
+            get_user_model()().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
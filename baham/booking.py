@@ -0,0 +1,68 @@
+import random
+import time
+
+from django.db import router, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from baham.enum_types import VehicleStatus
+from baham.locking import retry_on_locked
+from baham.sharding import shard_for_pk, using_shard
+
+
+class SeatUnavailable(Exception):
+    '''
+    The vehicle is not taking companions or has no free seat
+    '''
+
+
+class BookingConflict(Exception):
+    '''
+    Concurrent bookings kept changing the vehicle until the retries ran out
+    '''
+
+
+def claim_seat(vehicle_id, version, updated_by=None):
+    '''
+    Take one seat of the vehicle if it is still at the version read and AVAILABLE, in a single UPDATE. The
+    vehicle turns FULL when that was its last free seat. Returns True if the seat was taken
+    '''
+    from baham.models import Vehicle, get_system_user
+    # Stamped like sync_status() does, so the change feed sees the seat counts and status change
+    return bool(Vehicle.objects.filter(pk=vehicle_id, version=version, status=VehicleStatus.AVAILABLE.name,
+                                       seats_free__gt=0).update(
+        seats_taken=F('seats_taken') + 1, seats_free=F('seats_free') - 1, version=F('version') + 1,
+        date_updated=timezone.now(), updated_by=updated_by or get_system_user(),
+        # The right-hand sides see the row as it was before the update
+        status=Case(When(seats_free__lte=1, then=Value(VehicleStatus.FULL.name)), default=F('status'))))
+
+
+@retry_on_locked
+def book_seat(vehicle_id, companion, expiry_date, effective_start_date=None, fuel_share=0, maintenance_share=0,
+              schedule=0, created_by=None, retries=5):
+    '''
+    Sign a contract for a seat of the vehicle without locking anything: read the vehicle, check it has a seat,
+    then compare-and-swap on its version. A lost race is retried up to `retries` times with a short random
+    back-off. Raises SeatUnavailable when the vehicle is full or not AVAILABLE, BookingConflict when the
+    retries run out, and Vehicle.DoesNotExist for an unknown vehicle
+    '''
+    from baham.models import Contract, Vehicle
+    # Vehicles and their contracts live in the same shard, see baham.sharding
+    with using_shard(shard_for_pk(vehicle_id)):
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(random.uniform(0, 0.005 * 2 ** attempt))
+            state = Vehicle.objects.filter(pk=vehicle_id).values('version', 'seats_free', 'status').first()
+            if state is None:
+                raise Vehicle.DoesNotExist(f'Vehicle {vehicle_id} does not exist')
+            if state['status'] != VehicleStatus.AVAILABLE.name or state['seats_free'] <= 0:
+                raise SeatUnavailable(f'Vehicle {vehicle_id} has no free seat')
+            with transaction.atomic(using=router.db_for_write(Vehicle)):
+                if not claim_seat(vehicle_id, state['version'], created_by):
+                    continue
+                contract = Contract(vehicle_id=vehicle_id, companion=companion, expiry_date=expiry_date,
+                                    effective_start_date=effective_start_date or timezone.localdate(),
+                                    fuel_share=fuel_share, maintenance_share=maintenance_share, schedule=schedule)
+                contract.save(created_by=created_by, seat_claimed=True)
+                return contract
+    raise BookingConflict(f'Vehicle {vehicle_id} kept changing, gave up after {retries} retries')
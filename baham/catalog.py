@@ -0,0 +1,78 @@
+import time
+
+from django.core.cache import caches
+
+# Cached catalog entries live under CATALOG_KEY_PREFIX:<version>:<name>. Bumping the version makes every
+# worker sharing the cache miss and rebuild, so entries never need a short TTL to stay fresh. The 'catalog'
+# cache is shared by every worker (see CACHES in settings)
+CATALOG_CACHE = 'catalog'
+CATALOG_KEY_PREFIX = 'baham:catalog'
+CATALOG_VERSION_KEY = f'{CATALOG_KEY_PREFIX}:version'
+CATALOG_TIMEOUT = 60 * 60 * 24
+
+
+def _new_version():
+    # Seeded from the clock so a version key lost to eviction never reuses an old version number
+    return int(time.time() * 1000)
+
+
+def get_catalog_version():
+    cache = caches[CATALOG_CACHE]
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, _new_version(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    '''
+    Invalidate every cached catalog entry. Called whenever a VehicleModel row changes
+    '''
+    cache = caches[CATALOG_CACHE]
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, _new_version(), timeout=None)
+
+
+def get_cached(name, build):
+    '''
+    Return the catalog entry called name for the current version, calling build() to fill it on a miss
+    '''
+    key = f'{CATALOG_KEY_PREFIX}:{get_catalog_version()}:{name}'
+    return caches[CATALOG_CACHE].get_or_set(key, build, CATALOG_TIMEOUT)
+
+
+async def aget_catalog_version():
+    cache = caches[CATALOG_CACHE]
+    version = await cache.aget(CATALOG_VERSION_KEY)
+    if version is None:
+        await cache.aadd(CATALOG_VERSION_KEY, _new_version(), timeout=None)
+        version = await cache.aget(CATALOG_VERSION_KEY)
+    return version
+
+
+async def aget_cached(name, build):
+    '''
+    Async version of get_cached(); build is a coroutine function
+    '''
+    key = f'{CATALOG_KEY_PREFIX}:{await aget_catalog_version()}:{name}'
+    cache = caches[CATALOG_CACHE]
+    value = await cache.aget(key)
+    if value is None:
+        value = await build()
+        await cache.aset(key, value, CATALOG_TIMEOUT)
+    return value
+
+
+def catalog_queryset():
+    from baham.models import VehicleModel
+    return VehicleModel.objects.order_by('vendor').values('uuid', 'vendor', 'model', 'type', 'capacity')
+
+
+def get_catalog():
+    '''
+    The non-voided vehicle models ordered by vendor, as a list of dicts
+    '''
+    return get_cached('all', lambda: list(catalog_queryset()))
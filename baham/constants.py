@@ -15,3 +15,8 @@ COLOURS = ['ALICEBLUE', 'ANTIQUEWHITE', 'AQUA', 'AQUAMARINE', 'AZURE', 'BEIGE',
 
 TOWNS = ['Bin Qasim', 'Gadap', 'Gulberg', 'Gulshan-e-Iqbal', 'Jamshed', 'Keamari', 'Korangi', 'Landhi', 'Liaquatabad',
            'Malir', 'New Karachi', 'North Nazimabad', 'Orangi', 'SITE', 'Saddar', 'Shah Faisal']
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Contract schedules are split into these daily time slots, as (start hour, end hour)
+SCHEDULE_SLOTS = [(6, 8), (8, 10), (10, 12), (12, 14), (14, 16), (16, 18), (18, 20), (20, 22)]
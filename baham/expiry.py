@@ -0,0 +1,47 @@
+from django.db import router, transaction
+from django.utils import timezone
+
+from baham.occupancy import refresh_seats, sync_status
+from baham.sharding import shards, using_shard
+
+
+def sweep_expired_contracts(today=None, batch_size=1000):
+    '''
+    Deactivate active contracts whose expiry date has passed and free their seats. Every town shard is swept
+    in turn. Returns the number of (contracts, vehicles) updated
+    '''
+    contracts = vehicles = 0
+    for alias in shards():
+        with using_shard(alias):
+            swept = _sweep(today or timezone.localdate(), batch_size)
+        contracts += swept[0]
+        vehicles += swept[1]
+    return contracts, vehicles
+
+
+def expired_contracts(today):
+    '''
+    Active contracts past their expiry date, however they got there: back-dated, imported or reactivated.
+    Swept contracts leave the partial index on expiry_date of active ones, so reading them is a range scan of
+    what is left to do and no watermark is needed
+    '''
+    from baham.models import Contract
+    return Contract.all_objects.filter(is_active=True, expiry_date__lt=today).order_by('expiry_date', 'pk')
+
+
+def _sweep(today, batch_size):
+    from baham.models import Contract, get_system_user
+    expired = expired_contracts(today)
+    system_user = get_system_user()
+    contracts = vehicles = 0
+    while True:
+        with transaction.atomic(using=router.db_for_write(Contract)):
+            batch = list(expired.values_list('pk', 'vehicle_id')[:batch_size])
+            if not batch:
+                break
+            contracts += Contract.all_objects.filter(pk__in=[pk for pk, _ in batch], is_active=True).update(
+                is_active=False, date_updated=timezone.now(), updated_by=system_user)
+            vehicle_ids = {vehicle_id for _, vehicle_id in batch}
+            refresh_seats(vehicle_ids)
+            vehicles += sync_status(vehicle_ids, system_user)
+    return contracts, vehicles
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = 'pictures'
+ALLOWED_EXTENSIONS = {'.jpg': '.jpg', '.jpeg': '.jpg', '.png': '.png', '.webp': '.webp', '.gif': '.gif'}
+# Longest side in pixels of each generated size
+VARIANT_SIZES = {'thumb': 320, 'large': 1280}
+VARIANT_FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}), 'jpeg': ('JPEG', {'quality': 82, 'optimize': True})}
+
+_executor = None
+
+
+def _media_path(name):
+    return Path(settings.MEDIA_ROOT) / name
+
+
+def _replace_atomically(directory, suffix, write, target):
+    '''
+    Write through write(file) into a temporary file next to target, then move it into place, so readers never
+    see a half-written file
+    '''
+    temp = tempfile.NamedTemporaryFile(dir=directory, suffix=suffix, delete=False)
+    try:
+        with temp:
+            write(temp)
+        os.replace(temp.name, target)
+    except BaseException:
+        os.remove(temp.name)
+        raise
+
+
+def store_upload(upload):
+    '''
+    Stream an uploaded picture to MEDIA_ROOT chunk by chunk, hashing it on the way, and file it under its
+    SHA-256 so a picture uploaded twice is stored once. Returns the name to assign to an ImageField
+    '''
+    extension = ALLOWED_EXTENSIONS.get(os.path.splitext(upload.name or '')[1].lower())
+    if not extension:
+        raise ValueError(f'Unsupported picture type: {upload.name}')
+    directory = _media_path(UPLOAD_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    temp = tempfile.NamedTemporaryFile(dir=directory, suffix='.part', delete=False)
+    try:
+        with temp:
+            for chunk in upload.chunks():
+                digest.update(chunk)
+                temp.write(chunk)
+        content_hash = digest.hexdigest()
+        name = f'{UPLOAD_DIR}/{content_hash[:2]}/{content_hash}{extension}'
+        target = _media_path(name)
+        target.parent.mkdir(exist_ok=True)
+        if target.exists():
+            os.remove(temp.name)
+        else:
+            os.replace(temp.name, target)
+    except BaseException:
+        if os.path.exists(temp.name):
+            os.remove(temp.name)
+        raise
+    return name
+
+
+def variant_name(name, size, image_format):
+    return f'{os.path.splitext(name)[0]}_{size}.{image_format}'
+
+
+def make_variants(name):
+    '''
+    Generate every size and format of the picture that does not exist yet. Returns the names written
+    '''
+    source = _media_path(name)
+    written = []
+    with Image.open(source) as image:
+        # Lets JPEG decode at a reduced scale when even the largest variant is much smaller than the original
+        image.draft('RGB', (max(VARIANT_SIZES.values()),) * 2)
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        for size, longest in VARIANT_SIZES.items():
+            resized = None
+            for image_format, (pil_format, options) in VARIANT_FORMATS.items():
+                target_name = variant_name(name, size, image_format)
+                target = _media_path(target_name)
+                if target.exists():
+                    continue
+                if resized is None:
+                    resized = image.copy()
+                    resized.thumbnail((longest, longest), Image.LANCZOS)
+                _replace_atomically(target.parent, '.part', lambda file: resized.save(file, pil_format, **options),
+                                    target)
+                written.append(target_name)
+    return written
+
+
+def _make_variants_logged(name):
+    try:
+        return make_variants(name)
+    except Exception:
+        logger.exception('Could not generate variants of %s', name)
+        raise
+
+
+def schedule_variants(name):
+    '''
+    Generate the variants of a stored picture on the background worker pool. Returns the future, or None
+    when there is no picture
+    '''
+    global _executor
+    if not name:
+        return None
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'IMAGE_WORKERS', 2),
+                                       thread_name_prefix='baham-images')
+    return _executor.submit(_make_variants_logged, name)
+
+
+def variant_urls(name):
+    '''
+    {size: {format: url}} of the variants of the picture generated so far
+    '''
+    urls = {}
+    if not name:
+        return urls
+    for size in VARIANT_SIZES:
+        for image_format in VARIANT_FORMATS:
+            target_name = variant_name(name, size, image_format)
+            if _media_path(target_name).exists():
+                urls.setdefault(size, {})[image_format] = default_storage.url(target_name)
+    return urls
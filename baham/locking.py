@@ -0,0 +1,40 @@
+import random
+import time
+from functools import wraps
+
+from django.db import OperationalError, connections
+
+LOCKED_MESSAGES = ('database is locked', 'database table is locked')
+
+
+def is_locked(error):
+    '''
+    Whether the error is SQLite giving up on a lock another connection holds
+    '''
+    return isinstance(error, OperationalError) and any(message in str(error) for message in LOCKED_MESSAGES)
+
+
+def in_transaction():
+    return any(connection.in_atomic_block for connection in connections.all(initialized_only=True))
+
+
+def retry_on_locked(func=None, *, attempts=5, delay=0.05):
+    '''
+    Decorator running func again when SQLite reports "database is locked", after a jittered back-off that
+    doubles from `delay` seconds, at most `attempts` times in all. Inside a transaction the error is raised
+    at once, since the transaction is broken and only whoever opened it can start it over. func must be safe
+    to repeat: a locked error means its failed statement wrote nothing
+    '''
+    if func is None:
+        return lambda func: retry_on_locked(func, attempts=attempts, delay=delay)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(1, attempts + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                if attempt == attempts or not is_locked(error) or in_transaction():
+                    raise
+            time.sleep(random.uniform(delay, 2 * delay) * 2 ** (attempt - 1))
+    return wrapper
@@ -0,0 +1,102 @@
+import asyncio
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ("Measure the throughput and latency of running servers under many concurrent keep-alive connections, "
+            "e.g. to compare the REST API under WSGI and ASGI:\n"
+            "  gunicorn dareecha.wsgi -w 4 --threads 8 -b 127.0.0.1:8001\n"
+            "  uvicorn dareecha.asgi:application --workers 4 --port 8002\n"
+            "  python manage.py bench_http http://127.0.0.1:8001/api/get/vehiclemodels "
+            "http://127.0.0.1:8002/api/get/vehiclemodels --concurrency 200")
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='URLs to benchmark one after the other')
+        parser.add_argument('--concurrency', type=int, default=100, help='Simultaneous connections')
+        parser.add_argument('--requests', type=int, default=5000, help='Requests per URL')
+        parser.add_argument('--header', action='append', default=[], help='Extra request header, "Name: value"')
+
+    def handle(self, *args, **options):
+        for url in options['urls']:
+            parts = urlsplit(url)
+            if parts.scheme != 'http' or not parts.hostname:
+                raise CommandError(f'Only plain http:// URLs are supported: {url}')
+            latencies, errors, elapsed = asyncio.run(self.run(parts, options['concurrency'], options['requests'],
+                                                              options['header']))
+            latencies.sort()
+            self.stdout.write(self.style.MIGRATE_HEADING(url))
+            if not latencies:
+                self.stdout.write(f'All {errors} requests failed')
+                continue
+
+            def percentile(p):
+                return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+            self.stdout.write(f'{len(latencies) / elapsed:.0f} requests/s, {errors} errors, latency p50 '
+                              f'{percentile(0.5):.1f} ms, p95 {percentile(0.95):.1f} ms, '
+                              f'p99 {percentile(0.99):.1f} ms')
+
+    async def run(self, parts, concurrency, total, headers):
+        path = parts.path or '/'
+        if parts.query:
+            path += f'?{parts.query}'
+        lines = [f'GET {path} HTTP/1.1', f'Host: {parts.netloc}', 'Connection: keep-alive'] + headers
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode()
+        remaining = [total]
+        latencies = []
+        errors = [0]
+
+        async def client():
+            reader = writer = None
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                try:
+                    if writer is None:
+                        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+                    started = perf_counter()
+                    writer.write(request)
+                    status, keep_alive = await self.read_response(reader)
+                    latencies.append(perf_counter() - started)
+                    if status >= 400:
+                        errors[0] += 1
+                    if not keep_alive:
+                        writer.close()
+                        writer = None
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    errors[0] += 1
+                    if writer is not None:
+                        writer.close()
+                    writer = None
+            if writer is not None:
+                writer.close()
+
+        started = perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return latencies, errors[0], perf_counter() - started
+
+    async def read_response(self, reader):
+        '''
+        Read one HTTP/1.1 response, discarding the body. Returns (status, whether the connection stays open)
+        '''
+        head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+        status = int(head[0].split()[1])
+        headers = {}
+        for line in head[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip().lower()
+        if headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif 'content-length' in headers:
+            await reader.readexactly(int(headers['content-length']))
+        else:
+            await reader.read()
+            return status, False
+        return status, headers.get('connection') != 'close'
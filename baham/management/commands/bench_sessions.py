@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+
+ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+
+
+class Command(BaseCommand):
+    help = ("Measure authenticated page throughput under each session tier (see SESSION_TIER in settings). Many "
+            "signed-in clients request a page from a pool of threads in process, and the queries that touch "
+            "django_session are counted. Run it against a file database; threads cannot share an in-memory one.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tiers', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+        parser.add_argument('--clients', type=int, default=200, help='Signed-in clients, one session each')
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=5000, help='Requests per tier')
+        parser.add_argument('--path', default='/', help='Page to request')
+        parser.add_argument('--login-every', type=int, default=0,
+                            help='Sign each client in again after this many of its requests, to mix in session '
+                                 'writes (0: never)')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(is_active=True).order_by('pk').first()
+        if user is None:
+            raise CommandError('There is no active user to sign in as')
+        for tier in options['tiers']:
+            with override_settings(SESSION_ENGINE=ENGINES[tier]):
+                clients = [Client() for _ in range(options['clients'])]
+                for client in clients:
+                    client.force_login(user)
+                try:
+                    self.run(tier, clients, user, options)
+                finally:
+                    self.forget(clients)
+
+    def run(self, tier, clients, user, options):
+        threads = max(1, min(options['threads'], len(clients)))
+        shares = [clients[i::threads] for i in range(threads)]
+        per_thread = [options['requests'] // threads + (i < options['requests'] % threads) for i in range(threads)]
+        jobs = [(share, count, user, options['path'], options['login_every'])
+                for share, count in zip(shares, per_thread)]
+        started = perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            results = list(pool.map(self.hammer, jobs))
+        elapsed = perf_counter() - started
+        latencies = sorted(latency for result in results for latency in result[0])
+        errors = sum(result[1] for result in results)
+        session_queries = sum(result[2] for result in results)
+        self.stdout.write(self.style.MIGRATE_HEADING(tier))
+        if not latencies:
+            self.stdout.write('No request was made')
+            return
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write(f'{len(latencies) / elapsed:.0f} requests/s, {errors} errors, '
+                          f'{session_queries / len(latencies):.2f} django_session queries per request, latency '
+                          f'p50 {percentile(0.5):.1f} ms, p95 {percentile(0.95):.1f} ms, p99 {percentile(0.99):.1f} ms')
+
+    def hammer(self, job):
+        clients, count, user, path, login_every = job
+        latencies = []
+        errors = 0
+        session_queries = [0]
+
+        def count_session_queries(execute, sql, params, many, context):
+            if 'django_session' in sql:
+                session_queries[0] += 1
+            return execute(sql, params, many, context)
+
+        try:
+            with connection.execute_wrapper(count_session_queries):
+                for i in range(count):
+                    client = clients[i % len(clients)]
+                    started = perf_counter()
+                    if login_every and i // len(clients) % login_every == login_every - 1:
+                        client.force_login(user)
+                    response = client.get(path)
+                    latencies.append(perf_counter() - started)
+                    # A request whose session did not load is served the sign-in page
+                    if response.status_code != 200 or not response.wsgi_request.user.is_authenticated:
+                        errors += 1
+        finally:
+            connection.close()
+        return latencies, errors, session_queries[0]
+
+    def forget(self, clients):
+        '''
+        Delete the sessions the benchmark created from the database and the session cache
+        '''
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        for client in clients:
+            cookie = client.cookies.get(settings.SESSION_COOKIE_NAME)
+            if cookie:
+                store().delete(cookie.value)
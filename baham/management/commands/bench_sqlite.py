@@ -0,0 +1,109 @@
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from baham.enum_types import VehicleStatus
+from baham.locking import is_locked, retry_on_locked
+from baham.models import Vehicle
+
+PROFILES = ('stock', 'production')
+
+
+class Command(BaseCommand):
+    help = ("Mixed read/write load on the SQLite database from many threads, first with Django's stock settings "
+            "(rollback journal, a connection per request) and then with the production profile (SQLITE_PRODUCTION "
+            "in settings). Each operation is a request: a vehicle list page or a read-then-update transaction on "
+            "one vehicle. Run it against a copy of the database; it leaves the file in the last profile's "
+            "journal mode.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=list(PROFILES))
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--seconds', type=float, default=10, help='Duration of each profile')
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of operations that write')
+
+    def handle(self, *args, **options):
+        default = connections.settings[DEFAULT_DB_ALIAS]
+        if default['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('The default database is not SQLite')
+        vehicle_ids = list(Vehicle.objects.values_list('pk', flat=True)[:10000])
+        if not vehicle_ids:
+            raise CommandError('There are no vehicles to read and update')
+        connections.close_all()
+        for profile in options['profiles']:
+            alias = self.register(profile, default)
+            self.run(profile, alias, vehicle_ids, options)
+            connections[alias].close()
+
+    def register(self, profile, default):
+        '''
+        A database alias on the same file configured as the profile, and switch the file's journal mode to match
+        '''
+        alias = f'bench_{profile}'
+        database = dict(default, CONN_MAX_AGE=0, CONN_HEALTH_CHECKS=False, OPTIONS={})
+        if profile == 'production':
+            database.update(settings.SQLITE_PRODUCTION)
+        connections.settings[alias] = database
+        with connections[alias].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=%s' % ('DELETE' if profile == 'stock' else 'WAL'))
+        connections[alias].close()
+        return alias
+
+    def run(self, profile, alias, vehicle_ids, options):
+        write = self.write if profile == 'stock' else retry_on_locked(self.write)
+        deadline = perf_counter() + options['seconds']
+        job = (alias, vehicle_ids, write, options['write_ratio'], deadline)
+        started = perf_counter()
+        with ThreadPoolExecutor(options['threads']) as pool:
+            results = list(pool.map(self.hammer, [job] * options['threads']))
+        elapsed = perf_counter() - started
+        counts = sum((result[0] for result in results), Counter())
+        self.stdout.write(self.style.MIGRATE_HEADING(profile))
+        self.stdout.write(f"{counts['read'] / elapsed:.0f} reads/s, {counts['write'] / elapsed:.0f} writes/s, "
+                          f"{counts['locked']} failed with database is locked, {counts['error']} other errors")
+        for kind in ('read', 'write'):
+            latencies = sorted(latency for result in results for latency in result[1][kind])
+            if latencies:
+                self.stdout.write(f'{kind} latency p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, '
+                                  f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms')
+
+    def hammer(self, job):
+        alias, vehicle_ids, write, write_ratio, deadline = job
+        counts = Counter()
+        latencies = {'read': [], 'write': []}
+        try:
+            while perf_counter() < deadline:
+                kind = 'write' if random.random() < write_ratio else 'read'
+                started = perf_counter()
+                try:
+                    if kind == 'write':
+                        write(alias, random.choice(vehicle_ids))
+                    else:
+                        self.read(alias)
+                    counts[kind] += 1
+                    latencies[kind].append(perf_counter() - started)
+                except OperationalError as error:
+                    counts['locked' if is_locked(error) else 'error'] += 1
+                finally:
+                    # End of the request: closes the connection unless the profile keeps it
+                    connections[alias].close_if_unusable_or_obsolete()
+        finally:
+            connections[alias].close()
+        return counts, latencies
+
+    def read(self, alias):
+        list(Vehicle.objects.using(alias).filter(status=VehicleStatus.AVAILABLE.name).select_related('model')
+             .order_by('-date_created', '-vehicle_id')[:20])
+
+    def write(self, alias, vehicle_id):
+        with transaction.atomic(using=alias):
+            vehicle = Vehicle.all_objects.using(alias).filter(pk=vehicle_id).values('version').first()
+            Vehicle.all_objects.using(alias).filter(pk=vehicle_id, version=vehicle['version']).update(
+                version=F('version') + 1, date_updated=timezone.now())
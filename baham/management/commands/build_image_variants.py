@@ -0,0 +1,26 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from baham.images import make_variants
+from baham.models import Vehicle
+
+
+class Command(BaseCommand):
+    help = ("Generate the missing thumbnail and WebP/JPEG variants of every vehicle picture, e.g. for pictures "
+            "uploaded before the image pipeline or whose background job was lost.")
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+        names = set()
+        for picture1, picture2 in Vehicle.all_objects.values_list('picture1', 'picture2').iterator():
+            names.update(name for name in (picture1, picture2) if name)
+        written = failed = 0
+        for name in sorted(names):
+            try:
+                written += len(make_variants(name))
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} variants of {len(names)} pictures, {failed} failed, '
+                                             f'in {perf_counter() - started:.2f} s'))
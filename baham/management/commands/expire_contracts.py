@@ -0,0 +1,19 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from baham.expiry import sweep_expired_contracts
+
+
+class Command(BaseCommand):
+    help = ("Deactivate contracts whose expiry date has passed and make their vehicles AVAILABLE again. Only "
+            "active contracts are indexed by expiry date, so it is cheap to run every minute.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Contracts deactivated per transaction')
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+        contracts, vehicles = sweep_expired_contracts(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deactivated {contracts} contracts and freed {vehicles} vehicles '
+                                             f'in {perf_counter() - started:.2f} s'))
@@ -0,0 +1,117 @@
+import random
+from contextlib import ExitStack
+from datetime import date, timedelta
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from baham.backends import LOWER_EMAIL_INDEX, LOWER_USERNAME_INDEX, lookup
+from baham.catalog import catalog_queryset
+from baham.constants import TOWNS
+from baham.enum_types import UserType, VehicleStatus, VehicleType
+from baham.models import Contract, UserProfile, Vehicle, VehicleModel, get_system_user
+from baham.pagination import DEFAULT_PAGE_SIZE, page_queryset
+from baham.schedules import encode
+from baham.sharding import shards
+from baham.views import vehicle_listing
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Print the query plan and timing of the hot listing/lookup queries, with and without the '
+            'indexes added for them. Use --seed to load a synthetic dataset first; like the dropped indexes, '
+            'it is rolled back at the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Number of synthetic vehicles, profiles and contracts to insert before measuring')
+        parser.add_argument('--repeat', type=int, default=20, help='Executions per query when timing')
+
+    def handle(self, *args, **options):
+        # Seed, measure and drop the indexes inside transactions rolled back afterwards, so the database is left
+        # untouched. Seeded rows may land in any town shard
+        try:
+            with ExitStack() as stack:
+                for alias in shards():
+                    stack.enter_context(transaction.atomic(using=alias))
+                if options['seed']:
+                    self.seed(options['seed'])
+                queries = self.hot_queries()
+                self.measure(queries, options['repeat'], 'With indexes')
+                with connection.cursor() as cursor:
+                    for name in self.index_names():
+                        cursor.execute(f'DROP INDEX "{name}"')
+                self.measure(queries, options['repeat'], 'Without indexes')
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def hot_queries(self):
+        user = User.objects.order_by('pk').first()
+        username = user.username if user else 'admin'
+        vehicle_id = Vehicle.objects.values_list('pk', flat=True).first() or 0
+        return [
+            # Built by the views' own code: each shard runs the first page of the listing
+            ('view_vehicles', page_queryset(vehicle_listing())[:DEFAULT_PAGE_SIZE + 1]),
+            ('render_create_vehicle', catalog_queryset()),
+            ('login', lookup(username, 'username')),
+            ('active contracts', Contract.objects.filter(vehicle_id=vehicle_id, is_active=True,
+                                                         expiry_date__gte=date.today())),
+            ('profiles by town', UserProfile.objects.filter(town=TOWNS[0], type=UserType.COMPANION.name, active=True)),
+        ]
+
+    def index_names(self):
+        names = [LOWER_USERNAME_INDEX, LOWER_EMAIL_INDEX]
+        for model in (UserProfile, VehicleModel, Vehicle, Contract):
+            names.extend(index.name for index in model._meta.indexes)
+        return names
+
+    def measure(self, queries, repeat, heading):
+        self.stdout.write(self.style.MIGRATE_HEADING(heading))
+        for label, queryset in queries:
+            started = perf_counter()
+            for _ in range(repeat):
+                list(queryset.all())
+            elapsed = (perf_counter() - started) * 1000 / repeat
+            self.stdout.write(f'{label}: {elapsed:.2f} ms')
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                # The trailing comment stops sqlite3's statement cache from returning the other pass's plan
+                cursor.execute(f'{connection.ops.explain_query_prefix()} {sql} -- {heading}', params)
+                for row in cursor.fetchall():
+                    self.stdout.write(f'    {row[-1]}')
+
+    def seed(self, count):
+        system_user = get_system_user()
+        models = VehicleModel.objects.bulk_create_audited(
+            [VehicleModel(vendor=f'Vendor {i % 40}', model=f'Model {i}', type=random.choice(list(VehicleType)).name,
+                          capacity=random.randint(2, 7)) for i in range(200)], created_by=system_user)
+        offset = User.objects.count()
+        User.objects.bulk_create(
+            [User(username=f'seed{offset + i}', email=f'seed{offset + i}@example.com') for i in range(count)],
+            batch_size=500)
+        users = list(User.objects.filter(username__startswith='seed').order_by('-pk')[:count])
+        profiles = UserProfile.objects.bulk_create_audited(
+            (UserProfile(user=user, birthdate=date(2000, 1, 1), gender=random.choice('MF'),
+                         type=random.choice(list(UserType)).name, primary_contact='0300', landmark='',
+                         town=random.choice(TOWNS)) for user in users), created_by=system_user)
+        profiles = list(UserProfile.objects.order_by('-pk')[:count])
+        statuses = [s.name for s in VehicleStatus]
+        Vehicle.objects.bulk_create_audited(
+            (Vehicle(registration_number=f'S{offset + i}', colour='#FFFFFF', model=random.choice(models),
+                     owner=users[i], status=random.choice(statuses), voided=random.random() < 0.1)
+             for i in range(count)), created_by=system_user)
+        vehicles = list(Vehicle.objects.order_by('-pk').values_list('pk', flat=True)[:count])
+        today = date.today()
+        Contract.objects.bulk_create_audited(
+            (Contract(vehicle_id=random.choice(vehicles), companion=profile, effective_start_date=today,
+                      expiry_date=today + timedelta(days=random.randint(-180, 180)),
+                      is_active=random.random() < 0.5, fuel_share=25, maintenance_share=25,
+                      schedule=encode(range(5), (1, 5)))
+             for profile in profiles), created_by=system_user)
+        self.stdout.write(f'Seeded {count} users, profiles, vehicles and contracts')
@@ -0,0 +1,44 @@
+import sys
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from baham.transfer import FORMATS, TABLES, RowWriter, guess_format
+
+
+class Command(BaseCommand):
+    help = ("Export the vehicle models, vehicles, user profiles or contracts that are not voided as CSV or "
+            "NDJSON, streamed a batch at a time from every shard. References are written as natural keys "
+            "(model uuid, username, registration number) so the file can be imported into another database "
+            "with import_data.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=list(TABLES))
+        parser.add_argument('path', help='File to write, or - for standard output')
+        parser.add_argument('--format', choices=FORMATS, help='Default: from the file extension')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or guess_format(options['path'])
+        if not file_format:
+            raise CommandError('Cannot tell the format from the file name; use --format')
+        table = TABLES[options['table']]()
+
+        stream = sys.stdout if options['path'] == '-' else open(options['path'], 'w', newline='', encoding='utf-8')
+        started = perf_counter()
+        exported = 0
+        try:
+            writer = RowWriter(stream, file_format, table.columns)
+            for rows in table.export(options['batch_size']):
+                writer.write(rows)
+                exported += len(rows)
+                self.stderr.write(f'{exported} rows exported, {exported / (perf_counter() - started):.0f} rows/s')
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        elapsed = perf_counter() - started
+        # The summary goes with the progress when the rows themselves are on standard output
+        report = self.stderr if stream is sys.stdout else self.stdout
+        report.write(self.style.SUCCESS(f'Exported {exported} rows in {elapsed:.2f} s, '
+                                        f'{exported / elapsed if elapsed else 0:.0f} rows/s'))
@@ -0,0 +1,69 @@
+import sys
+from itertools import islice
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from baham.transfer import FORMATS, TABLES, Rejections, UserProfileTable, guess_format, read_rows
+
+
+class Command(BaseCommand):
+    help = ("Import vehicle models, vehicles, user profiles or contracts from a CSV file with a header line, or "
+            "from NDJSON, in the columns written by export_data. The file is read a batch at a time: each batch "
+            "is validated with a few queries (references, colour codes, unique registration numbers and uuids, "
+            "free seats) and its valid rows inserted with batched statements in one transaction per batch and "
+            "shard. Invalid rows are skipped and reported with their line number. Import the catalog, then "
+            "profiles, vehicles and contracts, as each refers to the ones before it.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=list(TABLES))
+        parser.add_argument('path', help="File to read, or - for standard input")
+        parser.add_argument('--format', choices=FORMATS, help='Default: from the file extension')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--created-by', help='Username recorded as the creator; default: the system user')
+        parser.add_argument('--create-users', action='store_true',
+                            help='Profiles: create missing users, without a usable password')
+        parser.add_argument('--max-errors', type=int, default=100, help='Invalid rows to list (all are counted)')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or guess_format(options['path'])
+        if not file_format:
+            raise CommandError('Cannot tell the format from the file name; use --format')
+        created_by = None
+        if options['created_by']:
+            created_by = User.objects.filter(username=options['created_by']).first()
+            if not created_by:
+                raise CommandError(f'User {options["created_by"]} does not exist')
+        table = UserProfileTable(options['create_users']) if options['table'] == 'userprofile' else \
+            TABLES[options['table']]()
+        batch_size = options['batch_size']
+
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+        started = perf_counter()
+        read = imported = 0
+        errors = Rejections(options['max_errors'])
+        try:
+            rows = read_rows(stream, file_format)
+            while batch := list(islice(rows, batch_size)):
+                read += len(batch)
+                valid = []
+                for line, row in batch:
+                    if isinstance(row, str):
+                        errors.append((line, row))
+                    else:
+                        valid.append((line, row))
+                for alias, objs in table.build(valid, errors).items():
+                    imported += table.insert(alias, objs, created_by, batch_size)
+                self.stderr.write(f'{read} rows read, {imported} imported, {errors.count} rejected, '
+                                  f'{read / (perf_counter() - started):.0f} rows/s')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for line, message in errors.first:
+            self.stderr.write(f'Line {line}: {message}')
+        elapsed = perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} of {read} rows ({errors.count} rejected) in {elapsed:.2f} s, '
+            f'{imported / elapsed if elapsed else 0:.0f} rows/s'))
@@ -0,0 +1,26 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from baham.matching import assign_companions
+
+
+class Command(BaseCommand):
+    help = ('Assign every unmatched companion to an AVAILABLE vehicle with free seats, minimising the total '
+            'pickup detour. Prints the proposed assignments; no contracts are created.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-detour', type=float, default=5.0, help='Largest acceptable detour in km')
+        parser.add_argument('--candidates', type=int, default=20,
+                            help='Cheapest vehicles considered per companion')
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+        assignments = assign_companions(options['max_detour'], options['candidates'])
+        elapsed = perf_counter() - started
+        if options['verbosity'] > 1:
+            for assignment in assignments:
+                self.stdout.write(f'{assignment.companion_id}\t{assignment.vehicle_id}\t{assignment.detour_km:.3f}')
+        total = sum(assignment.detour_km for assignment in assignments)
+        self.stdout.write(self.style.SUCCESS(
+            f'Matched {len(assignments)} companions, total detour {total:.1f} km, in {elapsed:.2f} s'))
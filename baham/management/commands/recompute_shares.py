@@ -0,0 +1,15 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from baham.shares import recompute_shares
+
+
+class Command(BaseCommand):
+    help = ("Recompute the fuel and maintenance shares of every active contract from the distance each "
+            "companion rides on the vehicle's route.")
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+        updated = recompute_shares()
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} contracts in {perf_counter() - started:.2f} s'))
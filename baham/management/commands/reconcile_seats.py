@@ -0,0 +1,22 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from baham.occupancy import refresh_seats, sync_status
+from baham.sharding import shards, using_shard
+
+
+class Command(BaseCommand):
+    help = ("Rebuild every vehicle's seats_taken and seats_free from its active contracts and bring its "
+            "AVAILABLE/FULL status in line with them.")
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+        vehicles = changed = 0
+        for alias in shards():
+            with transaction.atomic(using=alias), using_shard(alias):
+                vehicles += refresh_seats()
+                changed += sync_status()
+        self.stdout.write(self.style.SUCCESS(f'Recounted {vehicles} vehicles, {changed} changed status, '
+                                             f'in {perf_counter() - started:.2f} s'))
@@ -0,0 +1,92 @@
+from collections import defaultdict
+from itertools import islice
+from time import perf_counter
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+
+from baham.models import Contract, Route, RouteCell, UserProfile, Vehicle
+from baham.sharding import SHARD_ID_SPAN, enabled, mirror_catalog, shard_for_town, shards, town_shards
+
+
+class Command(BaseCommand):
+    help = ("Create the town shards (BAHAM_TOWN_SHARDS=1, see TOWN_GROUPS in settings) and move the profiles, "
+            "vehicles, routes and contracts in 'default' into the shard of their town. Moved rows get the id "
+            "range of their shard and references to them are rewritten. Rows are copied before anything is "
+            "deleted from 'default', so an interrupted run can simply be repeated.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not enabled():
+            raise CommandError('Sharding is off; set BAHAM_TOWN_SHARDS=1')
+        started = perf_counter()
+        for alias in town_shards():
+            call_command('migrate', database=alias, interactive=False, verbosity=0)
+        mirror_catalog()
+        self.batch_size = options['batch_size']
+        self.aliases = shards()
+        # Shard index, by id in 'default', of the rows moved so far, and of the users owning them
+        self.placed = defaultdict(dict)
+        users = {}
+
+        profiles = self.move(UserProfile, lambda row: self.index(shard_for_town(row['town'])))
+        for pk, user_id in UserProfile.all_objects.using(DEFAULT_DB_ALIAS).values_list('pk', 'user_id').iterator():
+            users[user_id] = self.placed[UserProfile].get(pk, 0)
+        vehicles = self.move(Vehicle, lambda row: users.get(row['owner_id'], 0))
+        routes = self.move(Route, lambda row: users.get(row['owner_id'], 0), vehicle_id=Vehicle)
+        cells = self.move(RouteCell, lambda row: self.placed[Route].get(row['route_id'], 0), route_id=Route)
+        contracts = self.move(Contract, lambda row: self.placed[Vehicle].get(row['vehicle_id'], 0),
+                              vehicle_id=Vehicle, companion_id=UserProfile)
+        for model in (Contract, RouteCell, Route, Vehicle, UserProfile):
+            self.delete_moved(model)
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {profiles} profiles, {vehicles} vehicles, {routes} routes, {cells} route cells and '
+            f'{contracts} contracts into {len(town_shards())} shards in {perf_counter() - started:.2f} s'))
+
+    def index(self, alias):
+        return self.aliases.index(alias)
+
+    def new_pk(self, model, pk):
+        return self.placed[model].get(pk, 0) * SHARD_ID_SPAN + pk
+
+    def move(self, model, index_of, **references):
+        '''
+        Copy the rows of model in 'default' whose index_of(row) is a town shard into it, with their ids and the
+        references given as {field: model} moved to the shard ranges. Rows staying in 'default' get their
+        references rewritten in place. Returns the number of rows moved
+        '''
+        fields = [field.attname for field in model._meta.concrete_fields]
+        pk_name = model._meta.pk.attname
+        rows = model._base_manager.using(DEFAULT_DB_ALIAS).filter(**{f'{pk_name}__lt': SHARD_ID_SPAN}) \
+            .order_by(pk_name).values(*fields).iterator(chunk_size=self.batch_size)
+        moved = 0
+        while batch := list(islice(rows, self.batch_size)):
+            copies = defaultdict(list)
+            rewritten = []
+            for row in batch:
+                index = index_of(row)
+                changed = {field: self.new_pk(target, row[field]) for field, target in references.items()
+                           if row[field] is not None and self.new_pk(target, row[field]) != row[field]}
+                row.update(changed)
+                if index:
+                    self.placed[model][row[pk_name]] = index
+                    row[pk_name] += index * SHARD_ID_SPAN
+                    copies[self.aliases[index]].append(model(**row))
+                elif changed:
+                    rewritten.append(model(**row))
+            for alias, objs in copies.items():
+                models.QuerySet(model, using=alias).bulk_create(objs, ignore_conflicts=True)
+                moved += len(objs)
+            if rewritten:
+                models.QuerySet(model, using=DEFAULT_DB_ALIAS).bulk_update(
+                    rewritten, [model._meta.get_field(field).name for field in references])
+        return moved
+
+    def delete_moved(self, model):
+        pks = iter(list(self.placed[model]))
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            while batch := list(islice(pks, 500)):
+                models.QuerySet(model, using=DEFAULT_DB_ALIAS).filter(pk__in=batch).delete()
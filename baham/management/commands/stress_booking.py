@@ -0,0 +1,87 @@
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+
+from baham.booking import BookingConflict, SeatUnavailable, book_seat
+from baham.constants import TOWNS
+from baham.enum_types import UserType, VehicleStatus, VehicleType
+from baham.models import Contract, UserProfile, Vehicle, VehicleModel, get_system_user
+
+
+class Command(BaseCommand):
+    help = ("Book seats on a few vehicles from many threads at once and check that none of them ends up "
+            "overbooked. Creates its own vehicles and companion and removes them afterwards. Run it against "
+            "a file database; threads cannot share an in-memory one.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--vehicles', type=int, default=3)
+        parser.add_argument('--bookings', type=int, default=25, help='Booking attempts per thread')
+        parser.add_argument('--capacity', type=int, default=5)
+
+    def handle(self, *args, **options):
+        vehicle_model, vehicles, user = self.create_fixtures(options['vehicles'], options['capacity'])
+        try:
+            started = perf_counter()
+            with ThreadPoolExecutor(options['threads']) as pool:
+                outcomes = Counter()
+                for result in pool.map(self.hammer, [(vehicles, user.userprofile, options['bookings'])] *
+                                       options['threads']):
+                    outcomes.update(result)
+            elapsed = perf_counter() - started
+            self.stdout.write(', '.join(f'{outcome}: {count}' for outcome, count in sorted(outcomes.items())) +
+                              f' in {elapsed:.2f} s')
+            self.verify(vehicles, options['capacity'])
+        finally:
+            Contract.all_objects.filter(vehicle__in=vehicles).delete()
+            Vehicle.all_objects.filter(pk__in=vehicles).delete()
+            VehicleModel.all_objects.filter(pk=vehicle_model.pk).delete()
+            user.delete()
+
+    def create_fixtures(self, count, capacity):
+        system_user = get_system_user()
+        suffix = random.randrange(10 ** 6)
+        vehicle_model = VehicleModel.objects.create(vendor='Stress', model=f'Stress {suffix}',
+                                                    type=VehicleType.VAN.name, capacity=capacity)
+        vehicles = [Vehicle.objects.create(registration_number=f'ST{suffix:06d}{i:02d}', colour='#FFFFFF',
+                                           model=vehicle_model, owner=system_user,
+                                           status=VehicleStatus.AVAILABLE.name).pk
+                    for i in range(count)]
+        user = User.objects.create(username=f'stress{suffix}')
+        UserProfile.objects.create(user=user, birthdate=date(2000, 1, 1), gender='M', type=UserType.COMPANION.name,
+                                   primary_contact='0300', landmark='', town=TOWNS[0])
+        return vehicle_model, vehicles, user
+
+    def hammer(self, job):
+        vehicles, companion, bookings = job
+        outcomes = Counter()
+        try:
+            for _ in range(bookings):
+                try:
+                    book_seat(random.choice(vehicles), companion, date.today() + timedelta(days=30))
+                    outcomes['booked'] += 1
+                except SeatUnavailable:
+                    outcomes['full'] += 1
+                except BookingConflict:
+                    outcomes['gave up'] += 1
+                except OperationalError:
+                    # SQLite's write lock timed out
+                    outcomes['locked'] += 1
+        finally:
+            connection.close()
+        return outcomes
+
+    def verify(self, vehicles, capacity):
+        for vehicle in Vehicle.all_objects.filter(pk__in=vehicles):
+            riders = Contract.objects.filter(vehicle=vehicle, is_active=True).count()
+            self.stdout.write(f'Vehicle {vehicle.pk}: {riders} riders, seats_taken {vehicle.seats_taken}, '
+                              f'seats_free {vehicle.seats_free}, {vehicle.status}')
+            if riders > capacity - 1 or riders != vehicle.seats_taken:
+                raise CommandError(f'Vehicle {vehicle.pk} is overbooked or its counters are wrong')
+        self.stdout.write(self.style.SUCCESS('No vehicle was overbooked'))
@@ -0,0 +1,48 @@
+import sqlite3
+import time
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = ("Copy the primary SQLite database over each replica in DATABASE_REPLICAS with SQLite's online "
+            "backup, a stand-in for replication when developing. Each copy is a consistent snapshot and "
+            "replaces the replica's content in place, so its open connections see it. With --interval it "
+            "keeps running and copies again every so many seconds.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Seconds between copies; 0 copies once (default)')
+
+    def handle(self, *args, **options):
+        primary = self.sqlite_name(DEFAULT_DB_ALIAS)
+        replicas = [self.sqlite_name(alias) for alias in getattr(settings, 'DATABASE_REPLICAS', [])]
+        if not replicas:
+            raise CommandError('DATABASE_REPLICAS is empty; set BAHAM_DB_REPLICA=1 to add the local replica')
+        while True:
+            for replica in replicas:
+                started = perf_counter()
+                self.copy(primary, replica)
+                self.stdout.write(f'Copied {primary} to {replica} in {perf_counter() - started:.2f} s')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def sqlite_name(self, alias):
+        database = connections.settings[alias]
+        if database['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError(f'{alias} is not an SQLite database')
+        return str(database['NAME'])
+
+    def copy(self, primary, replica):
+        source = sqlite3.connect(primary)
+        target = sqlite3.connect(replica, timeout=30)
+        try:
+            # In one step, so readers of the replica never see a half-copied database
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
@@ -0,0 +1,227 @@
+from collections import deque, namedtuple
+from itertools import chain
+
+from django.db.models import OuterRef, Subquery
+import numpy as np
+
+from baham.enum_types import UserType, VehicleStatus
+from baham.sharding import scatter, scatter_map
+from baham.spatial import EARTH_RADIUS_KM
+
+Assignment = namedtuple('Assignment', ['companion_id', 'vehicle_id', 'detour_km'])
+
+
+def unit_vectors(latitudes, longitudes):
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    return np.stack([np.cos(latitudes) * np.cos(longitudes), np.cos(latitudes) * np.sin(longitudes),
+                     np.sin(latitudes)], axis=-1)
+
+
+def distance_matrix(points, other_points):
+    '''
+    Pairwise great-circle distances in km between two arrays of unit vectors, from one matrix product
+    '''
+    chord = np.sqrt(np.clip(2 - 2 * (points @ other_points.T), 0, 4))
+    return 2 * EARTH_RADIUS_KM * np.arcsin(chord / 2)
+
+
+def haversine(latitudes, longitudes, other_latitudes, other_longitudes):
+    '''
+    Great-circle distances in km between coordinates given as broadcastable arrays of degrees
+    '''
+    lat1, lon1, lat2, lon2 = map(np.radians, (latitudes, longitudes, other_latitudes, other_longitudes))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def detour_matrix(companions, origins, destinations):
+    '''
+    Extra km each vehicle (column) drives to pick up each companion (row): origin -> companion -> destination
+    minus origin -> destination. Vehicles without a known destination (NaN) go out and back to the companion
+    '''
+    no_destination = np.isnan(destinations[:, 0])
+    destinations = np.where(no_destination[:, None], origins, destinations)
+    companions = unit_vectors(companions[:, 0], companions[:, 1])
+    to_companion = distance_matrix(companions, unit_vectors(origins[:, 0], origins[:, 1]))
+    onward = distance_matrix(companions, unit_vectors(destinations[:, 0], destinations[:, 1]))
+    direct = haversine(origins[:, 0], origins[:, 1], destinations[:, 0], destinations[:, 1])
+    return to_companion + onward - direct
+
+
+def candidate_vehicles(companions, origins, destinations, max_detour_km, candidates, chunk_size=1000):
+    '''
+    For each companion, the indices and detours of its `candidates` cheapest vehicles. Vehicles over
+    max_detour_km are marked with index -1. Computed in chunks to bound the size of the cost matrix
+    '''
+    k = min(candidates, len(origins))
+    indices = np.full((len(companions), k), -1, dtype=np.int64)
+    costs = np.full((len(companions), k), np.inf)
+    for start in range(0, len(companions), chunk_size):
+        detours = detour_matrix(companions[start:start + chunk_size], origins, destinations)
+        nearest = np.argpartition(detours, k - 1, axis=1)[:, :k] if k < detours.shape[1] else \
+            np.tile(np.arange(detours.shape[1]), (len(detours), 1))
+        nearest_costs = np.take_along_axis(detours, nearest, axis=1)
+        allowed = nearest_costs <= max_detour_km
+        indices[start:start + chunk_size] = np.where(allowed, nearest, -1)
+        costs[start:start + chunk_size] = np.where(allowed, nearest_costs, np.inf)
+    return indices, costs
+
+
+def max_matches(indices, capacities):
+    '''
+    The largest number of rows (companions) that can be assigned to their candidate columns (vehicles, -1 for
+    none) within the column capacities, by searching an augmenting path from each row in turn
+    '''
+    adjacency = [[column for column in row if column >= 0] for row in indices.tolist()]
+    capacities = capacities.tolist()
+    holders = [[] for _ in capacities]
+    column_of = [-1] * len(adjacency)
+    # Nothing a failed search reached can be on an augmenting path later, so it is not searched again
+    dead_rows, dead_columns = set(), set()
+    for start, columns in enumerate(adjacency):
+        if not columns:
+            continue
+        reached_from = {}
+        seen = {start}
+        queue = deque([start])
+        end = None
+        while queue and end is None:
+            row = queue.popleft()
+            for column in adjacency[row]:
+                if column in reached_from or column in dead_columns:
+                    continue
+                reached_from[column] = row
+                if len(holders[column]) < capacities[column]:
+                    end = column
+                    break
+                for holder in holders[column]:
+                    if holder not in seen and holder not in dead_rows:
+                        seen.add(holder)
+                        queue.append(holder)
+        if end is None:
+            dead_rows |= seen
+            dead_columns |= reached_from.keys()
+            continue
+        # Each row on the path moves to the column it reached, freeing its old one for the row before it
+        column = end
+        while column >= 0:
+            row = reached_from[column]
+            previous = column_of[row]
+            if previous >= 0:
+                holders[previous].remove(row)
+            holders[column].append(row)
+            column_of[row] = column
+            column = previous if row != start else -1
+    return sum(column >= 0 for column in column_of)
+
+
+def auction_assign(indices, costs, capacities, epsilon=0.01):
+    '''
+    Capacity-constrained assignment of rows (companions) to columns (vehicles) with the most matches possible
+    and, among those, the least total cost, by a vectorised Jacobi auction over similar objects. Each vehicle
+    holds up to its capacity of the highest bids; its price is the lowest held bid once full. Every row must
+    be placed, either in a vehicle or in an "unmatched" column that holds exactly the rows no maximum
+    assignment can seat, so no row gives up a seat to save cost. The total cost is within epsilon per match
+    of the optimum; smaller values cost more bidding rounds. Returns the column of each row, or -1
+    '''
+    rows = len(indices)
+    finite = np.isfinite(costs)
+    active = np.flatnonzero(finite.any(axis=1))
+    unmatched = len(active) - max_matches(indices, capacities)
+    # Benefits only need to be positive: every outcome the auction can reach has the same number of matches
+    offset = (costs[finite].max() if finite.any() else 0) + 1
+    dummy = len(capacities)
+    columns = np.concatenate([np.maximum(indices, 0), np.full((rows, 1), dummy)], axis=1)
+    benefits = np.concatenate([np.where(finite, offset - costs, -np.inf),
+                               np.full((rows, 1), 0.0 if unmatched else -np.inf)], axis=1)
+    capacities = np.append(capacities, unmatched)
+    prices = np.zeros(len(capacities))
+    assigned = np.full(rows, -1, dtype=np.int64)
+    held_bid = np.zeros(rows)
+    holders = np.zeros(len(capacities), dtype=np.int64)
+    while len(active):
+        values = benefits[active] - prices[columns[active]]
+        order = np.argsort(-values, axis=1)[:, :2]
+        best = np.take_along_axis(values, order[:, :1], axis=1)[:, 0]
+        second = np.take_along_axis(values, order[:, 1:2], axis=1)[:, 0]
+        # A row with a single option outbids the others by a whole benefit
+        second = np.where(np.isfinite(second), second, best - offset)
+        bidders = active
+        targets = columns[bidders, order[:, 0]]
+        bids = prices[targets] + best - second + epsilon
+        # Pool each targeted vehicle's current holders with its new bidders and keep the highest bids
+        targeted = np.unique(targets)
+        is_targeted = np.zeros(len(capacities) + 1, dtype=bool)
+        is_targeted[targeted] = True
+        # assigned == -1 lands on the extra, never targeted, slot
+        current = np.flatnonzero(is_targeted[assigned])
+        people = np.concatenate([current, bidders])
+        vehicles = np.concatenate([assigned[current], targets])
+        offers = np.concatenate([held_bid[current], bids])
+        order = np.lexsort((-offers, vehicles))
+        people, vehicles, offers = people[order], vehicles[order], offers[order]
+        group_start = np.searchsorted(vehicles, vehicles, side='left')
+        keep = (np.arange(len(vehicles)) - group_start) < capacities[vehicles]
+        assigned[people[~keep]] = -1
+        assigned[people[keep]] = vehicles[keep]
+        held_bid[people[keep]] = offers[keep]
+        holders[targeted] = 0
+        np.add.at(holders, vehicles[keep], 1)
+        full = targeted[holders[targeted] >= capacities[targeted]]
+        lowest = np.full(len(capacities), np.inf)
+        np.minimum.at(lowest, vehicles[keep], offers[keep])
+        prices[full] = lowest[full]
+        # Evicted rows bid again
+        active = people[~keep]
+    assigned[assigned == dummy] = -1
+    return assigned
+
+
+def available_vehicles(alias):
+    '''
+    AVAILABLE vehicles with free seats in one shard whose owner has coordinates, as (id, seats free, latitude,
+    longitude, destination latitude, destination longitude). Owners are users, which stay in 'default', so
+    their profiles and routes are looked up by owner id instead of joined through them
+    '''
+    from baham.models import Route, UserProfile, Vehicle
+    homes = UserProfile.objects.using(alias).filter(user_id=OuterRef('owner_id'))
+    vehicles = list(Vehicle.objects.using(alias).filter(
+        status=VehicleStatus.AVAILABLE.name, seats_free__gt=0).annotate(
+        latitude=Subquery(homes.values('address_latitude')[:1]),
+        longitude=Subquery(homes.values('address_longitude')[:1])).filter(latitude__isnull=False).values_list(
+        'pk', 'owner_id', 'seats_free', 'latitude', 'longitude'))
+    # The last waypoint of an owner's route is where they are headed
+    destinations = {}
+    for route in Route.objects.using(alias).filter(owner__in={v[1] for v in vehicles}).order_by('date_created'):
+        destinations[route.owner_id] = route.waypoints[-1]
+    return [(pk, free, lat, lon, *destinations.get(owner, (np.nan, np.nan)))
+            for pk, owner, free, lat, lon in vehicles]
+
+
+def assign_companions(max_detour_km=5.0, candidates=20):
+    '''
+    Match every active companion without an active contract to an AVAILABLE vehicle with free seats,
+    minimising the total pickup detour. With town shards every shard is read and the companions are matched
+    across all of them. Returns a list of Assignment
+    '''
+    from baham.models import Contract, UserProfile
+    # A contract lives in its vehicle's shard, which need not be its companion's
+    engaged = set(scatter(Contract.objects.filter(is_active=True).values_list('companion_id', flat=True)))
+    companions = [row for row in scatter(UserProfile.objects.filter(
+        type=UserType.COMPANION.name, active=True, address_latitude__isnull=False,
+        address_longitude__isnull=False).values_list('pk', 'address_latitude', 'address_longitude'))
+        if row[0] not in engaged]
+    vehicles = list(chain.from_iterable(scatter_map(available_vehicles).values()))
+    if not companions or not vehicles:
+        return []
+    companion_coordinates = np.array([(lat, lon) for _, lat, lon in companions], dtype=float)
+    origins = np.array([(lat, lon) for _, _, lat, lon, _, _ in vehicles], dtype=float)
+    ends = np.array([end for _, _, _, _, *end in vehicles], dtype=float)
+    capacities = np.array([free for _, free, _, _, _, _ in vehicles], dtype=np.int64)
+    indices, costs = candidate_vehicles(companion_coordinates, origins, ends, max_detour_km, candidates)
+    assigned = auction_assign(indices, costs, capacities)
+    result = []
+    for row in np.flatnonzero(assigned >= 0):
+        detour = costs[row][indices[row] == assigned[row]][0]
+        result.append(Assignment(companions[row][0], vehicles[assigned[row]][0], float(detour)))
+    return result
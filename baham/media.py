@@ -0,0 +1,84 @@
+import os
+import re
+
+# Pictures stored by baham.images are named after the SHA-256 of their content, so they never change
+HASHED_NAME = re.compile(r'(?:^|/)([0-9a-f]{64}(?:_[a-z]+)?)\.[a-z0-9]+$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=3600'
+BLOCK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+class FileRange:
+    '''
+    File object limited to `length` bytes from its current position. It keeps fileno() and tell(), so servers
+    with wsgi.file_wrapper can still sendfile() the range, bounded by Content-Length
+    '''
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def is_hashed(path):
+    return bool(HASHED_NAME.search(path))
+
+
+def file_etag(path, stat):
+    '''
+    Strong ETag of a file: its content hash when the name carries one, else its size and modification time
+    '''
+    match = HASHED_NAME.search(path)
+    if match:
+        return f'"{match.group(1)}"'
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    '''
+    (start, end), both inclusive, of a single-range "bytes=" Range header. Returns None when the whole file
+    should be served: no header, a malformed one, or several ranges. Raises RangeNotSatisfiable when the range
+    lies outside the file
+    '''
+    if not header or not header.startswith('bytes='):
+        return None
+    spec = header[len('bytes='):].strip()
+    if ',' in spec:
+        return None
+    start, separator, end = spec.partition('-')
+    if not separator:
+        return None
+    try:
+        if not start:
+            # Suffix range: the last `end` bytes
+            length = int(end)
+            if length <= 0 or size == 0:
+                raise RangeNotSatisfiable(header)
+            return max(0, size - length), size - 1
+        start, end = int(start), int(end) if end else size - 1
+    except RangeNotSatisfiable:
+        raise
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    if end < start:
+        return None
+    return start, min(end, size - 1)
@@ -0,0 +1,57 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from baham.routers import begin_request, end_request
+
+# Cookie holding the time until which the client reads from the primary
+PIN_COOKIE = 'baham_primary'
+
+
+class ReadYourWritesMiddleware:
+    '''
+    Routes each request through baham.routers.PrimaryReplicaRouter. Requests with an unsafe method read from
+    the primary throughout, as do the requests of a client for REPLICA_LAG seconds after it wrote, e.g. the
+    vehicle list a client is redirected to after save_vehicle
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = begin_request(self.pinned(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = end_request(token)
+        return self.pin(response, wrote)
+
+    async def __acall__(self, request):
+        token = begin_request(self.pinned(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            wrote = end_request(token)
+        return self.pin(response, wrote)
+
+    def pinned(self, request):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            return True
+        try:
+            return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def pin(self, response, wrote):
+        if wrote:
+            lag = getattr(settings, 'REPLICA_LAG', 5)
+            response.set_cookie(PIN_COOKIE, f'{time.time() + lag:.3f}', max_age=lag, httponly=True,
+                                samesite='Lax')
+        return response
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('baham', '0006_voidable_managers'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contract',
+            index=models.Index(fields=['vehicle', 'is_active', 'expiry_date'], name='contract_vehicle_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['town', 'type', 'active'], name='userprofile_town_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(condition=models.Q(('voided', False)), fields=['status', '-date_created', '-vehicle_id'], name='vehicle_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehiclemodel',
+            index=models.Index(condition=models.Q(('voided', False)), fields=['vendor'], name='vehiclemodel_vendor_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('baham', '0007_listing_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vehiclemodel',
+            index=models.Index(condition=models.Q(('voided', False)), fields=['-date_created', '-model_id'], name='vehiclemodel_created_idx'),
+        ),
+    ]
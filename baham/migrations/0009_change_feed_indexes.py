@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('baham', '0008_keyset_pagination_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(fields=['date_created'], name='vehicle_changed_c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(fields=['date_updated'], name='vehicle_changed_u_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(fields=['date_voided'], name='vehicle_changed_v_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehiclemodel',
+            index=models.Index(fields=['date_created'], name='vehiclemodel_changed_c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehiclemodel',
+            index=models.Index(fields=['date_updated'], name='vehiclemodel_changed_u_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehiclemodel',
+            index=models.Index(fields=['date_voided'], name='vehiclemodel_changed_v_idx'),
+        ),
+    ]
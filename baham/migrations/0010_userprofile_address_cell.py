@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+from baham.spatial import cell_for
+
+
+def fill_address_cells(apps, schema_editor):
+    UserProfile = apps.get_model('baham', 'UserProfile')
+    profiles = list(UserProfile._default_manager.filter(address_latitude__isnull=False,
+                                                        address_longitude__isnull=False))
+    for profile in profiles:
+        profile.address_cell = cell_for(profile.address_latitude, profile.address_longitude)
+    UserProfile._default_manager.bulk_update(profiles, ['address_cell'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('baham', '0009_change_feed_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='address_cell',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['address_cell'], name='userprofile_address_cell_idx'),
+        ),
+        migrations.RunPython(fill_address_cells, migrations.RunPython.noop),
+    ]
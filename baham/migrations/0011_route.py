@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:55
+
+import django.db.models.deletion
+import django.db.models.manager
+import django.utils.timezone
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('baham', '0010_userprofile_address_cell'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Route',
+            fields=[
+                ('route_id', models.AutoField(db_column='id', primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('polyline', models.BinaryField()),
+                ('min_latitude', models.FloatField(editable=False)),
+                ('max_latitude', models.FloatField(editable=False)),
+                ('min_longitude', models.FloatField(editable=False)),
+                ('max_longitude', models.FloatField(editable=False)),
+                ('date_created', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('date_updated', models.DateTimeField(null=True)),
+                ('voided', models.BooleanField(default=False)),
+                ('date_voided', models.DateTimeField(null=True)),
+                ('void_reason', models.CharField(blank=True, max_length=1024, null=True)),
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('created_by', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='route_creator', to=settings.AUTH_USER_MODEL)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('updated_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='route_updater', to=settings.AUTH_USER_MODEL)),
+                ('vehicle', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='baham.vehicle')),
+                ('voided_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='route_voider', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+                'default_manager_name': 'all_objects',
+            },
+            managers=[
+                ('all_objects', django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RouteCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell', models.IntegerField()),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cells', to='baham.route')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('cell', 'route'), name='routecell_cell_route_uniq')],
+            },
+        ),
+    ]
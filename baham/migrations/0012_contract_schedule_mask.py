@@ -0,0 +1,55 @@
+from django.db import migrations, models
+
+from baham.schedules import describe, parse
+
+
+def parse_schedules(apps, schema_editor):
+    Contract = apps.get_model('baham', 'Contract')
+    contracts = list(Contract._default_manager.only('pk', 'schedule'))
+    for contract in contracts:
+        contract.schedule_mask = parse(contract.schedule)
+    Contract._default_manager.bulk_update(contracts, ['schedule_mask'], batch_size=500)
+
+
+def describe_schedules(apps, schema_editor):
+    Contract = apps.get_model('baham', 'Contract')
+    contracts = list(Contract._default_manager.only('pk', 'schedule_mask'))
+    for contract in contracts:
+        contract.schedule = describe(contract.schedule_mask)[:255]
+    Contract._default_manager.bulk_update(contracts, ['schedule'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('baham', '0011_route'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contract',
+            name='schedule_mask',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(parse_schedules, describe_schedules),
+        # Lets the text column be re-added over existing rows when migrating backwards
+        migrations.AlterField(
+            model_name='contract',
+            name='schedule',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.RemoveField(
+            model_name='contract',
+            name='schedule',
+        ),
+        migrations.RenameField(
+            model_name='contract',
+            old_name='schedule_mask',
+            new_name='schedule',
+        ),
+        migrations.AlterField(
+            model_name='contract',
+            name='schedule',
+            field=models.BigIntegerField(default=0, help_text='Weekday x time-slot bitmask.'),
+        ),
+    ]
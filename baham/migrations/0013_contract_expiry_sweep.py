@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('baham', '0012_contract_schedule_mask'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contract',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['expiry_date'], name='contract_active_expiry_idx'),
+        ),
+    ]
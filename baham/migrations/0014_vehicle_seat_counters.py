@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:10
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_seats(apps, schema_editor):
+    Contract = apps.get_model('baham', 'Contract')
+    Vehicle = apps.get_model('baham', 'Vehicle')
+    VehicleModel = apps.get_model('baham', 'VehicleModel')
+    riders = Contract._default_manager.filter(vehicle=OuterRef('pk'), is_active=True, voided=False).values(
+        'vehicle').annotate(count=Count('pk')).values('count')
+    capacity = VehicleModel._default_manager.filter(pk=OuterRef('model_id')).values('capacity')
+    Vehicle._default_manager.update(seats_taken=Coalesce(Subquery(riders), Value(0)),
+                                    seats_free=Subquery(capacity) - 1 - Coalesce(Subquery(riders), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('baham', '0013_contract_expiry_sweep'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='seats_free',
+            field=models.SmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='seats_taken',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_seats, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(condition=models.Q(('voided', False)), fields=['status', 'seats_free'], name='vehicle_status_seats_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('baham', '0014_vehicle_seat_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
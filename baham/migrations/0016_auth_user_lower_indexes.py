@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('baham', '0015_vehicle_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # UsernameOrEmailBackend looks users up by lower(username) or lower(email), see baham.backends
+        migrations.RunSQL(
+            sql='CREATE INDEX IF NOT EXISTS "auth_user_username_lower_idx" ON "auth_user" (LOWER("username"))',
+            reverse_sql='DROP INDEX IF EXISTS "auth_user_username_lower_idx"',
+        ),
+        migrations.RunSQL(
+            sql='CREATE INDEX IF NOT EXISTS "auth_user_email_lower_idx" ON "auth_user" (LOWER("email"))',
+            reverse_sql='DROP INDEX IF EXISTS "auth_user_email_lower_idx"',
+        ),
+    ]
@@ -1,12 +1,22 @@
+from asgiref.sync import sync_to_async
 from django.utils.timezone import now
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import F, Q
 from django.utils import timezone
+from itertools import islice
 from uuid import uuid4
 import re
 
+from baham.catalog import bump_catalog_version
 from baham.constants import COLOURS, TOWNS
 from baham.enum_types import VehicleType, VehicleStatus, UserType
+from baham.images import variant_urls
+from baham.occupancy import contract_changed, refresh_seats, sync_status
+from baham.routing import pack_waypoints, route_cells, unpack_waypoints
+from baham.schedules import bit as schedule_bit, day_bits
+from baham.sharding import enabled as sharding_enabled, mirror_catalog, shards, using_shard
+from baham.spatial import bounding_box, cell_filter, cell_for, distance_expression
 
 
 # Custom validators
@@ -18,8 +28,192 @@ def validate_colour(value):
     return re.fullmatch(regex, value)
 
 
+# Audit helpers
+_system_user = None
+
+
+def get_system_user():
+    '''
+    Return the system user recorded as the actor when none is given. It is looked up once per process
+    '''
+    global _system_user
+    if _system_user is None:
+        _system_user = User.objects.get(pk=1)
+    return _system_user
+
+
+def _chunks(objs, batch_size):
+    iterator = iter(objs)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class AuditedQuerySet(models.QuerySet):
+    def create(self, **kwargs):
+        '''
+        Unless the queryset names a database, let the routers choose it from the new row, so a sharded row is
+        created in the shard of its town
+        '''
+        if self._db is not None:
+            return super().create(**kwargs)
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
+    def bulk_create_audited(self, objs, created_by=None, batch_size=500):
+        '''
+        Insert objs in batches, filling the creation audit fields in memory instead of per-row save()
+        '''
+        if not created_by:
+            created_by = get_system_user()
+        created = []
+        for batch in _chunks(objs, batch_size):
+            date_created = timezone.now()
+            for obj in batch:
+                obj.date_created = date_created
+                obj.created_by = created_by
+            created.extend(self.bulk_create(batch, batch_size=batch_size))
+        return created
+
+    def bulk_update_audited(self, objs, fields, updated_by=None, batch_size=500):
+        '''
+        Update the given fields of objs in batches, stamping date_updated/updated_by in memory
+        '''
+        if not updated_by:
+            updated_by = get_system_user()
+        fields = list(fields) + [f for f in ('date_updated', 'updated_by') if f not in fields]
+        rows = 0
+        for batch in _chunks(objs, batch_size):
+            date_updated = timezone.now()
+            for obj in batch:
+                obj.date_updated = date_updated
+                obj.updated_by = updated_by
+            rows += self.bulk_update(batch, fields, batch_size=batch_size)
+        return rows
+
+
+class VoidableQuerySet(AuditedQuerySet):
+    def void(self, reason=None, voided_by=None):
+        '''
+        Void every row of the queryset with a single UPDATE. Returns the number of rows voided
+        '''
+        if not reason:
+            reason = 'Voided without providing a reason'
+        if not voided_by:
+            voided_by = get_system_user()
+        return self.filter(voided=False).update(voided=True, date_voided=timezone.now(), voided_by=voided_by,
+                                                void_reason=reason)
+
+    def undelete(self):
+        '''
+        Restore every voided row of the queryset with a single UPDATE. Returns the number of rows restored
+        '''
+        # date_updated is stamped so change feeds see the row come back
+        return self.filter(voided=True).update(voided=False, date_voided=None, voided_by=None, void_reason=None,
+                                               date_updated=timezone.now())
+
+
+AuditedManager = models.Manager.from_queryset(VoidableQuerySet)
+
+
+class VoidableManager(AuditedManager):
+    '''
+    Manager that hides voided rows. Use all_objects to reach them
+    '''
+    def get_queryset(self):
+        return super().get_queryset().filter(voided=False)
+
+
+class AuditedModel(models.Model):
+    '''
+    Shared save/update/delete behaviour for models carrying the audit and void fields
+    '''
+    objects = VoidableManager()
+    all_objects = AuditedManager()
+
+    class Meta:
+        abstract = True
+        # Admin, dumpdata and unique validation must still see voided rows
+        default_manager_name = 'all_objects'
+
+    def save(self, created_by=None, *args, **kwargs):
+        # The creation audit is written once; update() and delete() save through here too
+        if self._state.adding:
+            self.date_created = timezone.now()
+            if created_by:
+                self.created_by = created_by
+            elif self.created_by_id is None:
+                self.created_by = get_system_user()
+        super().save(**kwargs)
+    
+    def update(self, updated_by=None):
+        self.date_updated = timezone.now()
+        if (not updated_by):
+            updated_by = get_system_user()
+        self.updated_by = updated_by
+        self.save()
+
+    async def aupdate(self, updated_by=None):
+        return await sync_to_async(self.update)(updated_by)
+    
+    def delete(self, voided_by=None, *args, **kwargs):
+        self.voided = True
+        self.date_voided = timezone.now()
+        if (not self.void_reason):
+            self.void_reason = 'Voided without providing a reason'
+        if (not voided_by):
+            voided_by = get_system_user()
+        self.voided_by = voided_by
+        self.save()
+    
+    def undelete(self, updated_by=None):
+        if self.voided:
+            self.voided = False
+            self.date_voided = None
+            self.void_reason = None
+            self.voided_by = None
+            # Stamped like VoidableQuerySet.undelete(), so change feeds see the row come back
+            self.update(updated_by)
+    
+    def purge(self, *args, **kwargs):
+        self.delete()
+
+
+class ProfileQuerySet(VoidableQuerySet):
+    def nearby(self, latitude, longitude, radius_km):
+        '''
+        Profiles whose home lies within radius_km of the coordinate, nearest first, annotated with distance_km.
+        Grid cells and the bounding box prune candidates through indexes before the exact haversine check
+        '''
+        latitude, longitude = float(latitude), float(longitude)
+        min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+        queryset = self.filter(cell_filter('address_cell', latitude, longitude, radius_km),
+                               address_latitude__range=(min_lat, max_lat))
+        if min_lon >= -180 and max_lon <= 180:
+            queryset = queryset.filter(address_longitude__range=(min_lon, max_lon))
+        distance = distance_expression('address_latitude', 'address_longitude', latitude, longitude)
+        return queryset.annotate(distance_km=distance).filter(distance_km__lte=radius_km).order_by('distance_km')
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.address_cell = cell_for(obj.address_latitude, obj.address_longitude)
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if 'address_latitude' in fields or 'address_longitude' in fields:
+            objs = list(objs)
+            for obj in objs:
+                obj.address_cell = cell_for(obj.address_latitude, obj.address_longitude)
+            fields = list(fields) + ['address_cell']
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+
 # Create your models here.
-class UserProfile(models.Model):
+class UserProfile(AuditedModel):
     # Should have one-to-one relationship with Django user
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     birthdate = models.DateField()
@@ -30,6 +224,8 @@ class UserProfile(models.Model):
     address = models.CharField(max_length=255, blank=True)
     address_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     address_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    # Grid cell of the address coordinates (see baham.spatial), kept in sync on save
+    address_cell = models.IntegerField(null=True, editable=False)
     landmark = models.CharField(max_length=255, null=False)
     town = models.CharField(max_length=50, null=False, choices=[(c, c) for c in TOWNS])
     active = models.BooleanField(default=True, editable=False)
@@ -46,46 +242,67 @@ class UserProfile(models.Model):
     void_reason = models.CharField(null=True, max_length=1024, blank=True)
     uuid = models.UUIDField(default=uuid4, editable=False, unique=True)
 
+    objects = VoidableManager.from_queryset(ProfileQuerySet)()
+    all_objects = AuditedManager.from_queryset(ProfileQuerySet)()
+
+    class Meta(AuditedModel.Meta):
+        indexes = [
+            models.Index(fields=['town', 'type', 'active'], name='userprofile_town_type_idx'),
+            models.Index(fields=['address_cell'], name='userprofile_address_cell_idx'),
+        ]
+
     def __str__(self):
         return self.user.username
-    
-    def save(self, created_by=None, *args, **kwargs):
-        self.date_created = timezone.now()
-        if not created_by:
-            created_by = User.objects.get(pk=1)
-        self.created_by = created_by
-        super().save()
-    
-    def update(self, updated_by=None, *args, **kwargs):
-        self.date_updated = timezone.now()
-        if (not updated_by):
-            updated_by = User.objects.get(pk=1)
-        self.updated_by = updated_by
-        self.save()
-    
-    def delete(self, voided_by=None, *args, **kwargs):
-        self.voided = True
-        self.date_voided = timezone.now()
-        if (not self.void_reason):
-            self.void_reason = 'Voided without providing a reason'
-        if (not voided_by):
-            voided_by = User.objects.get(pk=1)
-        self.voided_by = voided_by
-        self.save()
-    
-    def undelete(self, *args, **kwargs):
-        if self.voided:
-            self.voided = False
-            self.date_voided = None
-            self.void_reason = None
-            self.voided_by = None
-            self.save()
-    
-    def purge(self, *args, **kwargs):
-        self.delete()
 
+    def save(self, *args, **kwargs):
+        self.address_cell = cell_for(self.address_latitude, self.address_longitude)
+        super().save(*args, **kwargs)
+
+
+class CatalogQuerySet(VoidableQuerySet):
+    '''
+    Queryset for VehicleModel whose bulk writes invalidate the cached catalog
+    '''
+    def _changed_pks(self):
+        # Only needed to mirror the change into the town shards
+        return list(self.values_list('pk', flat=True)) if sharding_enabled() else None
+
+    def update(self, **kwargs):
+        # Stamped so the collection's ETag and Last-Modified change with the rows
+        kwargs.setdefault('date_updated', timezone.now())
+        pks = self._changed_pks()
+        rows = super().update(**kwargs)
+        bump_catalog_version()
+        mirror_catalog(pks)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        bump_catalog_version()
+        mirror_catalog([obj.pk for obj in objs])
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if 'date_updated' not in fields:
+            date_updated = timezone.now()
+            for obj in objs:
+                obj.date_updated = date_updated
+            fields = [*fields, 'date_updated']
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        bump_catalog_version()
+        mirror_catalog([obj.pk for obj in objs])
+        return rows
+
+    def delete(self):
+        pks = self._changed_pks()
+        deleted = super().delete()
+        bump_catalog_version()
+        mirror_catalog(pks, deleted=True)
+        return deleted
 
-class VehicleModel(models.Model):
+
+class VehicleModel(AuditedModel):
     model_id = models.AutoField(primary_key=True, db_column='id')
     # Toyota, Honda, Suzuki, Kia, etc.
     vendor = models.CharField(max_length=20, null=False, blank=False)
@@ -107,49 +324,49 @@ class VehicleModel(models.Model):
     void_reason = models.CharField(null=True, max_length=1024, blank=True)
     uuid = models.UUIDField(default=uuid4, editable=False, unique=True)
 
-    class Meta:
+    objects = VoidableManager.from_queryset(CatalogQuerySet)()
+    all_objects = AuditedManager.from_queryset(CatalogQuerySet)()
+
+    class Meta(AuditedModel.Meta):
         db_table = "baham_vehicle_model"
+        indexes = [
+            # Catalog listing: non-voided models ordered by vendor
+            models.Index(fields=['vendor'], name='vehiclemodel_vendor_idx', condition=Q(voided=False)),
+            # Keyset pagination of the REST collection on (date_created, id)
+            models.Index(fields=['-date_created', '-model_id'], name='vehiclemodel_created_idx',
+                         condition=Q(voided=False)),
+            # Change feed: rows created, updated or voided since a point in time, voided rows included
+            models.Index(fields=['date_created'], name='vehiclemodel_changed_c_idx'),
+            models.Index(fields=['date_updated'], name='vehiclemodel_changed_u_idx'),
+            models.Index(fields=['date_voided'], name='vehiclemodel_changed_v_idx'),
+        ]
 
     def __str__(self):
         return f"{self.vendor} {self.model}"
-    
-    def save(self, created_by=None, *args, **kwargs):
-        self.date_created = timezone.now()
-        if not created_by:
-            created_by = User.objects.get(pk=1)
-        self.created_by = created_by
-        super().save()
-    
-    def update(self, updated_by=None, *args, **kwargs):
-        self.date_updated = timezone.now()
-        if (not updated_by):
-            updated_by = User.objects.get(pk=1)
-        self.updated_by = updated_by
-        self.save()
-    
-    def delete(self, voided_by=None, *args, **kwargs):
-        self.voided = True
-        self.date_voided = timezone.now()
-        if (not self.void_reason):
-            self.void_reason = 'Voided without providing a reason'
-        if (not voided_by):
-            voided_by = User.objects.get(pk=1)
-        self.voided_by = voided_by
-        self.save()
-    
-    def undelete(self, *args, **kwargs):
-        if self.voided:
-            self.voided = False
-            self.date_voided = None
-            self.void_reason = None
-            self.voided_by = None
-            self.save()
-    
-    def purge(self, *args, **kwargs):
-        self.delete()
 
+    def save(self, *args, **kwargs):
+        capacity_changed = self.pk and VehicleModel.all_objects.filter(pk=self.pk).exclude(
+            capacity=self.capacity).exists()
+        super().save(*args, **kwargs)
+        bump_catalog_version()
+        mirror_catalog([self.pk])
+        if capacity_changed:
+            for alias in shards():
+                with using_shard(alias):
+                    vehicle_ids = list(Vehicle.all_objects.filter(model=self).values_list('pk', flat=True))
+                    refresh_seats(vehicle_ids)
+                    sync_status(vehicle_ids)
+
+
+class VehicleQuerySet(VoidableQuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        created = super().bulk_create(objs, *args, **kwargs)
+        with using_shard(self.db):
+            refresh_seats([obj.pk for obj in created])
+        return created
 
-class Vehicle(models.Model):
+
+class Vehicle(AuditedModel):
     vehicle_id = models.AutoField(primary_key=True, db_column='id')
     # ABC-877
     registration_number = models.CharField(max_length=10, unique=True, null=False, blank=False,
@@ -160,6 +377,12 @@ class Vehicle(models.Model):
     status = models.CharField(max_length=50, choices=[(t.name, t.value) for t in VehicleStatus])
     picture1 = models.ImageField(upload_to='pictures', null=True)
     picture2 = models.ImageField(upload_to='pictures', null=True)
+    # Seats held by active contracts and seats left besides the driver's, kept up to date as contracts change
+    seats_taken = models.PositiveSmallIntegerField(default=0, editable=False)
+    seats_free = models.SmallIntegerField(default=0, editable=False)
+    # Bumped on every change to the seats or status, so bookings can compare-and-swap on it
+    version = models.PositiveIntegerField(default=0, editable=False)
+    COUNTERS = ('seats_taken', 'seats_free', 'version')
     # Audit fields
     date_created = models.DateTimeField(default=timezone.now, null=False, editable=False)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, null=False, editable=False, related_name='vehicle_creator')
@@ -171,46 +394,165 @@ class Vehicle(models.Model):
     void_reason = models.CharField(null=True, max_length=1024, blank=True)
     uuid = models.UUIDField(default=uuid4, editable=False, unique=True)
 
+    objects = VoidableManager.from_queryset(VehicleQuerySet)()
+    all_objects = AuditedManager.from_queryset(VehicleQuerySet)()
+
+    class Meta(AuditedModel.Meta):
+        indexes = [
+            # Listing by free seats without joining contracts
+            models.Index(fields=['status', 'seats_free'], name='vehicle_status_seats_idx', condition=Q(voided=False)),
+            # Vehicle listing: non-voided vehicles by status, newest first, keyset-paginated on (date_created, id)
+            models.Index(fields=['status', '-date_created', '-vehicle_id'], name='vehicle_status_created_idx',
+                         condition=Q(voided=False)),
+            # Change feed: rows created, updated or voided since a point in time, voided rows included
+            models.Index(fields=['date_created'], name='vehicle_changed_c_idx'),
+            models.Index(fields=['date_updated'], name='vehicle_changed_u_idx'),
+            models.Index(fields=['date_voided'], name='vehicle_changed_v_idx'),
+        ]
+
     def __str__(self):
         return f"{self.model.vendor} {self.model.model} {self.colour}"
-    
-    def save(self, created_by=None, *args, **kwargs):
-        self.date_created = timezone.now()
-        if not created_by:
-            created_by = User.objects.get(pk=1)
-        self.created_by = created_by
-        super().save()
-    
-    def update(self, updated_by=None, *args, **kwargs):
-        self.date_updated = timezone.now()
-        if (not updated_by):
-            updated_by = User.objects.get(pk=1)
-        self.updated_by = updated_by
-        self.save()
-    
-    def delete(self, voided_by=None, *args, **kwargs):
-        self.voided = True
-        self.date_voided = timezone.now()
-        if (not self.void_reason):
-            self.void_reason = 'Voided without providing a reason'
-        if (not voided_by):
-            voided_by = User.objects.get(pk=1)
-        self.voided_by = voided_by
-        super().save()
-    
-    def undelete(self, *args, **kwargs):
-        if self.voided:
-            self.voided = False
-            self.date_voided = None
-            self.void_reason = None
-            self.voided_by = None
-            self.save()
-    
-    def purge(self, *args, **kwargs):
-        self.delete()
 
+    @property
+    def picture1_variants(self):
+        return variant_urls(self.picture1.name)
+
+    @property
+    def picture2_variants(self):
+        return variant_urls(self.picture2.name)
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.seats_free = self.model.capacity - 1 - self.seats_taken
+            return super().save(*args, **kwargs)
+        previous = Vehicle.all_objects.using(self._state.db).filter(pk=self.pk).values('status', 'model_id').first()
+        if previous and kwargs.get('update_fields') is None:
+            # The counters are kept by single UPDATEs (baham.occupancy, baham.booking); writing back the values
+            # this instance loaded would undo bookings made since
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.COUNTERS]
+        super().save(*args, **kwargs)
+        if not previous:
+            return
+        with using_shard(self._state.db):
+            if previous['model_id'] != self.model_id:
+                # A new model brings a new capacity; refresh_seats() bumps the version
+                refresh_seats([self.pk])
+                sync_status([self.pk])
+            elif previous['status'] != self.status:
+                Vehicle.all_objects.filter(pk=self.pk).update(version=F('version') + 1)
+            else:
+                return
+        self.refresh_from_db(fields=[*self.COUNTERS, 'status'])
+
+
+class Route(AuditedModel):
+    route_id = models.AutoField(primary_key=True, db_column='id')
+    owner = models.ForeignKey(User, null=False, on_delete=models.CASCADE)
+    vehicle = models.ForeignKey(Vehicle, null=True, blank=True, on_delete=models.CASCADE)
+    name = models.CharField(max_length=100, blank=True)
+    # Waypoints from origin to destination packed as float32 (lat, lon) pairs, see baham.routing
+    polyline = models.BinaryField(null=False, editable=False)
+    min_latitude = models.FloatField(editable=False)
+    max_latitude = models.FloatField(editable=False)
+    min_longitude = models.FloatField(editable=False)
+    max_longitude = models.FloatField(editable=False)
+    # Audit fields
+    date_created = models.DateTimeField(default=timezone.now, null=False, editable=False)
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, null=False, editable=False, related_name='route_creator')
+    date_updated = models.DateTimeField(null=True)
+    updated_by = models.ForeignKey(User, null=True, on_delete=models.CASCADE, related_name='route_updater')
+    voided = models.BooleanField(default=False, null=False)
+    date_voided = models.DateTimeField(null=True)
+    voided_by = models.ForeignKey(User, null=True, on_delete=models.CASCADE, related_name='route_voider')
+    void_reason = models.CharField(null=True, max_length=1024, blank=True)
+    uuid = models.UUIDField(default=uuid4, editable=False, unique=True)
+
+    def __str__(self):
+        return self.name or f"{self.owner.username}'s route"
+
+    @property
+    def waypoints(self):
+        return unpack_waypoints(self.polyline)
+
+    @waypoints.setter
+    def waypoints(self, points):
+        points = [(float(lat), float(lon)) for lat, lon in points]
+        if not points:
+            raise ValueError('A route needs at least one waypoint')
+        self.polyline = pack_waypoints(points)
+        self.min_latitude = min(lat for lat, _ in points)
+        self.max_latitude = max(lat for lat, _ in points)
+        self.min_longitude = min(lon for _, lon in points)
+        self.max_longitude = max(lon for _, lon in points)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Rebuild the cell index of this route, in the route's database
+        cells = RouteCell.objects.using(self._state.db)
+        cells.filter(route=self).delete()
+        cells.bulk_create([RouteCell(route=self, cell=cell) for cell in route_cells(self.waypoints)])
+
+
+class RouteCell(models.Model):
+    '''
+    Grid cells crossed by a route; lets corridor matching look up routes by cell instead of scanning them all
+    '''
+    route = models.ForeignKey(Route, null=False, on_delete=models.CASCADE, related_name='cells')
+    cell = models.IntegerField(null=False)
 
-class Contract(models.Model):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cell', 'route'], name='routecell_cell_route_uniq'),
+        ]
+
+
+class ContractQuerySet(VoidableQuerySet):
+    def riding_at(self, day, slot=None):
+        '''
+        Contracts whose schedule includes the slot of the day (0 = Monday), or any slot of it if slot is None.
+        The check is a bitwise AND in SQL, so it combines with the other filters into one query
+        '''
+        mask = day_bits(day) if slot is None else schedule_bit(day, slot)
+        return self.alias(schedule_match=F('schedule').bitand(mask)).exclude(schedule_match=0)
+
+    def _refreshing_seats(self, change, vehicle_ids=None):
+        '''
+        Run a bulk change and recount the seats of the vehicles whose contracts it touched, atomically
+        '''
+        using = self._db or router.db_for_write(self.model, **self._hints)
+        with transaction.atomic(using=using), using_shard(using):
+            if vehicle_ids is None:
+                vehicle_ids = set(self.using(using).values_list('vehicle_id', flat=True))
+            result = change()
+            vehicle_ids = set(vehicle_ids)
+            refresh_seats(vehicle_ids)
+            sync_status(vehicle_ids)
+        return result
+
+    def void(self, *args, **kwargs):
+        return self._refreshing_seats(lambda: super(ContractQuerySet, self).void(*args, **kwargs))
+
+    def undelete(self):
+        return self._refreshing_seats(lambda: super(ContractQuerySet, self).undelete())
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        return self._refreshing_seats(lambda: super(ContractQuerySet, self).bulk_create(objs, *args, **kwargs),
+                                      [obj.vehicle_id for obj in objs])
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if not {'vehicle', 'vehicle_id', 'is_active', 'voided'} & set(fields):
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        # Vehicles a contract is moved away from need recounting too
+        vehicle_ids = set(self.filter(pk__in=[obj.pk for obj in objs]).values_list('vehicle_id', flat=True))
+        vehicle_ids.update(obj.vehicle_id for obj in objs)
+        return self._refreshing_seats(lambda: super(ContractQuerySet, self).bulk_update(objs, fields, *args, **kwargs),
+                                      vehicle_ids)
+
+
+class Contract(AuditedModel):
     contract_id = models.AutoField(primary_key=True, db_column='id')
     vehicle = models.ForeignKey(Vehicle, null=False, on_delete=models.CASCADE)
     companion = models.ForeignKey(UserProfile, null=False, on_delete=models.CASCADE)
@@ -219,7 +561,8 @@ class Contract(models.Model):
     is_active = models.BooleanField(default=True)
     fuel_share = models.PositiveSmallIntegerField(help_text="Percentage of fuel contribution.")
     maintenance_share = models.PositiveSmallIntegerField(help_text="Percentage of maintenance cost contribution.")
-    schedule = models.CharField(max_length=255, null=False)  #TODO: use Django Scheduler
+    # Days and time slots of the ride as a bitmask, see baham.schedules
+    schedule = models.BigIntegerField(null=False, default=0, help_text="Weekday x time-slot bitmask.")
     # Audit fields
     date_created = models.DateTimeField(default=timezone.now, null=False, editable=False)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, null=False, editable=False, related_name='contract_creator')
@@ -230,41 +573,30 @@ class Contract(models.Model):
     voided_by = models.ForeignKey(User, null=True, on_delete=models.CASCADE, related_name='contract_voider')
     void_reason = models.CharField(null=True, max_length=1024, blank=True)
     uuid = models.UUIDField(default=uuid4, editable=False, unique=True)
+
+    objects = VoidableManager.from_queryset(ContractQuerySet)()
+    all_objects = AuditedManager.from_queryset(ContractQuerySet)()
+
+    class Meta(AuditedModel.Meta):
+        indexes = [
+            models.Index(fields=['vehicle', 'is_active', 'expiry_date'], name='contract_vehicle_active_idx'),
+            # Expiry sweep: active contracts by expiry date, see baham.expiry
+            models.Index(fields=['expiry_date'], name='contract_active_expiry_idx', condition=Q(is_active=True)),
+        ]
     
     def __str__(self):
         return f"{self}" # TODO: Complete this
-    
-    def save(self, created_by=None, *args, **kwargs):
-        self.date_created = timezone.now()
-        if not created_by:
-            created_by = User.objects.get(pk=1)
-        self.created_by = created_by
-        super().save()
-    
-    def update(self, updated_by=None, *args, **kwargs):
-        self.date_updated = timezone.now()
-        if (not updated_by):
-            updated_by = User.objects.get(pk=1)
-        self.updated_by = updated_by
-        self.save()
-    
-    def delete(self, voided_by=None, *args, **kwargs):
-        self.voided = True
-        self.date_voided = timezone.now()
-        if (not self.void_reason):
-            self.void_reason = 'Voided without providing a reason'
-        if (not voided_by):
-            voided_by = User.objects.get(pk=1)
-        self.voided_by = voided_by
-        self.save()
-    
-    def undelete(self, *args, **kwargs):
-        if self.voided:
-            self.voided = False
-            self.date_voided = None
-            self.void_reason = None
-            self.voided_by = None
-            self.save()
-    
-    def purge(self, *args, **kwargs):
-        self.delete()
+
+    def save(self, *args, seat_claimed=False, **kwargs):
+        '''
+        seat_claimed is set by baham.booking, which has already taken the seat of a new contract
+        '''
+        using = kwargs.pop('using', None) or router.db_for_write(Contract, instance=self)
+        with transaction.atomic(using=using), using_shard(using):
+            previous = None
+            if self.pk:
+                previous = Contract.all_objects.using(using).filter(pk=self.pk).values_list(
+                    'vehicle_id', 'is_active', 'voided').first()
+            super().save(*args, using=using, **kwargs)
+            if not seat_claimed:
+                sync_status(contract_changed(previous, self))
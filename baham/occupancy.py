@@ -0,0 +1,71 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from baham.enum_types import VehicleStatus
+
+
+def occupies_seat(is_active, voided):
+    return bool(is_active) and not voided
+
+
+def adjust_seats(vehicle_id, delta):
+    '''
+    Move delta seats of the vehicle from free to taken in one UPDATE, relative to the stored counters.
+    The version is bumped so concurrent bookings notice the change, see baham.booking
+    '''
+    from baham.models import Vehicle
+    if delta:
+        Vehicle.all_objects.filter(pk=vehicle_id).update(seats_taken=F('seats_taken') + delta,
+                                                         seats_free=F('seats_free') - delta,
+                                                         version=F('version') + 1)
+
+
+def contract_changed(previous, contract):
+    '''
+    Apply a saved contract's effect on seat counters. previous is the (vehicle_id, is_active, voided) the row
+    had before the save, or None for a new contract. Returns the ids of the vehicles touched
+    '''
+    deltas = {}
+    if previous and occupies_seat(previous[1], previous[2]):
+        deltas[previous[0]] = -1
+    if occupies_seat(contract.is_active, contract.voided):
+        deltas[contract.vehicle_id] = deltas.get(contract.vehicle_id, 0) + 1
+    for vehicle_id, delta in deltas.items():
+        adjust_seats(vehicle_id, delta)
+    return [vehicle_id for vehicle_id, delta in deltas.items() if delta]
+
+
+def refresh_seats(vehicle_ids=None):
+    '''
+    Recount the seat counters of the given vehicles, or of all of them, from their active contracts in a
+    single UPDATE. Returns the number of vehicles updated
+    '''
+    from baham.models import Contract, Vehicle, VehicleModel
+    riders = Contract.objects.filter(vehicle=OuterRef('pk'), is_active=True).values('vehicle').annotate(
+        count=Count('pk')).values('count')
+    capacity = VehicleModel.all_objects.filter(pk=OuterRef('model_id')).values('capacity')
+    vehicles = Vehicle.all_objects.all()
+    if vehicle_ids is not None:
+        vehicles = vehicles.filter(pk__in=vehicle_ids)
+    # One seat is the driver's
+    return vehicles.update(seats_taken=Coalesce(Subquery(riders), Value(0)),
+                           seats_free=Subquery(capacity) - 1 - Coalesce(Subquery(riders), Value(0)),
+                           version=F('version') + 1)
+
+
+def sync_status(vehicle_ids=None, updated_by=None):
+    '''
+    Flip AVAILABLE vehicles without a free seat to FULL and FULL vehicles with one back to AVAILABLE.
+    Returns the number of vehicles changed
+    '''
+    from baham.models import Vehicle, get_system_user
+    vehicles = Vehicle.all_objects.all()
+    if vehicle_ids is not None:
+        vehicles = vehicles.filter(pk__in=vehicle_ids)
+    stamp = {'date_updated': timezone.now(), 'updated_by': updated_by or get_system_user(),
+             'version': F('version') + 1}
+    changed = vehicles.filter(status=VehicleStatus.AVAILABLE.name, seats_free__lte=0).update(
+        status=VehicleStatus.FULL.name, **stamp)
+    return changed + vehicles.filter(status=VehicleStatus.FULL.name, seats_free__gt=0).update(
+        status=VehicleStatus.AVAILABLE.name, **stamp)
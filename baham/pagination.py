@@ -0,0 +1,84 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(obj):
+    '''
+    Encode the (date_created, pk) position of obj as an opaque, URL-safe cursor
+    '''
+    raw = f"{obj.date_created.isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    '''
+    Decode a cursor produced by encode_cursor(). Raises ValueError when it is malformed
+    '''
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        date_created, pk = raw.split('|')
+        return datetime.fromisoformat(date_created), int(pk)
+    except (TypeError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE):
+    '''
+    Parse a page size from a request parameter, clamped to [1, MAX_PAGE_SIZE]
+    '''
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def page_queryset(queryset, cursor=None):
+    '''
+    queryset ordered newest first and started after cursor; a page is its first limit + 1 rows
+    '''
+    pk = queryset.model._meta.pk.name
+    queryset = queryset.order_by('-date_created', f'-{pk}')
+    if cursor:
+        date_created, last_pk = decode_cursor(cursor)
+        # The redundant upper bound lets the planner use the index as a range scan
+        queryset = queryset.filter(date_created__lte=date_created).filter(
+            Q(date_created__lt=date_created) | Q(date_created=date_created, **{f'{pk}__lt': last_pk}))
+    return queryset
+
+
+def _split_page(page, limit):
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
+
+
+def paginate(queryset, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    '''
+    Return one page of queryset, newest first, and the cursor of the next page (None on the last page).
+    Pages are keyed on (date_created, pk), so every page costs one index range scan regardless of depth
+    '''
+    return _split_page(list(page_queryset(queryset, cursor)[:limit + 1]), limit)
+
+
+def paginate_shards(queryset, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    '''
+    paginate() over the town shards of a sharded model: every shard's page is read at once and the pages are
+    merged on (date_created, pk), which ids unique across shards keep a total order
+    '''
+    from baham.sharding import scatter
+    page = scatter(page_queryset(queryset, cursor), key=lambda obj: (obj.date_created, obj.pk), reverse=True,
+                   limit=limit + 1)
+    return _split_page(page, limit)
+
+
+async def apaginate(queryset, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    '''
+    Async version of paginate()
+    '''
+    return _split_page([obj async for obj in page_queryset(queryset, cursor)[:limit + 1]], limit)
@@ -0,0 +1,106 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+
+from baham import sharding
+
+# Per-request routing state, set by baham.middleware.ReadYourWritesMiddleware. A dict rather than flags so
+# that writes made inside sync_to_async threads are seen by the middleware afterwards
+_request_state = ContextVar('baham_request_state', default=None)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def begin_request(pinned):
+    '''
+    Start routing a request. Reads go to the primary when pinned, else to a replica until the first write.
+    Returns the token to pass to end_request
+    '''
+    return _request_state.set({'pinned': pinned, 'wrote': False})
+
+
+def end_request(token):
+    '''
+    Stop routing the request. Returns whether it wrote to the primary
+    '''
+    state = _request_state.get()
+    _request_state.reset(token)
+    return bool(state and state['wrote'])
+
+
+class TownShardRouter:
+    '''
+    Sends profiles, vehicles, routes and contracts to their town's shard (see baham.sharding) when TOWN_SHARDS
+    is set. A new row is routed by its own fields, an existing one stays where it was loaded from, and a
+    related lookup follows the id it goes through. Queries with nothing to route by go to the shard selected
+    with sharding.using_shard(), else to 'default'; use sharding.scatter() to query every shard
+    '''
+    def shard(self, model, instance=None, **hints):
+        if not sharding.enabled() or not sharding.is_sharded(model):
+            return None
+        if instance is None:
+            return sharding.current_shard()
+        if isinstance(instance, model):
+            return sharding.shard_of(instance) if instance._state.adding else instance._state.db
+        if isinstance(instance, get_user_model()):
+            return sharding.shard_for_user(instance.pk)
+        for field in instance._meta.concrete_fields:
+            if field.is_relation and field.related_model is model:
+                return sharding.shard_for_pk(getattr(instance, field.attname))
+        if sharding.is_sharded(type(instance)):
+            return instance._state.db
+        return sharding.current_shard()
+
+    def db_for_read(self, model, **hints):
+        return self.shard(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self.shard(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Contracts refer to companions, and every sharded row to users, in other databases
+        if sharding.enabled() and {obj1._state.db, obj2._state.db} <= set(sharding.shards()):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db not in sharding.town_shards():
+            return None
+        return app_label == 'baham' and model_name in sharding.SHARDED_MODELS | sharding.MIRRORED_MODELS
+
+
+class PrimaryReplicaRouter:
+    '''
+    Sends writes to the primary and the reads of a request to a random replica (DATABASE_REPLICAS). A request
+    that has written, or whose client wrote within the last REPLICA_LAG seconds, keeps reading the primary so
+    it sees its own writes. Reads outside a request, e.g. in management commands, and session reads always use
+    the primary: a replica that has not caught up with a login would sign the user out
+    '''
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        if state is None or state['pinned'] or not replicas() or model._meta.app_label == 'sessions':
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas())
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['pinned'] = state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary and get its schema with its data
+        if db in replicas():
+            return False
+        return None
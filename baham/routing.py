@@ -0,0 +1,107 @@
+import math
+from array import array
+from collections import namedtuple
+
+from baham.spatial import CELL_SIZE, EARTH_RADIUS_KM, cell_filter, cell_for, haversine_km
+
+# Segments are sampled at half a cell so every cell a segment crosses is indexed within this tolerance
+SAMPLE_STEP = CELL_SIZE / 2
+SAMPLE_STEP_KM = math.radians(SAMPLE_STEP) * EARTH_RADIUS_KM
+
+RouteMatch = namedtuple('RouteMatch', ['route', 'distance_m', 'along_km'])
+
+
+def pack_waypoints(points):
+    '''
+    Pack [(lat, lon), ...] into a compact float32 blob (~0.5 m precision)
+    '''
+    return array('f', [float(value) for point in points for value in point]).tobytes()
+
+
+def unpack_waypoints(blob):
+    values = array('f')
+    values.frombytes(bytes(blob))
+    return list(zip(values[0::2], values[1::2]))
+
+
+def route_cells(points):
+    '''
+    Grid cells touched by the polyline, sampled every SAMPLE_STEP degrees along each segment
+    '''
+    cells = set()
+    for (lat1, lon1), (lat2, lon2) in zip(points, points[1:]):
+        steps = max(1, int(math.ceil(max(abs(lat2 - lat1), abs(lon2 - lon1)) / SAMPLE_STEP)))
+        for i in range(steps + 1):
+            cells.add(cell_for(lat1 + (lat2 - lat1) * i / steps, lon1 + (lon2 - lon1) * i / steps))
+    if len(points) == 1:
+        cells.add(cell_for(*points[0]))
+    return cells
+
+
+def route_length_km(points):
+    return sum(haversine_km(lat1, lon1, lat2, lon2) for (lat1, lon1), (lat2, lon2) in zip(points, points[1:]))
+
+
+def _project(latitude, longitude, origin_latitude, origin_longitude):
+    '''
+    Equirectangular projection to km around the origin, accurate at commute scale
+    '''
+    x = math.radians(longitude - origin_longitude) * EARTH_RADIUS_KM * math.cos(math.radians(origin_latitude))
+    y = math.radians(latitude - origin_latitude) * EARTH_RADIUS_KM
+    return x, y
+
+
+def closest_point(points, latitude, longitude, within_km):
+    '''
+    (distance_km, along_km) from the coordinate to the nearest point of the polyline, where along_km is how far
+    down the route that point lies. Segments whose bounding box is further than within_km are skipped.
+    Returns None if no segment passes within within_km
+    '''
+    margin_lat = math.degrees(within_km / EARTH_RADIUS_KM)
+    margin_lon = margin_lat / max(math.cos(math.radians(latitude)), 1e-9)
+    best = None
+    along = 0.0
+    for (lat1, lon1), (lat2, lon2) in zip(points, points[1:]):
+        ax, ay = _project(lat1, lon1, latitude, longitude)
+        bx, by = _project(lat2, lon2, latitude, longitude)
+        length = math.hypot(bx - ax, by - ay)
+        if (min(lat1, lat2) - margin_lat <= latitude <= max(lat1, lat2) + margin_lat and
+                min(lon1, lon2) - margin_lon <= longitude <= max(lon1, lon2) + margin_lon):
+            t = 0.0 if length == 0 else max(0.0, min(1.0, -(ax * (bx - ax) + ay * (by - ay)) / length ** 2))
+            distance = math.hypot(ax + t * (bx - ax), ay + t * (by - ay))
+            if distance <= within_km and (best is None or distance < best[0]):
+                best = (distance, along + t * length)
+        along += length
+    if best is None and len(points) == 1:
+        distance = math.hypot(*_project(points[0][0], points[0][1], latitude, longitude))
+        if distance <= within_km:
+            best = (distance, 0.0)
+    return best
+
+
+def routes_near(latitude, longitude, within_m, queryset=None):
+    '''
+    Routes passing within within_m metres of the coordinate, nearest first. The route cell index narrows the
+    search to routes crossing nearby cells; only their nearby segments are measured exactly
+    '''
+    from baham.models import Route, RouteCell
+    latitude, longitude = float(latitude), float(longitude)
+    within_km = within_m / 1000
+    candidates = RouteCell.objects.filter(cell_filter('cell', latitude, longitude, within_km + SAMPLE_STEP_KM))
+    if queryset is None:
+        queryset = Route.objects.all()
+    matches = []
+    for route in queryset.filter(route_id__in=candidates.values('route_id')).select_related('owner'):
+        closest = closest_point(route.waypoints, latitude, longitude, within_km)
+        if closest:
+            matches.append(RouteMatch(route, closest[0] * 1000, closest[1]))
+    return sorted(matches, key=lambda match: match.distance_m)
+
+
+def match_companion(profile, within_m=500):
+    '''
+    Routes of owners that pass within within_m metres of the companion's home
+    '''
+    if profile.address_latitude is None or profile.address_longitude is None:
+        return []
+    return routes_near(profile.address_latitude, profile.address_longitude, within_m)
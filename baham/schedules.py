@@ -0,0 +1,144 @@
+import re
+
+from baham.constants import SCHEDULE_SLOTS, WEEKDAYS
+
+# A schedule is a bitmask with one bit per (weekday, slot): bit = day * len(SCHEDULE_SLOTS) + slot,
+# Monday being day 0. 7 days x 8 slots fit in a BigIntegerField
+SLOTS_PER_DAY = len(SCHEDULE_SLOTS)
+DAY_MASK = (1 << SLOTS_PER_DAY) - 1
+FULL_WEEK = (1 << (len(WEEKDAYS) * SLOTS_PER_DAY)) - 1
+
+_DAY_NAMES = {name[:3].lower(): index for index, name in enumerate(WEEKDAYS)}
+_DAY_PATTERN = re.compile(r'\b(mon|tue|wed|thu|fri|sat|sun)[a-z]*\.?(?:\s*(?:-|to)\s*(mon|tue|wed|thu|fri|sat|sun)[a-z]*)?',
+                          re.IGNORECASE)
+_TIME = r'(\d{1,2})(?::(\d{2}))?\s*(am|pm)?'
+_TIME_PATTERN = re.compile(_TIME + r'(?:\s*(?:-|to)\s*' + _TIME + r')?', re.IGNORECASE)
+
+
+def bit(day, slot):
+    return 1 << (day * SLOTS_PER_DAY + slot)
+
+
+def day_bits(day):
+    '''
+    Mask of every slot of the day
+    '''
+    return DAY_MASK << (day * SLOTS_PER_DAY)
+
+
+def encode(days, slots):
+    '''
+    Mask of every combination of the given day and slot indices
+    '''
+    mask = 0
+    for day in days:
+        for slot in slots:
+            mask |= bit(day, slot)
+    return mask
+
+
+def slot_for(hour):
+    '''
+    Index of the slot containing the hour, or None outside the scheduled hours
+    '''
+    for index, (start, end) in enumerate(SCHEDULE_SLOTS):
+        if start <= hour < end:
+            return index
+    return None
+
+
+def _hour(hours, minutes, meridiem):
+    hour = int(hours) % 24 + int(minutes or 0) / 60
+    if meridiem and meridiem.lower() == 'pm' and hour < 12:
+        hour += 12
+    elif meridiem and meridiem.lower() == 'am' and hour >= 12:
+        hour -= 12
+    return hour
+
+
+def _days(text):
+    lowered = text.lower()
+    days = set()
+    if 'weekday' in lowered:
+        days.update(range(5))
+    if 'weekend' in lowered:
+        days.update((5, 6))
+    for first, last in _DAY_PATTERN.findall(text):
+        start = _DAY_NAMES[first.lower()]
+        end = _DAY_NAMES[last.lower()] if last else start
+        days.update(range(start, end + 1) if start <= end else list(range(start, 7)) + list(range(end + 1)))
+    return days
+
+
+def _slots(text):
+    slots = set()
+    for hours, minutes, meridiem, end_hours, end_minutes, end_meridiem in _TIME_PATTERN.findall(text):
+        if (not meridiem and not minutes and not end_hours) or int(hours) > 24 or int(end_hours or 0) > 24:
+            # A bare number is more likely a date or a count than a time
+            continue
+        start = _hour(hours, minutes, meridiem or end_meridiem)
+        if end_hours:
+            end = _hour(end_hours, end_minutes, end_meridiem)
+            slots.update(index for index, (slot_start, slot_end) in enumerate(SCHEDULE_SLOTS)
+                         if slot_start < end and start < slot_end)
+        else:
+            slots.add(slot_for(start))
+    slots.discard(None)
+    return slots
+
+
+def parse(text):
+    '''
+    Best-effort parse of a free-text schedule such as "Mon, Thu 8am", "Mon-Fri 7:30-17:00" or "weekdays".
+    Clauses are split on commas and semicolons: times go with the days of their clause and of the day-only
+    clauses just before it, or with the previous days when their clause names none, so what describe()
+    writes reads back unchanged. Days default to the whole week and times to the whole day, so anything
+    unrecognised counts as riding at any time rather than freeing a seat that may be taken
+    '''
+    mask, days, slots, pending = 0, None, set(), set()
+    for clause in re.split(r'[,;]', text or ''):
+        clause_days, clause_slots = _days(clause), _slots(clause)
+        if not clause_slots:
+            pending |= clause_days
+            continue
+        if clause_days or pending or days is None:
+            days, slots, pending = (clause_days | pending) or range(len(WEEKDAYS)), set(), set()
+        slots |= clause_slots
+        mask |= encode(days, slots)
+    if pending:
+        # Days named after the last times share them ("Mon 8am, Thu"); days named alone ride all day
+        mask |= encode(pending, slots or range(SLOTS_PER_DAY))
+    return mask or FULL_WEEK
+
+
+def _runs(slots):
+    '''
+    "HH:00-HH:00" of each run of adjacent slots in a day's slot mask
+    '''
+    runs = []
+    for slot, (start, end) in enumerate(SCHEDULE_SLOTS):
+        if not slots & (1 << slot):
+            continue
+        if runs and runs[-1][1] == start and slots & (1 << (slot - 1)):
+            runs[-1][1] = end
+        else:
+            runs.append([start, end])
+    return [f'{start:02d}:00-{end:02d}:00' for start, end in runs]
+
+
+def describe(mask):
+    '''
+    Human readable form of a mask that parse() reads back, e.g. "Monday-Friday 08:00-10:00, 16:00-18:00;
+    Saturday 10:00-14:00". Adjacent days riding at the same times share a range
+    '''
+    groups = []
+    for day in range(len(WEEKDAYS)):
+        slots = (mask >> (day * SLOTS_PER_DAY)) & DAY_MASK
+        if not slots:
+            continue
+        if groups and groups[-1][1] == day - 1 and groups[-1][2] == slots:
+            groups[-1][1] = day
+        else:
+            groups.append([day, day, slots])
+    return '; '.join(f'{WEEKDAYS[first] if first == last else f"{WEEKDAYS[first]}-{WEEKDAYS[last]}"} '
+                     f'{", ".join(_runs(slots))}' for first, last, slots in groups)
@@ -0,0 +1,212 @@
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import chain, islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, models
+
+# Models partitioned by town. The vehicle model catalog is mirrored into every shard so joins and seat counts
+# work inside a shard; users and everything else stay in 'default'
+SHARDED_MODELS = {'userprofile', 'vehicle', 'route', 'routecell', 'contract'}
+MIRRORED_MODELS = {'vehiclemodel'}
+# Shard n allocates ids from n * SHARD_ID_SPAN, so the shard of a row can be told from its id alone
+SHARD_ID_SPAN = 10 ** 8
+USER_SHARD_TIMEOUT = 60 * 60
+
+_current_shard = ContextVar('baham_current_shard', default=None)
+_executor = None
+
+
+def town_shards():
+    '''
+    {alias: [town, ...]} of the configured shards, empty when sharding is off
+    '''
+    return getattr(settings, 'TOWN_SHARDS', {})
+
+
+def enabled():
+    return bool(town_shards())
+
+
+def shards():
+    '''
+    Every database holding sharded rows: 'default', which keeps the rows without a town, then the town shards
+    '''
+    return [DEFAULT_DB_ALIAS, *town_shards()]
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'baham' and model._meta.model_name in SHARDED_MODELS
+
+
+def shard_for_town(town):
+    for alias, towns in town_shards().items():
+        if town in towns:
+            return alias
+    return DEFAULT_DB_ALIAS
+
+
+def shard_for_pk(pk):
+    '''
+    The shard a sharded row with this id was created in
+    '''
+    aliases = shards()
+    if pk is None or not enabled() or not 0 <= pk // SHARD_ID_SPAN < len(aliases):
+        return DEFAULT_DB_ALIAS
+    return aliases[pk // SHARD_ID_SPAN]
+
+
+def _user_shard_key(user_id):
+    return f'baham:shard:user:{user_id}'
+
+
+def shard_for_user(user_id):
+    '''
+    The shard holding the user's profile, where their vehicles, routes and contracts live too. Users without
+    a profile belong to 'default'
+    '''
+    from baham.models import UserProfile
+    if user_id is None or not enabled():
+        return DEFAULT_DB_ALIAS
+    alias = cache.get(_user_shard_key(user_id))
+    if alias is None:
+        found = scatter_map(lambda alias: UserProfile.all_objects.using(alias).filter(user_id=user_id).exists())
+        alias = next((alias for alias, exists in found.items() if exists), None)
+        if alias is None:
+            # Not cached: the cache is per process, and a profile saved by another worker would not clear it
+            return DEFAULT_DB_ALIAS
+        # A profile never leaves the shard it was created in, so a found shard stays right
+        cache.set(_user_shard_key(user_id), alias, USER_SHARD_TIMEOUT)
+    return alias
+
+
+def remember_profile_shard(sender, instance, **kwargs):
+    '''
+    post_save handler: a new profile decides the shard of its user
+    '''
+    if enabled():
+        cache.set(_user_shard_key(instance.user_id), instance._state.db, USER_SHARD_TIMEOUT)
+
+
+def shard_of(instance):
+    '''
+    The shard a new sharded row belongs in: a profile's is its town's, a vehicle's or route's is its owner's,
+    a contract's is its vehicle's and a route cell's its route's. A profile whose town later moves to another
+    group stays where it was created
+    '''
+    name = instance._meta.model_name
+    if name == 'userprofile':
+        return shard_for_town(instance.town)
+    if name in ('vehicle', 'route'):
+        return shard_for_user(instance.owner_id)
+    if name == 'contract':
+        return shard_for_pk(instance.vehicle_id)
+    return shard_for_pk(instance.route_id)
+
+
+def current_shard():
+    return _current_shard.get()
+
+
+@contextmanager
+def using_shard(alias):
+    '''
+    Send the queries on sharded models that name no database, and carry no instance to route them by, to
+    alias for the duration of the block
+    '''
+    token = _current_shard.set(alias)
+    try:
+        yield alias
+    finally:
+        _current_shard.reset(token)
+
+
+def _on_shard(func, alias):
+    try:
+        return func(alias)
+    finally:
+        if alias is not None:
+            connections[alias].close_if_unusable_or_obsolete()
+
+
+def scatter_map(func):
+    '''
+    {alias: func(alias)} over every shard, run concurrently unless a transaction is open in this thread.
+    Without sharding func is called once with None, which using() takes as "let the routers choose"
+    '''
+    global _executor
+    if not enabled():
+        return {DEFAULT_DB_ALIAS: func(None)}
+    if any(connections[alias].in_atomic_block for alias in shards()):
+        # Other threads have connections of their own, which cannot see this transaction's writes
+        return {alias: func(alias) for alias in shards()}
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=len(shards()), thread_name_prefix='baham-shards')
+    futures = {alias: _executor.submit(_on_shard, func, alias) for alias in shards()}
+    return {alias: future.result() for alias, future in futures.items()}
+
+
+def scatter(queryset, key=None, reverse=False, limit=None):
+    '''
+    The rows of queryset from every shard. With key, each shard's rows must already be ordered by it and are
+    merged into one ordered list; limit caps the rows taken from each shard and in all
+    '''
+    def gather(alias):
+        rows = queryset.using(alias)
+        return list(rows[:limit] if limit is not None else rows)
+
+    results = scatter_map(gather).values()
+    rows = heapq.merge(*results, key=key, reverse=reverse) if key else chain(*results)
+    return list(islice(rows, limit))
+
+
+def locate(queryset):
+    '''
+    The first row of queryset found on any shard, or None. Meant for lookups by a unique field such as uuid
+    '''
+    if not queryset.ordered:
+        queryset = queryset.order_by('pk')
+    return next(iter(scatter(queryset[:1])), None)
+
+
+def mirror_catalog(pks=None, deleted=False):
+    '''
+    Copy vehicle models, all or those with the given ids, from 'default' to every shard, or delete them there
+    when deleted is set
+    '''
+    from baham.models import VehicleModel
+    if not enabled():
+        return
+    if deleted:
+        for alias in town_shards():
+            models.QuerySet(VehicleModel, using=alias).filter(pk__in=list(pks)).delete()
+        return
+    rows = VehicleModel.all_objects.using(DEFAULT_DB_ALIAS).order_by('pk')
+    if pks is not None:
+        rows = rows.filter(pk__in=list(pks))
+    fields = [field.name for field in VehicleModel._meta.concrete_fields if not field.primary_key]
+    iterator = rows.iterator(chunk_size=1000)
+    while batch := list(islice(iterator, 1000)):
+        for alias in town_shards():
+            models.QuerySet(VehicleModel, using=alias).bulk_create(
+                batch, update_conflicts=True, unique_fields=['model_id'], update_fields=fields)
+
+
+def seed_id_ranges(using, **kwargs):
+    '''
+    post_migrate handler: start the ids of the sharded tables of a town shard at its range
+    '''
+    from django.apps import apps
+    aliases = shards()
+    if not enabled() or using not in aliases[1:]:
+        return
+    start = aliases.index(using) * SHARD_ID_SPAN
+    with connections[using].cursor() as cursor:
+        for name in SHARDED_MODELS:
+            table = apps.get_model('baham', name)._meta.db_table
+            cursor.execute('UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s', [start, table])
+            cursor.execute('INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s WHERE NOT EXISTS '
+                           '(SELECT 1 FROM sqlite_sequence WHERE name = %s)', [table, start, table])
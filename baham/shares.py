@@ -0,0 +1,106 @@
+import math
+from collections import defaultdict
+
+import numpy as np
+
+from baham.routing import closest_point, route_length_km
+from baham.sharding import shard_for_pk, shards, using_shard
+
+
+def leg_shares(vehicles, pickups, lengths):
+    '''
+    Percentage of a trip's cost owed by each rider, for many vehicles at once. Rider i boards vehicle
+    vehicles[i] pickups[i] km down a route of lengths[i] km and rides to its end. Every leg between two
+    boardings is split equally between the driver and the riders on board, so a rider picked up late pays
+    only for the part of the route they actually ride
+    '''
+    vehicles = np.asarray(vehicles)
+    lengths = np.asarray(lengths, dtype=float)
+    pickups = np.clip(np.asarray(pickups, dtype=float), 0, lengths)
+    order = np.lexsort((pickups, vehicles))
+    vehicles, pickups, lengths = vehicles[order], pickups[order], lengths[order]
+    count = len(vehicles)
+    positions = np.arange(count)
+    group_start = np.searchsorted(vehicles, vehicles, side='left')
+    group_end = np.searchsorted(vehicles, vehicles, side='right')
+    on_board = positions - group_start + 1
+    last = positions == group_end - 1
+    next_pickup = np.where(last, lengths, np.append(pickups[1:], 0))
+    # Cost of the leg up to the next boarding, per person in the car (the driver included)
+    per_person = (next_pickup - pickups) / (on_board + 1)
+    # A rider pays their part of every leg from their boarding to the end of the route
+    remaining = np.append(np.cumsum(per_person[::-1])[::-1], 0)
+    owed = remaining[positions] - remaining[group_end]
+    percentages = np.empty(count)
+    percentages[order] = np.divide(owed * 100, lengths, out=np.zeros(count), where=lengths > 0)
+    return percentages
+
+
+def vehicle_routes(vehicles):
+    '''
+    The route each vehicle drives: the newest one attached to it, else its owner's newest unattached route
+    '''
+    from baham.models import Route
+    routes = {}
+    by_owner = {}
+    for route in Route.objects.filter(owner__in={vehicle.owner_id for vehicle in vehicles}).order_by('date_created'):
+        if route.vehicle_id:
+            routes[route.vehicle_id] = route
+        else:
+            by_owner[route.owner_id] = route
+    return {vehicle.pk: routes.get(vehicle.pk, by_owner.get(vehicle.owner_id)) for vehicle in vehicles}
+
+
+def companion_homes(profile_ids):
+    '''
+    {profile id: (latitude, longitude)} of the profiles with coordinates. A contract's companion may live in
+    another shard than the contract, so each profile is read from the shard its id belongs to
+    '''
+    from baham.models import UserProfile
+    by_shard = defaultdict(list)
+    for pk in profile_ids:
+        by_shard[shard_for_pk(pk)].append(pk)
+    homes = {}
+    for alias, pks in by_shard.items():
+        homes.update((pk, (float(lat), float(lon))) for pk, lat, lon in UserProfile.all_objects.using(alias).filter(
+            pk__in=pks, address_latitude__isnull=False, address_longitude__isnull=False).values_list(
+            'pk', 'address_latitude', 'address_longitude'))
+    return homes
+
+
+def recompute_shares(batch_size=500):
+    '''
+    Recompute fuel and maintenance shares of every active contract from each companion's boarding point on
+    the vehicle's route. Contracts on vehicles without a route, or whose companion has no coordinates, keep
+    their shares. Every town shard is done in turn. Returns the number of contracts updated
+    '''
+    updated = 0
+    for alias in shards():
+        with using_shard(alias):
+            updated += _recompute(batch_size)
+    return updated
+
+
+def _recompute(batch_size):
+    from baham.models import Contract, Vehicle
+    contracts = list(Contract.objects.filter(is_active=True))
+    homes = companion_homes({contract.companion_id for contract in contracts})
+    # A vehicle, its owner's routes and its contracts share a shard
+    routes = vehicle_routes(Vehicle.all_objects.filter(pk__in={contract.vehicle_id for contract in contracts}))
+    waypoints, lengths = {}, {}
+    for vehicle_id, route in routes.items():
+        if route:
+            waypoints[vehicle_id] = route.waypoints
+            lengths[vehicle_id] = route_length_km(waypoints[vehicle_id])
+    contracts = [contract for contract in contracts
+                 if contract.vehicle_id in waypoints and contract.companion_id in homes]
+    if not contracts:
+        return 0
+    pickups = [closest_point(waypoints[contract.vehicle_id], *homes[contract.companion_id], math.inf)[1]
+               for contract in contracts]
+    percentages = leg_shares([contract.vehicle_id for contract in contracts], pickups,
+                             [lengths[contract.vehicle_id] for contract in contracts])
+    for contract, percentage in zip(contracts, np.rint(percentages).astype(int)):
+        contract.fuel_share = int(percentage)
+        contract.maintenance_share = int(percentage)
+    return Contract.objects.bulk_update_audited(contracts, ['fuel_share', 'maintenance_share'], batch_size=batch_size)
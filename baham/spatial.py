@@ -0,0 +1,72 @@
+import math
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+# Side of a grid cell in degrees (~1.1 km of latitude). Cells are numbered row-major, so each grid row
+# of a bounding box is one contiguous range of cell ids
+CELL_SIZE = 0.01
+GRID_COLUMNS = int(round(360 / CELL_SIZE))
+
+
+def cell_for(latitude, longitude):
+    '''
+    Grid cell id of a coordinate, or None if either part is missing
+    '''
+    if latitude is None or longitude is None:
+        return None
+    row = int(math.floor((float(latitude) + 90) / CELL_SIZE))
+    column = int(math.floor((float(longitude) + 180) / CELL_SIZE)) % GRID_COLUMNS
+    return row * GRID_COLUMNS + column
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    '''
+    (min_lat, max_lat, min_lon, max_lon) enclosing the circle of radius_km around the coordinate
+    '''
+    delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(latitude))
+    delta_lon = 180.0 if cos_lat < 1e-9 else min(180.0, delta_lat / cos_lat)
+    return (max(-90.0, latitude - delta_lat), min(90.0, latitude + delta_lat),
+            longitude - delta_lon, longitude + delta_lon)
+
+
+def cell_filter(field, latitude, longitude, radius_km):
+    '''
+    Q matching the grid cells that overlap the bounding box of the circle: one id range per grid row
+    '''
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+    first_row = cell_for(min_lat, 0) // GRID_COLUMNS
+    last_row = cell_for(max_lat, 0) // GRID_COLUMNS
+    if max_lon - min_lon >= 360:
+        return Q(**{f'{field}__range': (first_row * GRID_COLUMNS, (last_row + 1) * GRID_COLUMNS - 1)})
+    first_column = cell_for(0, min_lon) % GRID_COLUMNS
+    last_column = cell_for(0, max_lon) % GRID_COLUMNS
+    column_ranges = [(first_column, last_column)]
+    if first_column > last_column:
+        # The box crosses the antimeridian
+        column_ranges = [(first_column, GRID_COLUMNS - 1), (0, last_column)]
+    query = Q()
+    for row in range(first_row, last_row + 1):
+        for start, end in column_ranges:
+            query |= Q(**{f'{field}__range': (row * GRID_COLUMNS + start, row * GRID_COLUMNS + end)})
+    return query
+
+
+def distance_expression(latitude_field, longitude_field, latitude, longitude):
+    '''
+    Haversine distance in km from the coordinate to the row's coordinate, as a database expression
+    '''
+    lat0, lon0 = math.radians(latitude), math.radians(longitude)
+    row_lat = Radians(F(latitude_field), output_field=FloatField())
+    row_lon = Radians(F(longitude_field), output_field=FloatField())
+    a = Power(Sin((row_lat - Value(lat0)) / 2), 2) + \
+        Value(math.cos(lat0)) * Cos(row_lat) * Power(Sin((row_lon - Value(lon0)) / 2), 2)
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(a))
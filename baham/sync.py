@@ -0,0 +1,168 @@
+import base64
+import binascii
+import heapq
+import json
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import islice
+from operator import itemgetter
+
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.utils import timezone
+
+from baham.models import Vehicle, VehicleModel
+from baham.pagination import MAX_PAGE_SIZE
+from baham.sharding import is_sharded, scatter
+
+VEHICLE_MODEL_FIELDS = ('uuid', 'vendor', 'model', 'type', 'capacity', 'date_created', 'date_updated')
+# Users stay in 'default' while vehicles may live in a town shard, so owners are read by id and their usernames
+# looked up afterwards (see _owner_names) rather than joined
+VEHICLE_FIELDS = ('uuid', 'registration_number', 'colour', 'model__uuid', 'owner_id', 'status',
+                  'date_created', 'date_updated')
+FEEDS = {
+    'vehicle_models': (VehicleModel, VEHICLE_MODEL_FIELDS),
+    'vehicles': (Vehicle, VEHICLE_FIELDS),
+}
+# Timestamps are taken in Python before the transaction commits, and under WAL readers do not wait for writers,
+# so a row stamped just before now may not be visible yet. Windows end this far in the past to let such
+# writes commit before they are read
+COMMIT_MARGIN = timedelta(seconds=5)
+
+
+# Each feed is read as one stream per timestamp column, paged on (timestamp, id) so that the window's bounds
+# drive that column's index (migration 0009). A first sync reads live rows by date_created alone
+STREAMS = ('date_created', 'date_updated', 'date_voided')
+
+
+def encode_token(since, until=None, after=None):
+    '''
+    Token of a window: the rows changed in (since, until]. after holds, for each feed, the (timestamp, id)
+    reached in each of its streams not yet exhausted, or None for a stream not started. Without until, the
+    token starts a new window at since
+    '''
+    state = {'since': since.isoformat() if since else None}
+    if until:
+        state.update(until=until.isoformat(), after={
+            name: {column: [position[0].isoformat(), position[1]] if position else None
+                   for column, position in streams.items()}
+            for name, streams in after.items()})
+    return base64.urlsafe_b64encode(json.dumps(state).encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    '''
+    Decode a sync token produced by encode_token() into (since, until, after). Raises ValueError when it is
+    malformed
+    '''
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        if not raw.startswith('{'):
+            # Tokens issued before the feed was paged hold just the end of the last window
+            return datetime.fromisoformat(raw), None, None
+        state = json.loads(raw)
+        since = datetime.fromisoformat(state['since']) if state['since'] else None
+        if 'until' not in state:
+            return since, None, None
+        after = {}
+        for name in FEEDS:
+            streams = state['after'][name]
+            if set(streams) - set(STREAMS):
+                raise KeyError(name)
+            after[name] = {column: (datetime.fromisoformat(position[0]), int(position[1])) if position else None
+                           for column, position in streams.items()}
+        return since, datetime.fromisoformat(state['until']), after
+    except (TypeError, KeyError, IndexError, AttributeError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError('Invalid sync token') from e
+
+
+def stream(model, column, since, until, position=None):
+    '''
+    Rows of model whose column falls in (since, until], ordered by (column, id) and starting after position,
+    as a range scan of the column's index. Without since, the live rows created up to until
+    '''
+    queryset = model.all_objects.filter(**{f'{column}__lte': until}).order_by(column, 'pk')
+    if since:
+        queryset = queryset.filter(**{f'{column}__gt': since})
+    else:
+        queryset = queryset.filter(voided=False)
+    if position:
+        moment, pk = position
+        # The redundant lower bound lets the planner keep the index range scan
+        queryset = queryset.filter(**{f'{column}__gte': moment}).filter(
+            Q(**{f'{column}__gt': moment}) | Q(**{column: moment, 'pk__gt': pk}))
+    return queryset
+
+
+def _changes(model, fields, since, until, after, limit):
+    '''
+    The next limit rows changed in the window, merged from the streams in after by (timestamp, id), and the
+    streams' new positions; a stream is dropped from them once exhausted
+    '''
+    entries = {}
+    for column, position in after.items():
+        queryset = stream(model, column, since, until, position).values('pk', *fields, 'voided', 'date_voided')
+        if is_sharded(model):
+            # Each shard allocates ids from its own range, so merging the shards by (timestamp, id) pages them
+            rows = scatter(queryset, key=itemgetter(column, 'pk'), limit=limit + 1)
+        else:
+            rows = list(queryset[:limit + 1])
+        entries[column] = [(row[column], row['pk'], column, row) for row in rows]
+    taken = list(islice(heapq.merge(*entries.values(), key=itemgetter(0, 1)), limit))
+    positions = dict(after)
+    for moment, pk, column, _ in taken:
+        positions[column] = (moment, pk)
+    consumed = Counter(column for _, _, column, _ in taken)
+    for column, rows in entries.items():
+        if len(rows) <= limit and consumed[column] == len(rows):
+            del positions[column]
+    rows = list({pk: row for _, pk, _, row in taken}.values())
+    if 'owner_id' in fields:
+        _owner_names(rows)
+    changed, deleted = [], []
+    for row in rows:
+        row.pop('pk')
+        if row.pop('voided'):
+            deleted.append({'uuid': row['uuid'], 'date_voided': row['date_voided']})
+        else:
+            row.pop('date_voided')
+            changed.append({name.split('__')[0]: value for name, value in row.items()})
+    return {'changed': changed, 'deleted': deleted}, positions
+
+
+def _owner_names(rows):
+    '''
+    Replace the owner_id of each row with an owner entry holding the owner's username, read from 'default'
+    '''
+    names = dict(User.objects.filter(pk__in={row['owner_id'] for row in rows}).values_list('pk', 'username'))
+    for row in rows:
+        row['owner'] = names.get(row.pop('owner_id'))
+
+
+def changes_since(token=None, limit=MAX_PAGE_SIZE):
+    '''
+    Return up to limit vehicle models and vehicles changed since token (everything live if token is None),
+    with tombstones for voided rows, and the token to pass on the next call. While more is set the window is
+    not exhausted and the next call continues it; a row changed again meanwhile may come twice, so clients
+    apply rows by uuid
+    '''
+    since, until, after = decode_token(token) if token else (None, None, None)
+    if not until:
+        # A new window, ending a little in the past (see COMMIT_MARGIN)
+        until = timezone.now() - COMMIT_MARGIN
+        if since:
+            until = max(until, since)
+        after = {name: dict.fromkeys(STREAMS if since else STREAMS[:1]) for name in FEEDS}
+    result = {}
+    remaining = {}
+    for name, (model, fields) in FEEDS.items():
+        if not after[name]:
+            result[name] = {'changed': [], 'deleted': []}
+            continue
+        result[name], remaining[name] = _changes(model, fields, since, until, after[name], limit)
+    if any(remaining.values()):
+        result['next'] = encode_token(since, until, {name: remaining.get(name, {}) for name in FEEDS})
+    else:
+        result['next'] = encode_token(until)
+    result['more'] = any(remaining.values())
+    return result
@@ -1 +1,546 @@
-# Create your tests here.
+import html
+import math
+import random
+import re
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from itertools import product
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+import numpy as np
+
+from baham import sharding
+from baham.backends import LOGIN_CACHE, find_user
+from baham.booking import BookingConflict, SeatUnavailable, book_seat, claim_seat
+from baham.catalog import get_catalog
+from baham.enum_types import UserType, VehicleStatus, VehicleType
+from baham.expiry import expired_contracts, sweep_expired_contracts
+from baham.matching import assign_companions, auction_assign
+from baham.models import Contract, Route, UserProfile, Vehicle, VehicleModel
+from baham.schedules import FULL_WEEK, bit, day_bits, describe, encode, parse
+from baham.shares import recompute_shares
+from baham.spatial import CELL_SIZE, EARTH_RADIUS_KM, cell_for, haversine_km
+from baham.sync import STREAMS, changes_since, decode_token, encode_token, stream
+from baham.transfer import UserProfileTable
+
+
+def create_fleet(capacity=3, vehicles=1, companions=2):
+    '''
+    The system user (pk 1, the default actor), an owner with vehicles of the given capacity and companions
+    with profiles. Returns (owner, vehicles, companion profiles)
+    '''
+    User.objects.get_or_create(pk=1, defaults={'username': 'admin'})
+    owner = User.objects.create(username='owner')
+    model = VehicleModel.objects.create(vendor='Suzuki', model='Bolan', type=VehicleType.VAN.name,
+                                        capacity=capacity)
+    fleet = [Vehicle.objects.create(registration_number=f'ABC-{index}', colour='#FFFFFF', model=model,
+                                    owner=owner, status=VehicleStatus.AVAILABLE.name)
+             for index in range(vehicles)]
+    profiles = [UserProfile.objects.create(user=User.objects.create(username=f'companion{index}'),
+                                           birthdate='2000-01-01', gender='F', type=UserType.COMPANION.name,
+                                           primary_contact='0300', landmark='', town='Gulberg')
+                for index in range(companions)]
+    return owner, fleet, profiles
+
+
+class AllDatabases:
+    '''
+    Lets the tests run with BAHAM_TOWN_SHARDS=1 too. The user -> shard cache is cleared, as ids are handed out
+    again once a test's rows are gone
+    '''
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+
+class AuditTests(AllDatabases, TestCase):
+    def test_update_and_delete_keep_creation_audit(self):
+        owner, (vehicle,), _ = create_fleet()
+        creator = User.objects.create(username='creator')
+        created = timezone.now() - timedelta(days=3)
+        Vehicle.all_objects.filter(pk=vehicle.pk).update(created_by=creator, date_created=created)
+        vehicle.refresh_from_db()
+
+        vehicle.colour = '#000000'
+        vehicle.update(updated_by=owner)
+        vehicle.delete(voided_by=owner)
+        vehicle.refresh_from_db()
+        self.assertEqual((vehicle.created_by, vehicle.date_created), (creator, created))
+        self.assertEqual((vehicle.updated_by, vehicle.voided_by, vehicle.voided), (owner, owner, True))
+
+    def test_edit_records_who_updated(self):
+        create_fleet()
+        editor = User.objects.create(username='editor')
+        model = VehicleModel.objects.get()
+        with self.assertRaises(TypeError):
+            model.update(update_by=editor)
+        self.client.force_login(editor)
+        self.client.post('/baham/vehicles/edit/update/', {'uuid': model.uuid, 'vendor': 'Suzuki', 'model': 'Carry',
+                                                          'type': VehicleType.VAN.name, 'capacity': 7})
+        model.refresh_from_db()
+        self.assertEqual((model.model, model.updated_by), ('Carry', editor))
+
+    def test_save_stamps_new_rows(self):
+        owner, (vehicle,), _ = create_fleet()
+        self.assertEqual(vehicle.created_by_id, 1)
+        model = VehicleModel(vendor='Honda', model='City', type=VehicleType.SEDAN.name)
+        model.save(created_by=owner)
+        self.assertEqual(model.created_by, owner)
+
+
+class LoginTests(AllDatabases, TestCase):
+    def setUp(self):
+        super().setUp()
+        caches[LOGIN_CACHE].clear()
+
+    def test_username_or_email_ignoring_case(self):
+        user = User.objects.create_user('Alice', 'Alice@Example.com', 'secret')
+        for identifier in ('Alice', 'ALICE', ' alice ', 'alice@example.COM'):
+            self.assertEqual(authenticate(username=identifier, password='secret'), user)
+        self.assertIsNone(authenticate(username='alice', password='wrong'))
+
+    def test_unknown_identifiers_skip_the_database(self):
+        self.assertIsNone(find_user('nobody'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(find_user('Nobody'))
+
+    def test_new_users_are_no_longer_unknown(self):
+        self.assertIsNone(find_user('bob'))
+        self.assertIsNone(find_user('carol'))
+        User.objects.create_user('Bob', password='secret')
+        self.assertEqual(authenticate(username='bob', password='secret').username, 'Bob')
+        # Users created by an import are bulk-created, without post_save
+        UserProfileTable(create_users=True).prepare([(2, {'username': 'carol'})])
+        self.assertEqual(find_user('carol').username, 'carol')
+
+
+class CatalogCacheTests(AllDatabases, TestCase):
+    def test_writes_invalidate_the_catalog(self):
+        create_fleet()
+        self.assertEqual([row['model'] for row in get_catalog()], ['Bolan'])
+        VehicleModel.objects.create(vendor='Toyota', model='Hiace', type=VehicleType.VAN.name)
+        self.assertEqual([row['model'] for row in get_catalog()], ['Bolan', 'Hiace'])
+
+
+
+class VehicleModelApiTests(AllDatabases, TestCase):
+    def test_queryset_update_changes_the_etag(self):
+        create_fleet()
+        etag = self.client.get('/api/get/vehiclemodels')['ETag']
+        self.assertEqual(self.client.get('/api/get/vehiclemodels', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        VehicleModel.objects.filter(vendor='Suzuki').update(vendor='Changan')
+        response = self.client.get('/api/get/vehiclemodels', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['vendor'], 'Changan')
+
+    def test_malformed_uuid_is_not_found(self):
+        self.assertEqual(self.client.get('/api/get/vehiclemodel/not-a-uuid').status_code, 404)
+        self.assertEqual(self.client.put('/api/update/vehiclemodel/not-a-uuid').status_code, 404)
+        self.assertEqual(self.client.delete('/api/delete/vehiclemodel/not-a-uuid').status_code, 404)
+
+
+class VehicleListingTests(AllDatabases, TestCase):
+    def next_link(self, response):
+        match = re.search(r'href="([^"]*cursor=[^"]*)"', response.content.decode())
+        return match and html.unescape(match.group(1))
+
+    def test_pages_through_every_vehicle_once(self):
+        _, fleet, _ = create_fleet(vehicles=7)
+        # Ties on date_created are broken by pk
+        Vehicle.objects.filter(pk__in=[vehicle.pk for vehicle in fleet[2:5]]).update(
+            date_created=fleet[2].date_created)
+        expected = sorted(Vehicle.objects.all(), key=lambda vehicle: (vehicle.date_created, vehicle.pk), reverse=True)
+        seen, url = [], '/baham/vehicles?limit=3&seats=1'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.context['vehicles']), 3)
+            seen.extend(response.context['vehicles'])
+            url = self.next_link(response)
+            if url:
+                self.assertIn('limit=3', url)
+                self.assertIn('seats=1', url)
+        self.assertEqual([vehicle.pk for vehicle in seen], [vehicle.pk for vehicle in expected])
+
+    def test_invalid_cursor_is_a_bad_request(self):
+        self.assertEqual(self.client.get('/baham/vehicles?cursor=not-a-cursor').status_code, 400)
+        self.assertEqual(self.client.get('/baham/vehicles?seats=many').status_code, 400)
+
+
+class MediaTests(SimpleTestCase):
+    hashed = f'pictures/{"ab" * 32}.jpg'
+    content = bytes(range(256)) * 4
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        for name in (self.hashed, 'pictures/plain.jpg'):
+            path = Path(media_root.name, name)
+            path.parent.mkdir(exist_ok=True)
+            path.write_bytes(self.content)
+
+    def get(self, path='', **headers):
+        response = self.client.get(f'/media/{path or self.hashed}', **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_ranges(self):
+        size = len(self.content)
+        for header, (start, end) in (('bytes=-100', (size - 100, size - 1)), ('bytes=1000-', (1000, size - 1)),
+                                     ('bytes=10-19', (10, 19)), ('bytes=-5000', (0, size - 1))):
+            response, body = self.get(HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{size}')
+            self.assertEqual(body, self.content[start:end + 1])
+
+    def test_unsatisfiable_range(self):
+        for header in ('bytes=1024-1030', 'bytes=-0'):
+            response, _ = self.get(HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 416, header)
+            self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_several_ranges_serve_the_whole_file(self):
+        response, body = self.get(HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual((response.status_code, body), (200, self.content))
+        self.assertNotIn('Content-Range', response)
+
+    def test_range_of_another_version_serves_the_whole_file(self):
+        response, body = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, body), (200, self.content))
+
+    def test_hashed_names_are_immutable(self):
+        response, _ = self.get()
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['ETag'], f'"{"ab" * 32}"')
+        response, body = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual((response.status_code, body), (304, b''))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.get('pictures/plain.jpg')[0]['Cache-Control'], 'public, max-age=3600')
+
+
+class ChangeFeedTests(AllDatabases, TestCase):
+    @mock.patch('baham.sync.COMMIT_MARGIN', timedelta(0))
+    def test_feed_is_paged(self):
+        _, fleet, _ = create_fleet(vehicles=5)
+        seen, pages, token = [], 0, None
+        while True:
+            changes = changes_since(token, limit=2)
+            seen += [row['uuid'] for row in changes['vehicles']['changed']]
+            pages, token = pages + 1, changes['next']
+            if not changes['more']:
+                break
+        self.assertEqual((pages, sorted(seen)), (3, sorted(vehicle.uuid for vehicle in fleet)))
+
+        Vehicle.objects.filter(pk=fleet[0].pk).update(colour='#000000', date_updated=timezone.now())
+        fleet[1].delete()
+        changes = changes_since(token, limit=2)
+        self.assertEqual([row['uuid'] for row in changes['vehicles']['changed']], [fleet[0].uuid])
+        self.assertEqual([row['uuid'] for row in changes['vehicles']['deleted']], [fleet[1].uuid])
+        self.assertFalse(changes['more'])
+
+    @mock.patch('baham.sync.COMMIT_MARGIN', timedelta(0))
+    def test_undeleted_row_comes_back(self):
+        owner, (vehicle,), _ = create_fleet()
+        token = changes_since()['next']
+        vehicle.delete()
+        changes = changes_since(token)
+        self.assertEqual([row['uuid'] for row in changes['vehicles']['deleted']], [vehicle.uuid])
+        vehicle.undelete(updated_by=owner)
+        changes = changes_since(changes['next'])
+        self.assertEqual([row['uuid'] for row in changes['vehicles']['changed']], [vehicle.uuid])
+        self.assertEqual(changes['vehicles']['deleted'], [])
+        self.assertEqual(Vehicle.objects.get().updated_by, owner)
+
+    def test_recent_writes_are_left_for_the_next_window(self):
+        # A row stamped just now may belong to a transaction not yet committed; it must not fall between windows
+        create_fleet()
+        changes = changes_since(encode_token(timezone.now() - timedelta(minutes=1)))
+        self.assertEqual(changes['vehicles']['changed'], [])
+        since, _, _ = decode_token(changes['next'])
+        self.assertLess(since, Vehicle.objects.get().date_created)
+
+    def test_streams_scan_their_date_index(self):
+        since = timezone.now() - timedelta(hours=1)
+        for model, prefix in ((VehicleModel, 'vehiclemodel'), (Vehicle, 'vehicle')):
+            for column, index in zip(STREAMS, ('c', 'u', 'v')):
+                plan = stream(model, column, since, timezone.now(), (since, 1)).explain()
+                self.assertIn(f'USING INDEX {prefix}_changed_{index}_idx', plan)
+
+
+class BookingTests(AllDatabases, TestCase):
+    @mock.patch('baham.sync.COMMIT_MARGIN', timedelta(0))
+    def test_last_seat_shows_in_the_change_feed(self):
+        owner, (vehicle,), (companion, _) = create_fleet(capacity=2)
+        token = changes_since()['next']
+        book_seat(vehicle.pk, companion, timezone.localdate() + timedelta(days=30), created_by=owner)
+        changed = changes_since(token)['vehicles']['changed']
+        self.assertEqual([(row['uuid'], row['status']) for row in changed], [(vehicle.uuid, 'FULL')])
+        self.assertEqual(Vehicle.objects.get().updated_by, owner)
+
+    def test_booking_read_before_deactivation_cannot_claim(self):
+        _, (vehicle,), _ = create_fleet()
+        version = vehicle.version
+        vehicle.status = VehicleStatus.INACTIVE.name
+        vehicle.update()
+        self.assertFalse(claim_seat(vehicle.pk, version))
+        vehicle.refresh_from_db()
+        self.assertFalse(claim_seat(vehicle.pk, vehicle.version))
+        self.assertEqual(vehicle.seats_taken, 0)
+
+    def test_saving_a_stale_instance_keeps_the_counters(self):
+        _, (vehicle,), (companion, _) = create_fleet()
+        book_seat(vehicle.pk, companion, timezone.localdate() + timedelta(days=30))
+        vehicle.colour = '#000000'
+        vehicle.update()
+        self.assertEqual(Vehicle.objects.values_list('seats_taken', 'seats_free').get(), (1, 1))
+
+    def test_new_model_brings_its_capacity(self):
+        _, (vehicle,), (companion, _) = create_fleet(capacity=2)
+        book_seat(vehicle.pk, companion, timezone.localdate() + timedelta(days=30))
+        vehicle.refresh_from_db()
+        self.assertEqual(vehicle.status, VehicleStatus.FULL.name)
+        vehicle.model = VehicleModel.objects.create(vendor='Toyota', model='Hiace', type=VehicleType.VAN.name,
+                                                    capacity=5)
+        vehicle.update()
+        self.assertEqual((vehicle.seats_taken, vehicle.seats_free, vehicle.status),
+                         (1, 3, VehicleStatus.AVAILABLE.name))
+        self.assertEqual(Vehicle.objects.values_list('seats_free', flat=True).get(), 3)
+
+
+class ConcurrentBookingTests(AllDatabases, TransactionTestCase):
+    '''
+    Commits for real, on the file test database (see DATABASES): threads cannot share an in-memory one
+    '''
+    capacity = 4
+    threads = 8
+
+    def hammer(self, fleet, companion, bookings):
+        outcomes = Counter()
+        try:
+            for _ in range(bookings):
+                try:
+                    book_seat(random.choice(fleet).pk, companion, timezone.localdate() + timedelta(days=30))
+                    outcomes['booked'] += 1
+                except SeatUnavailable:
+                    outcomes['full'] += 1
+                except BookingConflict:
+                    outcomes['gave up'] += 1
+                except OperationalError:
+                    # SQLite's write lock timed out, which is not an overbooking
+                    outcomes['locked'] += 1
+        finally:
+            connection.close()
+        return outcomes
+
+    def test_threads_never_overbook(self):
+        _, fleet, (companion,) = create_fleet(capacity=self.capacity, vehicles=3, companions=1)
+        with ThreadPoolExecutor(self.threads) as pool:
+            outcomes = sum(pool.map(self.hammer, [fleet] * self.threads, [companion] * self.threads,
+                                    [15] * self.threads), Counter())
+        self.assertEqual(sum(outcomes.values()), self.threads * 15)
+        self.assertEqual(outcomes['booked'], Contract.objects.count())
+        self.assertGreater(outcomes['full'], 0)
+        for vehicle in Vehicle.objects.all():
+            riders = Contract.objects.filter(vehicle=vehicle, is_active=True).count()
+            self.assertLessEqual(riders, self.capacity - 1)
+            self.assertEqual((vehicle.seats_taken, vehicle.seats_free), (riders, self.capacity - 1 - riders))
+            self.assertEqual(vehicle.status == VehicleStatus.FULL.name, vehicle.seats_free == 0)
+
+
+@skipUnless(sharding.enabled(), 'Run with BAHAM_TOWN_SHARDS=1')
+class ShardedJobsTests(AllDatabases, TestCase):
+    def profile(self, username, user_type, town, latitude, longitude):
+        return UserProfile(user=User.objects.create(username=username), birthdate='2000-01-01', gender='F',
+                           type=user_type, primary_contact='0300', landmark='', town=town,
+                           address_latitude=latitude, address_longitude=longitude)
+
+    def create_profile(self, *args):
+        profile = self.profile(*args)
+        profile.save()
+        return profile
+
+    def test_user_without_a_profile_is_not_pinned_to_default(self):
+        User.objects.create(pk=1, username='admin')
+        profile = self.profile('late', UserType.OWNER.name, 'Gulberg', 24.84, 67.14)
+        self.assertEqual(sharding.shard_for_user(profile.user_id), 'default')
+        # Saved by another worker: no post_save reaches this process
+        UserProfile.all_objects.using('town_north').bulk_create_audited([profile])
+        self.assertEqual(sharding.shard_for_user(profile.user_id), 'town_north')
+
+    @mock.patch('baham.sync.COMMIT_MARGIN', timedelta(0))
+    def test_jobs_read_every_shard(self):
+        User.objects.create(pk=1, username='admin')
+        owner = self.create_profile('owner', UserType.OWNER.name, 'Korangi', 24.83, 67.13).user
+        model = VehicleModel.objects.create(vendor='Suzuki', model='Bolan', type=VehicleType.VAN.name, capacity=3)
+        vehicle = Vehicle.objects.create(registration_number='ABC-0', colour='#FFFFFF', model=model, owner=owner,
+                                         status=VehicleStatus.AVAILABLE.name)
+        companion = self.create_profile('companion', UserType.COMPANION.name, 'Gulberg', 24.84, 67.14)
+        self.assertEqual((vehicle._state.db, companion._state.db), ('town_east', 'town_north'))
+
+        [assignment] = assign_companions()
+        self.assertEqual((assignment.companion_id, assignment.vehicle_id), (companion.pk, vehicle.pk))
+        route = Route(owner=owner, vehicle=vehicle)
+        route.waypoints = [(24.83, 67.13), (24.84, 67.14), (24.86, 67.16)]
+        route.save()
+        book_seat(vehicle.pk, companion, timezone.localdate() + timedelta(days=30))
+        self.assertEqual(recompute_shares(), 1)
+        changed = changes_since()['vehicles']['changed']
+        self.assertEqual([(row['uuid'], row['owner']) for row in changed], [(vehicle.uuid, 'owner')])
+
+
+class ExpiryTests(AllDatabases, TestCase):
+    def test_sweep_catches_contracts_expired_before_the_last_sweep(self):
+        _, (vehicle,), (first, second) = create_fleet()
+        today = timezone.localdate()
+        Contract.objects.create(vehicle=vehicle, companion=first, effective_start_date=today - timedelta(days=30),
+                                expiry_date=today - timedelta(days=1), fuel_share=50, maintenance_share=50)
+        self.assertEqual(sweep_expired_contracts(), (1, 0))
+        # Back-dated, imported or reactivated after that sweep, the same day
+        Contract.objects.create(vehicle=vehicle, companion=second, effective_start_date=today - timedelta(days=60),
+                                expiry_date=today - timedelta(days=20), fuel_share=50, maintenance_share=50)
+        self.assertEqual(Vehicle.objects.get().seats_taken, 1)
+        self.assertEqual(sweep_expired_contracts(), (1, 0))
+        self.assertFalse(Contract.objects.filter(is_active=True).exists())
+        self.assertEqual(Vehicle.objects.get().seats_taken, 0)
+
+    def test_sweep_reads_only_active_contracts_through_their_index(self):
+        plan = expired_contracts(timezone.localdate()).values_list('pk', 'vehicle_id')[:1000].explain()
+        self.assertIn('USING INDEX contract_active_expiry_idx', plan)
+
+
+class ImportTests(AllDatabases, TestCase):
+    def test_rejected_rows_are_counted_but_only_the_first_listed(self):
+        User.objects.create(pk=1, username='admin')
+        rows = ['{"vendor": "Suzuki", "model": "Bolan", "type": "VAN", "capacity": 7}'] + \
+            [f'{{"vendor": "Suzuki", "model": "Bolan {index}", "type": "BUS", "capacity": 7}}' for index in range(5)]
+        out, err = StringIO(), StringIO()
+        with mock.patch('sys.stdin', StringIO('\n'.join(rows))):
+            call_command('import_data', 'vehiclemodel', '-', format='ndjson', max_errors=2, stdout=out, stderr=err)
+        self.assertIn('Imported 1 of 6 rows (5 rejected)', out.getvalue())
+        self.assertEqual([line.split(':')[0] for line in err.getvalue().splitlines() if line.startswith('Line')],
+                         ['Line 2', 'Line 3'])
+
+
+class NearbyTests(AllDatabases, TestCase):
+    def place(self, name, latitude, longitude, **kwargs):
+        return UserProfile.objects.create(user=User.objects.create(username=name), birthdate='2000-01-01',
+                                          gender='F', type=UserType.COMPANION.name, primary_contact='0300',
+                                          landmark='', town='Gulberg', address_latitude=f'{latitude:.6f}',
+                                          address_longitude=f'{longitude:.6f}', **kwargs)
+
+    def assert_matches_brute_force(self, latitude, longitude, spread, radii):
+        rng = random.Random(17)
+        for index in range(150):
+            self.place(f'user{index}', latitude + rng.uniform(-spread, spread),
+                       (longitude + rng.uniform(-spread, spread) + 180) % 360 - 180)
+        profiles = list(UserProfile.objects.all())
+        for radius in radii:
+            expected = {profile.pk for profile in profiles if haversine_km(
+                latitude, longitude, profile.address_latitude, profile.address_longitude) <= radius}
+            found = list(UserProfile.objects.nearby(latitude, longitude, radius))
+            self.assertEqual({profile.pk for profile in found}, expected, radius)
+            self.assertEqual([profile.distance_km for profile in found],
+                             sorted(profile.distance_km for profile in found))
+
+    def test_finds_neighbours_across_cell_borders(self):
+        # Just inside the corner of a cell, so most neighbours lie in the cells around it
+        latitude, longitude = 31.52 - 1e-6, 74.33 - 1e-6
+        self.assertNotEqual(cell_for(latitude, longitude), cell_for(latitude + 2e-6, longitude + 2e-6))
+        self.assert_matches_brute_force(latitude, longitude, 4 * CELL_SIZE, (0.3, 1.5, 3))
+
+    def test_finds_neighbours_across_the_antimeridian(self):
+        self.assert_matches_brute_force(-16.5, 179.9995, 2 * CELL_SIZE, (0.5, 2))
+
+    def test_radius_cut_off(self):
+        self.client.force_login(User.objects.create(username='rider'))
+        self.assertEqual(self.client.get('/api/get/nearby?lat=31.5&lon=74.3&radius=60').status_code, 400)
+        north = math.degrees(1 / EARTH_RADIUS_KM)
+        self.place('inside', 31.5 + 1.99 * north, 74.3)
+        self.place('closer', 31.5, 74.3 + 0.5 * north / math.cos(math.radians(31.5)))
+        self.place('outside', 31.5 + 2.01 * north, 74.3)
+        self.place('inactive', 31.5, 74.3, active=False)
+        results = self.client.get('/api/get/nearby?lat=31.5&lon=74.3').json()['results']
+        self.assertEqual([result['username'] for result in results], ['closer', 'inside'])
+        self.assertAlmostEqual(results[1]['distance_km'], 1.99, places=2)
+
+
+class ScheduleTests(SimpleTestCase):
+    def test_parses_free_text(self):
+        self.assertEqual(parse('Mon, Thu 8am'), bit(0, 1) | bit(3, 1))
+        self.assertEqual(parse('Mon-Fri 7:30-17:00'), encode(range(5), range(6)))
+        self.assertEqual(parse('weekdays'), sum(day_bits(day) for day in range(5)))
+        self.assertEqual(parse('Sat to Mon 9pm'), encode((5, 6, 0), (7,)))
+        # Each clause keeps its own times
+        self.assertEqual(parse('Mon 8am, Thu 5pm'), bit(0, 1) | bit(3, 5))
+        self.assertEqual(parse('Mon 8am, 5pm'), bit(0, 1) | bit(0, 5))
+
+    def test_unrecognised_input_rides_at_any_time(self):
+        for text in (None, '', 'whenever', '25:00', 'Route 42', '11pm'):
+            self.assertEqual(parse(text), FULL_WEEK, text)
+        # Days without usable times ride all day
+        self.assertEqual(parse('Tue 3'), day_bits(1))
+        self.assertEqual(parse('Tue 11pm'), day_bits(1))
+
+    def test_describe_reads_back(self):
+        self.assertEqual(describe(encode(range(5), (1, 2)) | bit(0, 5) | bit(5, 2)),
+                         'Monday 08:00-12:00, 16:00-18:00; Tuesday-Friday 08:00-12:00; Saturday 10:00-12:00')
+        self.assertEqual(describe(FULL_WEEK), 'Monday-Sunday 06:00-22:00')
+        rng = random.Random(13)
+        for _ in range(2000):
+            mask = rng.getrandbits(56) & rng.getrandbits(56) or 1
+            self.assertEqual(parse(describe(mask)), mask, describe(mask))
+
+
+class MatchingTests(SimpleTestCase):
+    def brute_force(self, costs, capacities):
+        '''
+        (matches, total cost) of the best assignment: the most matches, then the least cost
+        '''
+        best = (0, 0.0)
+        for choice in product(range(-1, costs.shape[1]), repeat=len(costs)):
+            if any(column >= 0 and not np.isfinite(costs[row, column]) for row, column in enumerate(choice)):
+                continue
+            if any(choice.count(column) > capacity for column, capacity in enumerate(capacities)):
+                continue
+            matches = sum(column >= 0 for column in choice)
+            cost = sum(costs[row, column] for row, column in enumerate(choice) if column >= 0)
+            if (matches, -cost) > (best[0], -best[1]):
+                best = (matches, cost)
+        return best
+
+    def test_auction_matches_brute_force(self):
+        rng = np.random.default_rng(11)
+        for _ in range(400):
+            rows, columns = rng.integers(1, 6), rng.integers(1, 4)
+            capacities = rng.integers(1, 3, size=columns)
+            costs = rng.uniform(0, 20, size=(rows, columns))
+            costs[rng.random((rows, columns)) < 0.2] = np.inf
+            indices = np.where(np.isfinite(costs), np.arange(columns), -1)
+            assigned = auction_assign(indices, costs, capacities)
+            matches, cost = self.brute_force(costs, capacities)
+            self.assertEqual((assigned >= 0).sum(), matches)
+            self.assertLessEqual(sum(costs[row, column] for row, column in enumerate(assigned) if column >= 0),
+                                 cost + rows * 0.01 + 1e-9)
+            self.assertTrue(all((assigned == column).sum() <= capacity
+                                for column, capacity in enumerate(capacities)))
+
+    def test_does_not_trade_a_match_for_a_shorter_detour(self):
+        # The second companion is slightly closer to the only vehicle the first one can reach
+        costs = np.array([[np.inf, 16.1], [7.0, 5.7]])
+        assigned = auction_assign(np.array([[-1, 1], [0, 1]]), costs, np.array([1, 1]))
+        self.assertEqual(assigned.tolist(), [1, 0])
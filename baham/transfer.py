@@ -0,0 +1,489 @@
+import csv
+import json
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from itertools import chain, islice
+from uuid import UUID
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import router, transaction
+from django.utils import timezone
+
+from baham.backends import forget_identifiers
+from baham.constants import TOWNS
+from baham.enum_types import UserType, VehicleStatus, VehicleType
+from baham.occupancy import sync_status
+from baham.schedules import FULL_WEEK, parse as parse_schedule
+from baham.sharding import enabled as sharding_enabled, is_sharded, scatter_map, shard_for_pk, shard_for_town, \
+    shards, using_shard
+
+FORMATS = ('csv', 'ndjson')
+BOOLEANS = {'true': True, '1': True, 'yes': True, 'false': False, '0': False, 'no': False}
+
+
+def guess_format(path):
+    if path.endswith('.csv'):
+        return 'csv'
+    if path.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return None
+
+
+def read_rows(stream, file_format):
+    '''
+    Yield (line, row) from a CSV file with a header line or from NDJSON, one row at a time. A line that is not
+    a JSON object is yielded as its error message instead of a row
+    '''
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as e:
+            yield line, f'Invalid JSON: {e}'
+            continue
+        yield line, row if isinstance(row, dict) else 'Not a JSON object'
+
+
+class RowWriter:
+    '''
+    Writes rows as CSV with a header line, or as NDJSON
+    '''
+    def __init__(self, stream, file_format, columns):
+        self.stream = stream
+        self.csv = csv.DictWriter(stream, columns) if file_format == 'csv' else None
+        if self.csv:
+            self.csv.writeheader()
+
+    def write(self, rows):
+        if self.csv:
+            self.csv.writerows(rows)
+        else:
+            self.stream.writelines(json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in rows)
+
+
+class Rejections:
+    '''
+    The rows an import rejected: every one is counted, but only the first `keep` (line, message) pairs are
+    kept, so a file of bad rows does not pile its messages up in memory
+    '''
+    def __init__(self, keep):
+        self.keep = keep
+        self.count = 0
+        self.first = []
+
+    def append(self, rejection):
+        self.count += 1
+        if len(self.first) < self.keep:
+            self.first.append(rejection)
+
+
+# Field parsers: each takes the row and a column name and raises ValueError with a message for the user
+def _text(row, name, max_length, required=True):
+    value = row.get(name)
+    value = '' if value is None else str(value).strip()
+    if not value:
+        if required:
+            raise ValueError(f'{name} is required')
+        return None
+    if len(value) > max_length:
+        raise ValueError(f'{name} is longer than {max_length} characters')
+    return value
+
+
+def _integer(row, name, minimum=0, maximum=None, default=None):
+    value = row.get(name)
+    if value is None or str(value).strip() == '':
+        if default is None:
+            raise ValueError(f'{name} is required')
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a whole number') from None
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ValueError(f'{name} must be between {minimum} and {maximum}' if maximum is not None else
+                         f'{name} must be at least {minimum}')
+    return value
+
+
+def _decimal(row, name):
+    value = row.get(name)
+    if value is None or str(value).strip() == '':
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f'{name} must be a number') from None
+
+
+def _date(row, name, default=None):
+    value = row.get(name)
+    if not value:
+        if default is None:
+            raise ValueError(f'{name} is required')
+        return default
+    try:
+        return date.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError(f'{name} must be a date (YYYY-MM-DD)') from None
+
+
+def _boolean(row, name, default):
+    value = row.get(name)
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    try:
+        return BOOLEANS[str(value).strip().lower()]
+    except KeyError:
+        raise ValueError(f'{name} must be true or false') from None
+
+
+def _choice(row, name, choices):
+    value = _text(row, name, 50)
+    if value not in choices:
+        raise ValueError(f'{name} must be one of {", ".join(choices)}')
+    return value
+
+
+def _uuid(row, name, required=True):
+    value = _text(row, name, 36, required)
+    if value is None:
+        return None
+    try:
+        return UUID(value)
+    except ValueError:
+        raise ValueError(f'{name} is not a UUID') from None
+
+
+def _uuids(batch, name):
+    '''
+    The valid UUIDs in column name of a batch, for looking them up in one query
+    '''
+    found = set()
+    for _, row in batch:
+        try:
+            found.add(_uuid(row, name))
+        except ValueError:
+            pass
+    return found - {None}
+
+
+def _existing(model, field, values):
+    '''
+    The values of field, among values, that rows of model already have, on any shard
+    '''
+    if not values:
+        return set()
+    if not is_sharded(model):
+        return set(model.all_objects.filter(**{f'{field}__in': values}).values_list(field, flat=True))
+    found = scatter_map(lambda alias: list(model.all_objects.using(alias).filter(**{f'{field}__in': values})
+                                           .values_list(field, flat=True)))
+    return set(chain.from_iterable(found.values()))
+
+
+def _usernames(user_ids):
+    return dict(User.objects.filter(pk__in=set(user_ids)).values_list('pk', 'username'))
+
+
+def _user_ids(usernames):
+    return dict(User.objects.filter(username__in=set(usernames)).values_list('username', 'pk'))
+
+
+def _profiles_of(user_ids):
+    '''
+    {user_id: (shard, profile id)} of the users with a profile
+    '''
+    from baham.models import UserProfile
+    found = scatter_map(lambda alias: list(UserProfile.all_objects.using(alias).filter(user_id__in=set(user_ids))
+                                           .values_list('user_id', 'pk')))
+    return {user_id: (alias, pk) for alias, rows in found.items() for user_id, pk in rows}
+
+
+class Table:
+    '''
+    How one model is exported and imported: the columns of a row and the conversion of a batch of rows to
+    and from model instances, with references written as natural keys (uuid, username, registration number)
+    '''
+    model = None
+    columns = ()
+    fields = ()
+
+    def queryset(self):
+        return self.model.objects.all()
+
+    def export(self, batch_size):
+        '''
+        Yield batches of rows, shard by shard, reading batch_size rows at a time
+        '''
+        for alias in shards() if sharding_enabled() else [None]:
+            rows = self.queryset().using(alias).order_by('pk').values(*self.fields).iterator(chunk_size=batch_size)
+            while batch := list(islice(rows, batch_size)):
+                yield self.to_rows(batch)
+
+    def to_rows(self, batch):
+        return [self.row(values) for values in batch]
+
+    def row(self, values):
+        return {column: values[column] for column in self.columns}
+
+    def build(self, batch, errors):
+        '''
+        Validate a batch of (line, row) and return {database: [instances]} of the valid rows. The reason each
+        invalid row was rejected is appended to errors (see Rejections) as (line, message)
+        '''
+        objs = defaultdict(list)
+        context = self.prepare(batch)
+        for line, row in batch:
+            try:
+                obj, alias = self.build_one(row, context)
+            except ValueError as e:
+                errors.append((line, str(e)))
+                continue
+            objs[alias].append(obj)
+        return objs
+
+    def prepare(self, batch):
+        '''
+        Look up everything the rows of the batch refer to, in a few queries for the whole batch
+        '''
+        return {}
+
+    def build_one(self, row, context):
+        '''
+        (instance, database alias or None) of one row, or ValueError
+        '''
+        raise NotImplementedError
+
+    def check_uuid(self, row, context):
+        value = _uuid(row, 'uuid', required=False)
+        if not value:
+            return {}
+        if value in context['uuids']:
+            raise ValueError(f'uuid {value} already exists')
+        context['uuids'].add(value)
+        return {'uuid': value}
+
+    def existing_uuids(self, batch):
+        return _existing(self.model, 'uuid', _uuids(batch, 'uuid'))
+
+    def insert(self, alias, objs, created_by, batch_size):
+        '''
+        Insert the instances with batched statements in one transaction. Returns the number inserted
+        '''
+        using = alias or router.db_for_write(self.model)
+        with transaction.atomic(using=using), using_shard(using):
+            return len(self.model.all_objects.using(using).bulk_create_audited(objs, created_by=created_by,
+                                                                               batch_size=batch_size))
+
+
+class VehicleModelTable(Table):
+    columns = fields = ('uuid', 'vendor', 'model', 'type', 'capacity')
+
+    @property
+    def model(self):
+        from baham.models import VehicleModel
+        return VehicleModel
+
+    def prepare(self, batch):
+        return {'uuids': self.existing_uuids(batch)}
+
+    def build_one(self, row, context):
+        return self.model(vendor=_text(row, 'vendor', 20), model=_text(row, 'model', 20),
+                          type=_choice(row, 'type', [t.name for t in VehicleType]),
+                          capacity=_integer(row, 'capacity', minimum=1, maximum=100),
+                          **self.check_uuid(row, context)), None
+
+
+class VehicleTable(Table):
+    columns = ('uuid', 'registration_number', 'colour', 'model', 'owner', 'status')
+    fields = ('uuid', 'registration_number', 'colour', 'model_id', 'owner_id', 'status')
+
+    @property
+    def model(self):
+        from baham.models import Vehicle
+        return Vehicle
+
+    def to_rows(self, batch):
+        from baham.models import VehicleModel
+        models = dict(VehicleModel.all_objects.filter(pk__in={row['model_id'] for row in batch})
+                      .values_list('pk', 'uuid'))
+        owners = _usernames(row['owner_id'] for row in batch)
+        return [self.row(dict(row, model=models.get(row['model_id']), owner=owners.get(row['owner_id'])))
+                for row in batch]
+
+    def prepare(self, batch):
+        from baham.models import VehicleModel
+        numbers = [str(row.get('registration_number') or '').strip() for _, row in batch]
+        owners = _user_ids(str(row.get('owner') or '').strip() for _, row in batch)
+        return {
+            'uuids': self.existing_uuids(batch),
+            'numbers': _existing(self.model, 'registration_number', numbers),
+            'models': dict(VehicleModel.objects.filter(uuid__in=_uuids(batch, 'model')).values_list('uuid', 'pk')),
+            'owners': owners,
+            'shards': {user_id: alias for user_id, (alias, _) in _profiles_of(owners.values()).items()},
+        }
+
+    def build_one(self, row, context):
+        from baham.models import validate_colour
+        number = _text(row, 'registration_number', 10)
+        if number in context['numbers']:
+            raise ValueError(f'registration_number {number} already exists')
+        colour = _text(row, 'colour', 50)
+        if not validate_colour(colour):
+            raise ValueError(f'colour {colour} is not a #RRGGBB colour code')
+        model_id = context['models'].get(_uuid(row, 'model'))
+        if not model_id:
+            raise ValueError(f'vehicle model {row.get("model")} does not exist')
+        owner_id = context['owners'].get(_text(row, 'owner', 150))
+        if not owner_id:
+            raise ValueError(f'owner {row.get("owner")} does not exist')
+        status = _choice(row, 'status', [s.name for s in VehicleStatus])
+        obj = self.model(registration_number=number, colour=colour, model_id=model_id, owner_id=owner_id,
+                         status=status, **self.check_uuid(row, context))
+        context['numbers'].add(number)
+        return obj, context['shards'].get(owner_id) if sharding_enabled() else None
+
+    def insert(self, alias, objs, created_by, batch_size):
+        using = alias or router.db_for_write(self.model)
+        with transaction.atomic(using=using), using_shard(using):
+            created = super().insert(alias, objs, created_by, batch_size)
+            # The status of the file may be FULL for seats the imported contracts have yet to take
+            sync_status([obj.pk for obj in objs])
+        return created
+
+
+class UserProfileTable(Table):
+    columns = ('username', 'birthdate', 'gender', 'type', 'primary_contact', 'alternate_contact', 'address',
+               'address_latitude', 'address_longitude', 'landmark', 'town', 'bio')
+    fields = ('user_id',) + columns[1:]
+
+    def __init__(self, create_users=False):
+        self.create_users = create_users
+
+    @property
+    def model(self):
+        from baham.models import UserProfile
+        return UserProfile
+
+    def to_rows(self, batch):
+        users = _usernames(row['user_id'] for row in batch)
+        return [self.row(dict(row, username=users.get(row['user_id']))) for row in batch]
+
+    def prepare(self, batch):
+        usernames = {str(row.get('username') or '').strip() for _, row in batch} - {''}
+        users = _user_ids(usernames)
+        if self.create_users and usernames - set(users):
+            # New users cannot sign in until they set a password. One unusable hash serves the whole batch:
+            # generating each is a good part of the import's time
+            password = make_password(None)
+            created = usernames - set(users)
+            User.objects.bulk_create([User(username=username, password=password) for username in created],
+                                     ignore_conflicts=True)
+            # bulk_create() sends no post_save, which would have cleared them
+            forget_identifiers(created)
+            users = _user_ids(usernames)
+        return {'users': users, 'profiles': set(_profiles_of(users.values()))}
+
+    def build_one(self, row, context):
+        username = _text(row, 'username', 150)
+        user_id = context['users'].get(username)
+        if not user_id:
+            raise ValueError(f'user {username} does not exist')
+        if user_id in context['profiles']:
+            raise ValueError(f'user {username} already has a profile')
+        town = _choice(row, 'town', TOWNS)
+        obj = self.model(user_id=user_id, birthdate=_date(row, 'birthdate'), gender=_choice(row, 'gender', ['M', 'F']),
+                         type=_choice(row, 'type', [t.name for t in UserType]),
+                         primary_contact=_text(row, 'primary_contact', 20),
+                         alternate_contact=_text(row, 'alternate_contact', 20, required=False),
+                         address=_text(row, 'address', 255, required=False) or '',
+                         address_latitude=_decimal(row, 'address_latitude'),
+                         address_longitude=_decimal(row, 'address_longitude'),
+                         landmark=_text(row, 'landmark', 255, required=False) or '', town=town,
+                         bio=_text(row, 'bio', 10000, required=False))
+        context['profiles'].add(user_id)
+        return obj, shard_for_town(town) if sharding_enabled() else None
+
+
+class ContractTable(Table):
+    columns = ('uuid', 'vehicle', 'companion', 'effective_start_date', 'expiry_date', 'is_active', 'fuel_share',
+               'maintenance_share', 'schedule')
+    fields = ('uuid', 'vehicle_id', 'companion_id', 'effective_start_date', 'expiry_date', 'is_active',
+              'fuel_share', 'maintenance_share', 'schedule')
+
+    @property
+    def model(self):
+        from baham.models import Contract
+        return Contract
+
+    def to_rows(self, batch):
+        from baham.models import UserProfile, Vehicle
+        vehicle_ids = {row['vehicle_id'] for row in batch}
+        profile_ids = {row['companion_id'] for row in batch}
+        vehicles = scatter_map(lambda alias: list(Vehicle.all_objects.using(alias).filter(pk__in=vehicle_ids)
+                                                  .values_list('pk', 'registration_number')))
+        profiles = dict(chain.from_iterable(scatter_map(
+            lambda alias: list(UserProfile.all_objects.using(alias).filter(pk__in=profile_ids)
+                               .values_list('pk', 'user_id'))).values()))
+        vehicles = dict(chain.from_iterable(vehicles.values()))
+        users = _usernames(profiles.values())
+        return [self.row(dict(row, vehicle=vehicles.get(row['vehicle_id']),
+                              companion=users.get(profiles.get(row['companion_id'])))) for row in batch]
+
+    def prepare(self, batch):
+        from baham.models import Vehicle
+        numbers = {str(row.get('vehicle') or '').strip() for _, row in batch}
+        found = scatter_map(lambda alias: list(Vehicle.objects.using(alias).filter(registration_number__in=numbers)
+                                               .values_list('registration_number', 'pk', 'seats_free')))
+        users = _user_ids(str(row.get('companion') or '').strip() for _, row in batch)
+        return {
+            'uuids': self.existing_uuids(batch),
+            'vehicles': {number: [pk, seats_free] for number, pk, seats_free in chain.from_iterable(found.values())},
+            'users': users,
+            'profiles': {user_id: pk for user_id, (_, pk) in _profiles_of(users.values()).items()},
+        }
+
+    def build_one(self, row, context):
+        number = _text(row, 'vehicle', 10)
+        vehicle = context['vehicles'].get(number)
+        if not vehicle:
+            raise ValueError(f'vehicle {number} does not exist')
+        username = _text(row, 'companion', 150)
+        companion_id = context['profiles'].get(context['users'].get(username))
+        if not companion_id:
+            raise ValueError(f'companion {username} has no profile')
+        is_active = _boolean(row, 'is_active', True)
+        if is_active and vehicle[1] <= 0:
+            raise ValueError(f'vehicle {number} has no free seat')
+        schedule = row.get('schedule')
+        schedule = _integer(row, 'schedule', maximum=FULL_WEEK, default=0) if str(schedule or '0').strip().isdigit() else \
+            parse_schedule(str(schedule))
+        obj = self.model(vehicle_id=vehicle[0], companion_id=companion_id,
+                         effective_start_date=_date(row, 'effective_start_date', default=timezone.localdate()),
+                         expiry_date=_date(row, 'expiry_date'), is_active=is_active,
+                         fuel_share=_integer(row, 'fuel_share', maximum=100, default=0),
+                         maintenance_share=_integer(row, 'maintenance_share', maximum=100, default=0),
+                         schedule=schedule, **self.check_uuid(row, context))
+        if is_active:
+            # Later rows of the file see the seat as taken
+            vehicle[1] -= 1
+        return obj, shard_for_pk(vehicle[0]) if sharding_enabled() else None
+
+
+TABLES = {
+    'vehiclemodel': VehicleModelTable,
+    'vehicle': VehicleTable,
+    'userprofile': UserProfileTable,
+    'contract': ContractTable,
+}
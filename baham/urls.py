@@ -14,6 +14,10 @@ urlpatterns = [
     path('baham/vehicles/edit/<str:uuid>', views.edit_vehicle, name='editvehicle'),
     path('baham/vehicles/edit/update/', views.update_vehicle, name='updatedvehicle'),
     path('baham/aboutus', views.view_aboutus, name='aboutus'),
+
+    ### Media ###
+    path('media/<path:path>', views.serve_media, name='media'),
+    path('static/images/<path:path>', views.serve_vehicle_image, name='vehicle_image'),
     
     ### REST API ###
     path('api/csrftoken', views.get_csrf_token, name='get_csrf_token'),
@@ -22,4 +26,7 @@ urlpatterns = [
     path('api/create/vehiclemodel', views.create_vehicle_model, name='create_vehicle_model'),
     path('api/update/vehiclemodel/<str:uuid>', views.update_vehicle_model, name='update_vehicle_model'),
     path('api/delete/vehiclemodel/<str:uuid>', views.delete_vehicle_model, name='delete_vehicle_model'),
+    path('api/create/contract', views.create_contract, name='create_contract'),
+    path('api/get/nearby', views.get_nearby_profiles, name='get_nearby_profiles'),
+    path('api/changes', views.get_changes, name='get_changes'),
 ]
@@ -1,14 +1,44 @@
+import datetime
+import hashlib
 import json
-from django.http import HttpResponse, HttpResponseRedirect, HttpResponseBadRequest, JsonResponse, QueryDict
+import mimetypes
+import os
+import stat
+from functools import partial, wraps
+from pathlib import Path
+from uuid import UUID
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed, HttpResponseRedirect, \
+    HttpResponseBadRequest, JsonResponse, QueryDict, StreamingHttpResponse
 from django.template import loader
 from django.urls import reverse
 from django.contrib import auth
-from django.contrib.auth.models import User
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.utils.dateparse import parse_date
 from django.middleware.csrf import get_token
-
+from django.utils._os import safe_join
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.vary import vary_on_headers
+
+from baham.backends import find_user
+from baham.booking import BookingConflict, SeatUnavailable, book_seat
+from baham.catalog import aget_cached, get_catalog
 from baham.enum_types import VehicleStatus, VehicleType
-from baham.models import Vehicle, VehicleModel, validate_colour
+from baham.images import schedule_variants, store_upload
+from baham.locking import retry_on_locked
+from baham.media import BLOCK_SIZE, IMMUTABLE, REVALIDATE, FileRange, RangeNotSatisfiable, file_etag, is_hashed, \
+    parse_range
+from baham.models import UserProfile, Vehicle, VehicleModel, validate_colour
+from baham.pagination import MAX_PAGE_SIZE, apaginate, decode_cursor, paginate, paginate_shards, parse_limit
+from baham.schedules import parse as parse_schedule
+from baham.sharding import enabled as sharding_enabled, locate, scatter, shard_for_user, using_shard
+from baham.sync import changes_since
 
 
 # Create your views here.
@@ -33,14 +63,14 @@ def view_home(request):
 
 def login(request):
     _username = request.POST.get("username")
-    _username = _username.lower()
     _password = request.POST.get("password")
-    user = User.objects.filter(Q(username=_username) | Q(email=_username)).first()
-    if not user:
-        return render_login(request, message='User not found. Please check the username/email.')
-    if user.check_password(_password):
+    user = auth.authenticate(request, username=_username, password=_password)
+    if user:
         auth.login(request, user)
         return HttpResponseRedirect(reverse('home'))
+    # Unknown identifiers are negatively cached by the backend, so this costs no second query for them
+    if not find_user(_username):
+        return render_login(request, message='User not found. Please check the username/email.')
     return render_login(request, message='Invalid password!')
 
 
@@ -58,21 +88,41 @@ def view_aboutus(request):
     return HttpResponse(template.render(context, request))
 
 
+def vehicle_listing(seats=None):
+    '''
+    The vehicles view_vehicles() pages through: AVAILABLE ones, with at least seats free seats if given
+    '''
+    vehicles = Vehicle.objects.filter(status=VehicleStatus.AVAILABLE.name).select_related('model')
+    if seats:
+        vehicles = vehicles.filter(seats_free__gte=seats)
+    return vehicles
+
+
 def view_vehicles(request):
-    limit = 20
     template = loader.get_template('vehicles.html')
-    vehicles = Vehicle.objects.filter(Q(voided=0) & Q(status=VehicleStatus.AVAILABLE.name)).order_by('-date_created')[:limit]
+    seats = request.GET.get('seats')
+    if seats and not seats.isdigit():
+        return HttpResponseBadRequest('Invalid number of seats!')
+    vehicles = vehicle_listing(int(seats) if seats else None)
+    limit = parse_limit(request.GET.get('limit'))
+    try:
+        vehicles, next_cursor = paginate_shards(vehicles, request.GET.get('cursor'), limit)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid page cursor!')
     context = {
         'navbar': 'vehicles',
         'is_superuser': request.user.is_superuser,
-        'vehicles': vehicles
+        'vehicles': vehicles,
+        'next_cursor': next_cursor,
+        'limit': limit,
+        'seats': seats
     }
     return HttpResponse(template.render(context, request))
 
 
 def render_create_vehicle(request, message=None):
     template = loader.get_template('createvehicle.html')
-    models = VehicleModel.objects.filter(voided=0).order_by('vendor')
+    models = get_catalog()
     context = {
         'navbar': 'vehicles',
         'is_superuser': request.user.is_superuser,
@@ -88,9 +138,11 @@ def create_vehicle(request):
     return render_create_vehicle(request)
 
 
+@retry_on_locked
 def save_vehicle(request):
     _registration_number = request.POST.get('registration_number')
-    exists = Vehicle.objects.filter(registration_number=_registration_number)
+    # Registration numbers are unique across every town shard
+    exists = locate(Vehicle.all_objects.filter(registration_number=_registration_number).values('pk'))
     if exists:
         return render_create_vehicle(request, message="Another vehicle with this registration number already exists.")
     _model_uuid = request.POST.get('model_uuid')
@@ -102,14 +154,20 @@ def save_vehicle(request):
         return render_create_vehicle(request, message="Invalid colour code!")    
     _status = request.POST.get('status')
     print (_status)
-    _picture1 = request.FILES.get('image1')
-    _picture2 = request.FILES.get('image2')
+    # Pictures are stored by content hash here; resizing happens off the request on the image worker pool
+    try:
+        _picture1 = store_upload(request.FILES['image1']) if request.FILES.get('image1') else None
+        _picture2 = store_upload(request.FILES['image2']) if request.FILES.get('image2') else None
+    except ValueError:
+        return render_create_vehicle(request, message="Pictures must be JPEG, PNG, WebP or GIF images!")
     vehicle = Vehicle.objects.create(registration_number=_registration_number, colour=_colour, model=_model, 
                                      owner=request.user, status=_status, picture1=_picture1, picture2=_picture2)
-    vehicle.save()
+    for _picture in (_picture1, _picture2):
+        transaction.on_commit(partial(schedule_variants, _picture))
     return HttpResponseRedirect(reverse('vehicles'))
 
 
+@retry_on_locked
 def delete_vehicle(request, uuid):
     if not request.user.is_staff:
         return HttpResponseBadRequest('You are not authorized for this operation!')
@@ -134,6 +192,7 @@ def edit_vehicle(request, uuid):
     return HttpResponse(template.render(context, request))
 
 
+@retry_on_locked
 def update_vehicle(request):
     _uuid = request.POST.get('uuid')
     _vendor = request.POST.get('vendor')
@@ -151,9 +210,79 @@ def update_vehicle(request):
     vehicle_model.model = _model
     vehicle_model.type = _type
     vehicle_model.capacity = _capacity
-    vehicle_model.update(update_by=request.user)
+    vehicle_model.update(updated_by=request.user)
     return HttpResponseRedirect(reverse('vehicles'))
 
+#############
+### Media ###
+#############
+VEHICLE_IMAGES_ROOT = Path(__file__).resolve().parent / 'static' / 'images'
+
+
+def _with_headers(response, headers):
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def serve_file(request, path, document_root):
+    '''
+    Serve a file under document_root without reading it into memory: conditional requests against a strong
+    ETag, single byte ranges, and a year of immutable caching for content-hashed names
+    '''
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    try:
+        full_path = safe_join(document_root, path)
+        file_stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('File not found')
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404('File not found')
+    etag = file_etag(path, file_stat)
+    last_modified = int(file_stat.st_mtime)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': IMMUTABLE if is_hashed(path) else REVALIDATE,
+        'Accept-Ranges': 'bytes',
+    }
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return _with_headers(not_modified, headers)
+    size = file_stat.st_size
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    # A range applies only to the version of the file the client already has part of
+    if not if_range or if_range == etag or parse_http_date_safe(if_range) == last_modified:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except RangeNotSatisfiable:
+            response = _with_headers(HttpResponse(status=416), headers)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    file = open(full_path, 'rb')
+    if byte_range:
+        start, end = byte_range
+        file.seek(start)
+        response = FileResponse(FileRange(file, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    else:
+        response = FileResponse(file, content_type=content_type)
+    response.block_size = BLOCK_SIZE
+    return _with_headers(response, headers)
+
+
+def serve_media(request, path):
+    return serve_file(request, path, settings.MEDIA_ROOT)
+
+
+def serve_vehicle_image(request, path):
+    return serve_file(request, path, VEHICLE_IMAGES_ROOT)
+
+
 #############
 ### REST ####
 #############
@@ -162,27 +291,187 @@ def get_csrf_token(request):
     return JsonResponse({'csrf_token': csrf_token})
 
 
-def get_all_vehicle_models(request):
+def stream_vehicle_models(ndjson=False, chunk_size=2000):
+    '''
+    Yield the whole non-voided catalog as NDJSON lines or as one {"results": [...]} document,
+    encoding it one chunk of rows at a time so memory stays flat regardless of catalog size
+    '''
+    encoder = DjangoJSONEncoder()
+    rows = VehicleModel.objects.order_by('model_id').values(
+        'uuid', 'vendor', 'model', 'type', 'date_created', 'created_by__username').iterator(chunk_size=chunk_size)
+
+    def encoded_chunks():
+        buffer = []
+        for row in rows:
+            row['created_by'] = row.pop('created_by__username')
+            buffer.append(encoder.encode(row))
+            if len(buffer) == chunk_size:
+                yield buffer
+                buffer = []
+        if buffer:
+            yield buffer
+
+    if ndjson:
+        for chunk in encoded_chunks():
+            yield ''.join(line + '\n' for line in chunk)
+    else:
+        yield '{"results": ['
+        for i, chunk in enumerate(encoded_chunks()):
+            yield (', ' if i else '') + ', '.join(chunk)
+        yield ']}'
+
+
+async def astream_vehicle_models(ndjson=False, chunk_size=2000):
+    '''
+    Async version of stream_vehicle_models(), for ASGI servers
+    '''
+    encoder = DjangoJSONEncoder()
+    rows = VehicleModel.objects.order_by('model_id').values(
+        'uuid', 'vendor', 'model', 'type', 'date_created', 'created_by__username').aiterator(chunk_size=chunk_size)
+
+    async def encoded_chunks():
+        buffer = []
+        async for row in rows:
+            row['created_by'] = row.pop('created_by__username')
+            buffer.append(encoder.encode(row))
+            if len(buffer) == chunk_size:
+                yield buffer
+                buffer = []
+        if buffer:
+            yield buffer
+
+    if ndjson:
+        async for chunk in encoded_chunks():
+            yield ''.join(line + '\n' for line in chunk)
+    else:
+        yield '{"results": ['
+        separator = ''
+        async for chunk in encoded_chunks():
+            yield separator + ', '.join(chunk)
+            separator = ', '
+        yield ']}'
+
+
+async def vehicle_models_page(cursor, limit):
+    vehicle_models, next_cursor = await apaginate(VehicleModel.objects.select_related('created_by'), cursor, limit)
+    data = []
+    for model in vehicle_models:
+        data.append({
+            'uuid': model.uuid,
+            'vendor': model.vendor,
+            'model': model.model,
+            'type': model.type,
+            'date_created': model.date_created,
+            'created_by': str(model.created_by),
+        })
+    return data, next_cursor
+
+
+def _wants_ndjson(request):
+    return 'application/x-ndjson' in request.headers.get('Accept', '')
+
+
+def _parse_uuid(value):
+    '''
+    The UUID in a URL, or None if it is malformed, so the lookup can answer 404 rather than fail
+    '''
+    try:
+        return UUID(value)
+    except ValueError:
+        return None
+
+
+def _latest_change(*timestamps):
+    timestamps = [t for t in timestamps if t]
+    return max(timestamps) if timestamps else None
+
+
+def async_condition(validators):
+    '''
+    condition() for async views. validators is a coroutine function taking the view's arguments and returning
+    (etag, last_modified), so computing them does not block the event loop
+    '''
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            etag, last_modified = await validators(request, *args, **kwargs)
+            etag = quote_etag(etag) if etag else None
+            if last_modified:
+                if not timezone.is_aware(last_modified):
+                    last_modified = timezone.make_aware(last_modified, datetime.timezone.utc)
+                last_modified = int(last_modified.timestamp())
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                if last_modified and not response.has_header('Last-Modified'):
+                    response['Last-Modified'] = http_date(last_modified)
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
+
+
+async def vehicle_models_validators(request):
+    '''
+    ETag and Last-Modified of the catalog, from one aggregate query
+    '''
+    state = await VehicleModel.all_objects.aaggregate(last_created=Max('date_created'),
+                                                      last_updated=Max('date_updated'),
+                                                      last_voided=Max('date_voided'),
+                                                      active=Count('pk', filter=Q(voided=False)))
+    changes = (state['last_created'], state['last_updated'], state['last_voided'])
+    # The representation depends on the query string and on the negotiated format
+    key = f"{'|'.join(str(change) for change in changes)}|{state['active']}|" \
+          f"{request.GET.urlencode()}|{_wants_ndjson(request)}"
+    return hashlib.sha1(key.encode()).hexdigest(), _latest_change(*changes)
+
+
+async def vehicle_model_validators(request, uuid):
+    '''
+    ETag and Last-Modified of a single vehicle model, or (None, None) if it does not exist
+    '''
+    if not _parse_uuid(uuid):
+        return None, None
+    state = await VehicleModel.all_objects.filter(uuid=uuid).values_list(
+        'date_created', 'date_updated', 'date_voided', 'voided').afirst()
+    if not state:
+        return None, None
+    key = f"{uuid}|{'|'.join(str(value) for value in state)}"
+    return hashlib.sha1(key.encode()).hexdigest(), _latest_change(*state[:3])
+
+
+@async_condition(vehicle_models_validators)
+@vary_on_headers('Accept')
+async def get_all_vehicle_models(request):
     if request.method == 'GET':
-        vehicle_models = VehicleModel.objects.all()
-        data = []
-        for model in vehicle_models:
-            data.append({
-                'uuid': model.uuid,
-                'vendor': model.vendor,
-                'model': model.model,
-                'type': model.type,
-                'date_created': model.date_created,
-                'created_by': str(model.created_by),
-            })
-        return JsonResponse({'results': data})
+        ndjson = _wants_ndjson(request)
+        if ndjson or request.GET.get('stream') == '1':
+            content_type = 'application/x-ndjson' if ndjson else 'application/json'
+            # Each server type consumes the other kind of iterator by buffering all of it
+            stream = astream_vehicle_models if isinstance(request, ASGIRequest) else stream_vehicle_models
+            return StreamingHttpResponse(stream(ndjson), content_type=content_type)
+        cursor = request.GET.get('cursor')
+        limit = parse_limit(request.GET.get('limit'), default=100)
+        try:
+            if cursor:
+                decode_cursor(cursor)
+            data, next_cursor = await aget_cached(f'page:{cursor}:{limit}', lambda: vehicle_models_page(cursor, limit))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+        return JsonResponse({'results': data, 'next': next_cursor})
     else:
         return JsonResponse({'error': 'Invalid endpoint or method type'}, status=400)
 
 
-def get_vehicle_model(request, uuid):
+@async_condition(vehicle_model_validators)
+async def get_vehicle_model(request, uuid):
     if request.method == 'GET':
-        model = VehicleModel.objects.filter(uuid=uuid).first()
+        model = _parse_uuid(uuid) and await VehicleModel.all_objects.filter(uuid=uuid).select_related(
+            'created_by', 'updated_by', 'voided_by').afirst()
+        if not model:
+            return JsonResponse({'error': 'Vehicle model not found'}, status=404)
         data = {
             'uuid': model.uuid,
             'vendor': model.vendor,
@@ -203,13 +492,13 @@ def get_vehicle_model(request, uuid):
         return JsonResponse({'error': 'Invalid endpoint or method type'}, status=400)
 
 
-def create_vehicle_model(request):
+async def create_vehicle_model(request):
     if request.method == 'POST':
         _vendor = request.POST.get('vendor')
         _model = request.POST.get('model')
         _type = request.POST.get('type')
         _capacity = request.POST.get('capacity')
-        vehicle_model = VehicleModel.objects.create(vendor=_vendor, model=_model, type=_type, capacity=_capacity)
+        vehicle_model = await VehicleModel.objects.acreate(vendor=_vendor, model=_model, type=_type, capacity=_capacity)
         response_data = {
             'message': 'Vehicle model created successfully',
             'uuid': vehicle_model.uuid,
@@ -219,14 +508,14 @@ def create_vehicle_model(request):
         return JsonResponse({'error': 'Invalid endpoint or method type'}, status=400)
 
 
-def update_vehicle_model(request, uuid):
+async def update_vehicle_model(request, uuid):
     if request.method == 'PUT':
         params = QueryDict(request.body)
         _vendor = params.get('vendor')
         _model = params.get('model')
         _type = params.get('type')
         _capacity = params.get('capacity')
-        vehicle_model = VehicleModel.objects.filter(uuid=uuid).first()
+        vehicle_model = _parse_uuid(uuid) and await VehicleModel.objects.filter(uuid=uuid).afirst()
         if not vehicle_model:
             response_data = {
                 'error': 'Vehicle model not found',
@@ -236,7 +525,7 @@ def update_vehicle_model(request, uuid):
         vehicle_model.model = _model
         vehicle_model.type = _type
         vehicle_model.capacity = _capacity
-        vehicle_model.update()
+        await vehicle_model.aupdate()
         response_data = {
             'message': 'Vehicle model updated successfully',
             'uuid': vehicle_model.uuid,
@@ -246,18 +535,96 @@ def update_vehicle_model(request, uuid):
         return JsonResponse({'error': 'Invalid endpoint or method type'}, status=400)
 
 
-def delete_vehicle_model(request, uuid):
+async def delete_vehicle_model(request, uuid):
     if request.method == 'DELETE':
-        vehicle_model = VehicleModel.objects.filter(uuid=uuid).first()
+        vehicle_model = _parse_uuid(uuid) and await VehicleModel.objects.filter(uuid=uuid).afirst()
         if not vehicle_model:
             response_data = {
                 'error': 'Vehicle model not found',
             }
             return JsonResponse(response_data, status=404)
-        vehicle_model.delete()
+        await vehicle_model.adelete()
         response_data = {
             'message': 'Vehicle model voided successfully'
         }
         return JsonResponse(response_data, status=200)
     else:
         return JsonResponse({'error': 'Invalid endpoint or method type'}, status=400)
+
+
+def create_contract(request):
+    if request.method == 'POST':
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+        with using_shard(shard_for_user(request.user.pk)):
+            companion = UserProfile.objects.filter(user=request.user).first()
+        if not companion:
+            return JsonResponse({'error': 'Only users with a profile can book a seat'}, status=403)
+        vehicle = locate(Vehicle.objects.filter(uuid=request.POST.get('vehicle')).values('pk'))
+        if not vehicle:
+            return JsonResponse({'error': 'Vehicle not found'}, status=404)
+        try:
+            _expiry_date = parse_date(request.POST.get('expiry_date') or '')
+        except ValueError:
+            _expiry_date = None
+        if not _expiry_date:
+            return JsonResponse({'error': 'expiry_date must be a date (YYYY-MM-DD)'}, status=400)
+        try:
+            contract = book_seat(vehicle['pk'], companion, _expiry_date,
+                                 schedule=parse_schedule(request.POST.get('schedule')), created_by=request.user)
+        except SeatUnavailable:
+            return JsonResponse({'error': 'No free seat in this vehicle'}, status=409)
+        except BookingConflict:
+            return JsonResponse({'error': 'The vehicle is busy, please try again'}, status=409)
+        response_data = {
+            'message': 'Seat booked successfully',
+            'uuid': contract.uuid,
+        }
+        return JsonResponse(response_data, status=201)
+    else:
+        return JsonResponse({'error': 'Invalid endpoint or method type'}, status=400)
+
+
+def get_nearby_profiles(request):
+    if request.method == 'GET':
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+        try:
+            _latitude = float(request.GET.get('lat'))
+            _longitude = float(request.GET.get('lon'))
+            _radius = float(request.GET.get('radius', 2))
+        except (TypeError, ValueError):
+            return JsonResponse({'error': 'lat, lon and radius must be numbers'}, status=400)
+        if not -90 <= _latitude <= 90 or not -180 <= _longitude <= 180 or not 0 < _radius <= 50:
+            return JsonResponse({'error': 'Coordinates or radius out of range'}, status=400)
+        profiles = UserProfile.objects.filter(active=True).nearby(_latitude, _longitude, _radius)
+        if request.GET.get('type'):
+            profiles = profiles.filter(type=request.GET.get('type'))
+        # Users are not in the town shards, so they are fetched separately there
+        profiles = profiles.prefetch_related('user') if sharding_enabled() else profiles.select_related('user')
+        data = []
+        for profile in scatter(profiles, key=lambda profile: profile.distance_km,
+                               limit=parse_limit(request.GET.get('limit'), default=100)):
+            data.append({
+                'uuid': profile.uuid,
+                'username': profile.user.username,
+                'type': profile.type,
+                'town': profile.town,
+                'landmark': profile.landmark,
+                'distance_km': round(profile.distance_km, 3),
+            })
+        return JsonResponse({'results': data})
+    else:
+        return JsonResponse({'error': 'Invalid endpoint or method type'}, status=400)
+
+
+def get_changes(request):
+    if request.method == 'GET':
+        try:
+            changes = changes_since(request.GET.get('since'),
+                                    parse_limit(request.GET.get('limit'), default=MAX_PAGE_SIZE))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid sync token'}, status=400)
+        return JsonResponse(changes)
+    else:
+        return JsonResponse({'error': 'Invalid endpoint or method type'}, status=400)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'baham.middleware.ReadYourWritesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -78,9 +80,129 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file rather than memory, so threaded tests get connections of their own and SQLite's real locking
+        'TEST': {'NAME': BASE_DIR / 'db-test.sqlite3'},
     }
 }
 
+# Production profile, enabled with BAHAM_DB_PROFILE=production. The pragmas run on every new connection:
+# WAL lets readers carry on while a write commits, and with synchronous=NORMAL a power loss can only lose
+# the last commits, never corrupt the file. Connections are kept across requests, and write transactions take
+# the lock when they begin (BEGIN IMMEDIATE) instead of failing when a read upgrades to a write
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,       # KiB per connection
+    'mmap_size': 268435456,
+    'busy_timeout': 5000,       # ms
+    'temp_store': 'MEMORY',
+}
+SQLITE_PRODUCTION = {
+    'CONN_MAX_AGE': 600,
+    'CONN_HEALTH_CHECKS': True,
+    'OPTIONS': {
+        'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+        'transaction_mode': 'IMMEDIATE',
+    },
+}
+DATABASE_PROFILE = os.environ.get('BAHAM_DB_PROFILE', 'default')
+if DATABASE_PROFILE == 'production':
+    DATABASES['default'].update(SQLITE_PRODUCTION)
+
+# Read replicas. Requests read from one of DATABASE_REPLICAS and write to 'default' (baham.routers); a client
+# reads from 'default' for REPLICA_LAG seconds after a write so it sees its own changes. BAHAM_DB_REPLICA=1
+# adds a local replica, a second SQLite file refreshed from db.sqlite3 by `manage.py sync_replica --interval 2`
+
+DATABASE_REPLICAS = []
+if os.environ.get('BAHAM_DB_REPLICA'):
+    DATABASES['replica'] = dict(DATABASES['default'], NAME=BASE_DIR / 'db-replica.sqlite3',
+                                TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append('replica')
+REPLICA_LAG = 5
+
+# Town shards, enabled with BAHAM_TOWN_SHARDS=1. Profiles, vehicles, routes and contracts live in the database
+# of their town's group (baham.sharding); users, sessions and the rest stay in 'default', along with the rows
+# of people without a profile. `manage.py shard_towns` creates the shards and moves existing rows into them.
+# Neighbouring towns share a group, since matching rarely leaves a town and its neighbours
+
+TOWN_GROUPS = {
+    'town_east': ['Bin Qasim', 'Landhi', 'Korangi', 'Malir'],
+    'town_central': ['Gulshan-e-Iqbal', 'Shah Faisal', 'Jamshed', 'Liaquatabad'],
+    'town_north': ['Gulberg', 'New Karachi', 'North Nazimabad', 'Gadap'],
+    'town_west': ['Orangi', 'SITE', 'Keamari', 'Saddar'],
+}
+TOWN_SHARDS = {}
+if os.environ.get('BAHAM_TOWN_SHARDS'):
+    # Rows in one database refer to rows in another, so the shards' SQLite backend leaves foreign keys unchecked
+    DATABASES['default']['ENGINE'] = 'baham.shard_backend'
+    for alias in TOWN_GROUPS:
+        DATABASES[alias] = dict(DATABASES['default'], NAME=BASE_DIR / f'db-{alias}.sqlite3',
+                                TEST={'NAME': BASE_DIR / f'db-test-{alias}.sqlite3'})
+    TOWN_SHARDS = TOWN_GROUPS
+DATABASE_ROUTERS = ['baham.routers.TownShardRouter', 'baham.routers.PrimaryReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Local memory is per process, so anything one worker must see another change lives in a shared file cache
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'baham',
+    },
+    # Vehicle-model catalog (baham.catalog). A version bump in one worker must make every worker rebuild, so
+    # the shared file cache is the default; BAHAM_CATALOG_CACHE=locmem is only safe with a single server process
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'baham-catalog',
+    } if os.environ.get('BAHAM_CATALOG_CACHE') == 'locmem' else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'catalog',
+    },
+    # Front of the cached_db session tier. A logout must reach every worker, so the shared file cache is the
+    # default; BAHAM_SESSION_CACHE=locmem is only safe with a single server process
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'baham-sessions',
+    } if os.environ.get('BAHAM_SESSION_CACHE') == 'locmem' else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'sessions',
+    },
+    # Sign-in identifiers that matched no user (baham.backends). A user created through one worker must be able
+    # to sign in through every other at once, so the shared file cache is the default; BAHAM_LOGIN_CACHE=locmem
+    # is only safe with a single server process
+    'logins': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'baham-logins',
+    } if os.environ.get('BAHAM_LOGIN_CACHE') == 'locmem' else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'logins',
+    },
+}
+
+
+# Sessions
+# https://docs.djangoproject.com/en/4.1/topics/http/sessions/
+# Chosen with BAHAM_SESSION_TIER:
+#   db              every request reads django_session
+#   cached_db       reads come from the 'sessions' cache, writes go through to django_session (default)
+#   signed_cookies  the session lives in a signed client cookie and never touches the database; it cannot be
+#                   revoked server-side before it expires, and its content is readable by the client
+
+SESSION_TIER = os.environ.get('BAHAM_SESSION_TIER', 'cached_db')
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}[SESSION_TIER]
+SESSION_CACHE_ALIAS = 'sessions'
+
+
+# Users sign in with their username or email, case-insensitively
+AUTHENTICATION_BACKENDS = ['baham.backends.UsernameOrEmailBackend']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -119,6 +241,8 @@ USE_TZ = True
 STATIC_URL = 'static/'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Threads resizing uploaded pictures in the background, see baham.images
+IMAGE_WORKERS = 2
 
 
 # Default primary key field type
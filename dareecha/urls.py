@@ -14,12 +14,10 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.conf.urls.static import static
 from django.urls import path, include
 
-from dareecha.settings import MEDIA_URL, MEDIA_ROOT
-
+# Media files are served by baham.views.serve_media, with range and cache support
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('baham.urls'))
-] + static(MEDIA_URL, document_root=MEDIA_ROOT)
+]